@@ -0,0 +1,12 @@
+'''
+Benchmarks for the data preparation scripts.
+
+synthetic builds COCO datasets of a chosen size, stages times each step of
+the pipeline on one, and run ties them together and compares the timings
+against a stored baseline:
+
+    python -m benchmarks.run --images 500 --output results.json
+    python -m benchmarks.run --images 500 --baseline results.json
+
+json_backends compares the JSON backends on existing annotation files.
+'''
@@ -0,0 +1,65 @@
+'''
+Compare the JSON backends of json_works.json_io on real annotation files.
+
+    python benchmarks/json_backends.py path/to/instances_default.json [...]
+
+For every file and backend: load time, compact and indent=2 save time and
+size, plus the time to stream every record with iter_top_level.
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import json_io
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_file(file_path, repeat):
+    results = []
+    size_mb = os.path.getsize(file_path) / 1e6
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, 'out.json')
+        for backend in json_io.BACKENDS:
+            data = json_io.load_json(file_path, backend=backend)
+            row = {'file': os.path.basename(file_path), 'size_mb': size_mb, 'backend': backend}
+            row['load_s'] = best_of(lambda: json_io.load_json(file_path, backend=backend), repeat)
+            row['save_compact_s'] = best_of(lambda: json_io.save_json(data, out_path, backend=backend), repeat)
+            row['compact_mb'] = os.path.getsize(out_path) / 1e6
+            row['save_indent_s'] = best_of(lambda: json_io.save_json(data, out_path, indent=2, backend=backend), repeat)
+            row['indent_mb'] = os.path.getsize(out_path) / 1e6
+            results.append(row)
+    stream_s = best_of(lambda: sum(1 for _ in json_io.iter_top_level(file_path)), repeat)
+    results.append({'file': os.path.basename(file_path), 'size_mb': size_mb, 'backend': 'stream', 'load_s': stream_s})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="COCO JSON files to benchmark")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'file':<32} {'MB':>8} {'backend':<8} {'load s':>8} {'save s':>8} {'MB':>8} {'indent s':>9} {'MB':>8}")
+    for file_path in args.files:
+        for row in bench_file(file_path, args.repeat):
+            line = f"{row['file']:<32} {row['size_mb']:>8.1f} {row['backend']:<8} {row['load_s']:>8.3f}"
+            if 'save_compact_s' in row:
+                line += (f" {row['save_compact_s']:>8.3f} {row['compact_mb']:>8.1f}"
+                         f" {row['save_indent_s']:>9.3f} {row['indent_mb']:>8.1f}")
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''
+Run the stage benchmarks on a synthetic dataset and write the timings as JSON.
+
+    python -m benchmarks.run --images 500 --annotations 8 --vertices 64 --output results.json
+    python -m benchmarks.run --images 500 --annotations 8 --vertices 64 --baseline results.json
+
+With --baseline, each stage is compared to the stored run and the exit status
+is 1 when any stage is slower than the baseline by more than --tolerance.
+Stages that take less than 10 ms in both runs are not flagged (timer noise).
+'''
+
+import argparse
+import contextlib
+import io
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from json_works import json_io
+from .stages import STAGES, StageContext
+from .synthetic import write_dataset
+
+MIN_FLAGGED_SECONDS = 0.01
+
+
+def time_stage(stage, ctx, root, repeat, verbose=False):
+    runs = []
+    items = 0
+    for i in range(repeat):
+        work_dir = os.path.join(root, f'run_{i}')
+        os.makedirs(work_dir)
+        # The scripts print per image; keep that out of the benchmark output
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            start = time.perf_counter()
+            items = stage(ctx, work_dir)
+            runs.append(time.perf_counter() - start)
+        shutil.rmtree(work_dir)
+    seconds = min(runs)
+    return {'seconds': seconds, 'runs': runs, 'items': items, 'items_per_s': items / seconds if seconds else None}
+
+
+def environment():
+    import numpy as np
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'json_backend': json_io.get_backend(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    '''(stage, baseline seconds, seconds, ratio, regressed) for every stage in both runs.'''
+    rows = []
+    for name, stage in results['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if base is None:
+            continue
+        ratio = stage['seconds'] / base['seconds'] if base['seconds'] else float('inf')
+        noise = max(base['seconds'], stage['seconds']) < MIN_FLAGGED_SECONDS
+        rows.append((name, base['seconds'], stage['seconds'], ratio, ratio > 1 + tolerance and not noise))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--annotations', type=int, default=5, help="annotations per image")
+    parser.add_argument('--vertices', type=int, default=32, help="vertices per polygon")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma-separated subset of " + ', '.join(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--copy-mode', default='hardlink')
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument('--verbose', action='store_true', help="keep the scripts' own output")
+    args = parser.parse_args(argv)
+
+    stage_names = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = [name for name in stage_names if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    params = {'images': args.images, 'annotations_per_image': args.annotations, 'vertices': args.vertices,
+              'width': args.width, 'height': args.height, 'seed': args.seed, 'workers': args.workers, 'copy_mode': args.copy_mode}
+    results = {'params': params, 'repeat': args.repeat, 'environment': environment(), 'stages': {}}
+
+    with tempfile.TemporaryDirectory(prefix='json_works_bench_') as root:
+        print(f"Generating {args.images} images x {args.annotations} annotations x {args.vertices} vertices...")
+        data, annotation_path, images_dir = write_dataset(
+            os.path.join(root, 'dataset'), args.images, args.annotations, args.vertices, args.width, args.height,
+            seed=args.seed)
+        ctx = StageContext(data, annotation_path, images_dir, workers=args.workers, copy_mode=args.copy_mode)
+        for name in stage_names:
+            stage = time_stage(STAGES[name], ctx, root, args.repeat, args.verbose)
+            results['stages'][name] = stage
+            print(f"{name:<10} {stage['seconds']:>9.3f} s {stage['items_per_s']:>12.1f} items/s")
+
+    if args.output:
+        json_io.save_json(results, args.output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        baseline = json_io.load_json(args.baseline)
+        if baseline.get('params') != params:
+            print("Warning: baseline was run with different parameters")
+        regressed = False
+        print(f"{'stage':<10} {'baseline s':>11} {'now s':>9} {'ratio':>7}")
+        for name, base_seconds, seconds, ratio, slower in compare(results, baseline, args.tolerance):
+            print(f"{name:<10} {base_seconds:>11.3f} {seconds:>9.3f} {ratio:>7.2f}{'  REGRESSION' if slower else ''}")
+            regressed = regressed or slower
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Timed stages. Each stage takes the shared context and a fresh, empty work
+directory and returns the number of items it processed; only the call itself
+is timed. The pointrend and fasterrcnn scripts are imported as modules so the
+stages run the same code the scripts do; they are imported here so import
+time is not charged to the first stage that uses them.
+'''
+
+import os
+import sys
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_root, 'pointrend'))
+sys.path.insert(0, os.path.join(_root, 'fasterrcnn'))
+
+import augment
+import plot_json
+import train_val_split
+from json_works.columnar import load_coco
+from json_works.merge import merge_coco
+
+
+class StageContext:
+    def __init__(self, data, annotation_path, images_dir, workers=None, copy_mode='hardlink', merge_sources=3):
+        self.data = data
+        self.annotation_path = annotation_path
+        self.images_dir = images_dir
+        self.workers = workers
+        self.copy_mode = copy_mode
+        self.merge_sources = merge_sources
+
+
+def stage_load(ctx, work_dir):
+    data = load_coco(ctx.annotation_path)
+    return len(data['annotations'])
+
+
+def stage_merge(ctx, work_dir):
+    # The same file merged several times, as json_combo does for the per-folder exports
+    sources = [ctx.annotation_path] * ctx.merge_sources
+    merge_coco(sources, os.path.join(work_dir, 'merged.json'))
+    return len(ctx.data['annotations']) * ctx.merge_sources
+
+
+def stage_split(ctx, work_dir):
+    train_data, val_data = train_val_split.split_dataset(ctx.data, 0.8)
+    return len(train_data['images']) + len(val_data['images'])
+
+
+def stage_copy(ctx, work_dir):
+    train_val_split.copy_images(ctx.data, ctx.images_dir, work_dir, mode=ctx.copy_mode)
+    return len(ctx.data['images'])
+
+
+def stage_augment(ctx, work_dir):
+    augment.augment_dataset(ctx.images_dir, ctx.annotation_path, work_dir, 'train', workers=ctx.workers)
+    return len(ctx.data['images'])
+
+
+def stage_render(ctx, work_dir):
+    augment.plot_annotations(ctx.data, ctx.images_dir, work_dir, workers=ctx.workers, use_cache=False)
+    return len(ctx.data['images'])
+
+
+def stage_render_boxes(ctx, work_dir):
+    plot_json.plot_boxes_on_images(ctx.annotation_path, ctx.images_dir, work_dir, workers=ctx.workers, use_cache=False)
+    return len(ctx.data['images'])
+
+
+STAGES = {
+    'load': stage_load,
+    'merge': stage_merge,
+    'split': stage_split,
+    'copy': stage_copy,
+    'augment': stage_augment,
+    'render': stage_render,
+    'render_boxes': stage_render_boxes,
+}
@@ -0,0 +1,77 @@
+'''
+Synthetic COCO datasets for benchmarking.
+
+Images are smooth gradients with noise (so JPEG sizes are realistic) and
+every annotation is a jittered star-shaped polygon with the requested number
+of vertices, fully inside its image, with bbox and area computed from it.
+'''
+
+import os
+
+import cv2
+import numpy as np
+
+from json_works import json_io
+from json_works.geometry import polygon_area, segmentation_bbox
+
+
+def synthetic_polygon(rng, vertices, width, height):
+    radius = rng.uniform(0.05, 0.2) * min(width, height)
+    cx = rng.uniform(radius, width - radius)
+    cy = rng.uniform(radius, height - radius)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, vertices))
+    radii = radius * rng.uniform(0.6, 1.0, vertices)
+    xy = np.stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)], axis=1)
+    return np.round(xy, 2).ravel().tolist()
+
+
+def synthetic_coco(num_images=100, annotations_per_image=5, vertices=32, width=640, height=480, num_categories=3,
+                   seed=0):
+    rng = np.random.default_rng(seed)
+    data = {
+        'info': {'description': 'synthetic benchmark dataset'},
+        'licenses': [],
+        'images': [],
+        'annotations': [],
+        'categories': [{'id': i + 1, 'name': f'category_{i + 1}', 'supercategory': ''} for i in range(num_categories)],
+    }
+    annotation_id = 1
+    for image_id in range(1, num_images + 1):
+        data['images'].append({'id': image_id, 'width': width, 'height': height, 'file_name': f'{image_id:06d}.jpg'})
+        for _ in range(annotations_per_image):
+            polygon = synthetic_polygon(rng, vertices, width, height)
+            data['annotations'].append({
+                'id': annotation_id,
+                'image_id': image_id,
+                'category_id': int(rng.integers(1, num_categories + 1)),
+                'segmentation': [polygon],
+                'area': float(polygon_area(polygon)),
+                'bbox': segmentation_bbox([polygon]),
+                'iscrowd': 0,
+            })
+            annotation_id += 1
+    return data
+
+
+def synthetic_image(rng, width, height):
+    gradient = np.add.outer(np.linspace(0, 128, height), np.linspace(0, 96, width))
+    image = gradient[:, :, None] + rng.normal(0, 12, (height, width, 3)) + rng.uniform(0, 32, 3)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def write_dataset(output_dir, num_images=100, annotations_per_image=5, vertices=32, width=640, height=480,
+                  num_categories=3, seed=0, write_images=True):
+    '''
+    Write output_dir/images/*.jpg and output_dir/instances_default.json.
+    Returns (COCO dict, annotation path, images dir).
+    '''
+    data = synthetic_coco(num_images, annotations_per_image, vertices, width, height, num_categories, seed)
+    images_dir = os.path.join(output_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    if write_images:
+        rng = np.random.default_rng(seed + 1)
+        for img in data['images']:
+            cv2.imwrite(os.path.join(images_dir, img['file_name']), synthetic_image(rng, width, height))
+    annotation_path = os.path.join(output_dir, 'instances_default.json')
+    json_io.save_json(data, annotation_path)
+    return data, annotation_path, images_dir
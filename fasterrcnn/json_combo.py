@@ -1,9 +1,19 @@
 import os
-import json
-import shutil
-import cv2
-import numpy as np
-from tqdm import tqdm
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import CocoIndex, json_io
+from json_works.columnar import load_coco
+from json_works.dedup import DedupIndex
+from json_works.geometry import denormalize_bboxes, is_normalized, normalize_bboxes
+from json_works.instrument import logger, setup_logging, stage, write_report
+from json_works.journal import Journal
+from json_works.partition import write_partial
+from json_works.json_io import CocoStreamWriter
+from json_works.materialize import materialize_files
+from json_works.merge import CocoMerger
+from json_works.pipeline import ImageJob, imread, run_pipeline
+from json_works.render import render_images, report_failures
 
 def create_directory_structure(base_dir):
     os.makedirs(base_dir, exist_ok=True)
@@ -15,150 +25,168 @@ def create_directory_structure(base_dir):
     os.makedirs(os.path.join("annotation_check", "val"), exist_ok=True)
 
 def read_json(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
-
-def update_ids(data, start_id):
-    new_images = []
-    new_annotations = []
-    image_id_map = {}
-    
-    print(f"Updating IDs. Starting ID: {start_id}")
-    print(f"Original image count: {len(data['images'])}")
-    print(f"Original annotation count: {len(data['annotations'])}")
-
-    for image in data['images']:
-        new_image_id = start_id
-        image_id_map[image['id']] = new_image_id
-        image['id'] = new_image_id
-        new_images.append(image)
-        start_id += 1
-
-    for annotation in data['annotations']:
-        new_annotation_id = start_id
-        if annotation['image_id'] in image_id_map:
-            annotation['id'] = new_annotation_id
-            annotation['image_id'] = image_id_map[annotation['image_id']]
-            new_annotations.append(annotation)
-            start_id += 1
-        else:
-            print(f"Warning: annotation {annotation['id']} refers to non-existent image {annotation['image_id']}")
-
-    print(f"Updated image count: {len(new_images)}")
-    print(f"Updated annotation count: {len(new_annotations)}")
-    print(f"New starting ID: {start_id}")
-
-    data['images'] = new_images
-    data['annotations'] = new_annotations
-    return data, start_id
+    # Also loads columnar stores (.npz or directory) written by json_works.columnar
+    return load_coco(file_path)
 
 def save_json(data, file_path):
-    with open(file_path, 'w') as file:
-        json.dump(data, file)
-
-def copy_images(source_dir, dest_dir):
-    images = os.listdir(source_dir)
-    for image in images:
-        shutil.copy(os.path.join(source_dir, image), os.path.join(dest_dir, image))
+    json_io.save_json(data, file_path)
+
+def copy_images(source_dir, dest_dir, mode='hardlink', workers=8, resume=True, partition=None):
+    # Only file names are known here, so a sharded worker takes the files whose name hashes into its shard
+    images = [image for image in os.listdir(source_dir) if partition is None or partition.owns(image)]
+    pairs = [(os.path.join(source_dir, image), os.path.join(dest_dir, image)) for image in images]
+    # Finished copies are journaled next to dest_dir so an interrupted copy picks up where it stopped
+    split_folder = os.path.dirname(os.path.abspath(dest_dir))
+    suffix = f'-{partition.suffix}' if partition is not None else ''
+    journal = Journal(os.path.join(split_folder, f'.copy{suffix}.journal'),
+                      settings={'mode': mode}) if resume else None
+    try:
+        stats = materialize_files(pairs, mode=mode, workers=workers, desc=f"Copying images to {dest_dir}",
+                                  journal=journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    logger.info(stats)
+    if partition is not None:
+        write_partial(split_folder, 'copy', partition, items=len(pairs), outputs=[dst for _, dst in pairs])
+    return stats
 
 def normalize_bbox(bbox, img_width, img_height):
-    x, y, w, h = bbox
-    return [x/img_width, y/img_height, w/img_width, h/img_height]
+    return normalize_bboxes(bbox, img_width, img_height)[0].tolist()
 
 def denormalize_bbox(bbox, img_width, img_height):
-    x, y, w, h = bbox
-    return [int(x*img_width), int(y*img_height), int(w*img_width), int(h*img_height)]
+    return denormalize_bboxes(bbox, img_width, img_height)[0].astype(int).tolist()
 
-def plot_annotations(image_dir, json_data, save_dir):
-    print(f"Plotting annotations for {len(json_data['images'])} images")
-    for img_data in tqdm(json_data['images']):
+def plot_image_annotations(img_path, annotations, save_path, img_data, normalized=False):
+    import cv2
+    import numpy as np
+
+    # img_path may also be the in-memory image handed over by run_pipeline
+    img = imread(img_path)
+    if img is None:
+        raise FileNotFoundError(f"Could not read image {img_path}")
+    logger.debug("Image %s has %d annotations", img_data['file_name'], len(annotations))
+    
+    bboxes = np.array([ann['bbox'] for ann in annotations], dtype=np.float64).reshape(-1, 4)
+    # Denormalize all boxes of the image at once if the dataset is normalized
+    if normalized:
+        bboxes = denormalize_bboxes(bboxes, img_data['width'], img_data['height'])
+    
+    for x, y, w, h in bboxes.astype(int).tolist():
+        cv2.rectangle(img, (x, y), (x+w, y+h), (0, 0, 255), 2)
+    
+    cv2.imwrite(save_path, img)
+
+def plot_annotations(image_dir, json_data, save_dir, workers=None):
+    logger.info("Plotting annotations for %d images", len(json_data['images']))
+    index = CocoIndex(json_data)
+    normalized = is_normalized([ann['bbox'] for ann in json_data['annotations']])
+    if normalized:
+        logger.info("Bounding boxes are normalized, denormalizing with image sizes")
+    tasks = []
+    for img_data in json_data['images']:
         img_path = os.path.join(image_dir, img_data['file_name'])
-        img = cv2.imread(img_path)
-        
-        annotations = [ann for ann in json_data['annotations'] if ann['image_id'] == img_data['id']]
-        print(f"Image {img_data['file_name']} has {len(annotations)} annotations")
-        
-        for ann in annotations:
-            bbox = ann['bbox']
-            print(f"Original bbox: {bbox}")
-            
-            # Denormalize if necessary
-            if max(bbox) <= 1:
-                bbox = denormalize_bbox(bbox, img_data['width'], img_data['height'])
-                print(f"Denormalized bbox: {bbox}")
-            
-            x, y, w, h = [int(v) for v in bbox]
-            cv2.rectangle(img, (x, y), (x+w, y+h), (0, 0, 255), 2)
-        
         save_path = os.path.join(save_dir, img_data['file_name'])
-        cv2.imwrite(save_path, img)
-
-def combine_data(data1, data2):
-    combined_data = {
-        "info": data1['info'],
-        "licenses": data1['licenses'],
-        "images": data1['images'] + data2['images'],
-        "annotations": data1['annotations'] + data2['annotations'],
-        "categories": data1['categories']
-    }
-    
-    print(f"Combined data: {len(combined_data['images'])} images, {len(combined_data['annotations'])} annotations")
-    return combined_data
-
-def main(folder1, folder2):
+        tasks.append((img_path, index.annotations_for(img_data['id']), save_path, img_data, normalized))
+    report_failures(render_images(plot_image_annotations, tasks, workers=workers))
+
+def copy_and_plot_split(folders, split, split_data, split_dir, save_dir, mode='hardlink', workers=None, placements=None):
+    # Every source image is read once, linked or written into the combined split
+    # and rendered from memory, instead of copying first and reading the copy back
+    index = CocoIndex(split_data)
+    normalized = is_normalized([ann['bbox'] for ann in split_data['annotations']])
+    if normalized:
+        logger.info("Bounding boxes are normalized, denormalizing with image sizes")
+    images_by_name = {img_data['file_name']: img_data for img_data in split_data['images']}
+
+    if placements is not None:
+        # Deduplicated merge: one source file per stored image name
+        sources = placements
+    else:
+        sources = {}
+        for folder in folders:
+            source_dir = os.path.join(folder, split, 'images')
+            for image in os.listdir(source_dir):
+                sources[image] = os.path.join(source_dir, image)  # later folders win, as with sequential copies
+
+    jobs = []
+    for image, source in sources.items():
+        job = ImageJob(source, [os.path.join(split_dir, "images", image)])
+        img_data = images_by_name.get(image)
+        if img_data is not None:
+            job.render_args = (index.annotations_for(img_data['id']), os.path.join(save_dir, image), img_data, normalized)
+        jobs.append(job)
+    for image in images_by_name.keys() - sources.keys():
+        logger.warning("Image not found: %s", image)
+
+    stats, failures = run_pipeline(jobs, plot_image_annotations, mode=mode, renderers=workers,
+                                   desc=f"Copying and plotting {split} images")
+    logger.info(stats)
+    report_failures(failures, action="copy or plot")
+    return stats
+
+def merge_split(folders, split, output_path, start_id, dedup=None):
+    # Streams every folder's split JSON into output_path; ids come from one
+    # shared counter so they stay unique across images, annotations and splits.
+    # With a DedupIndex, byte-identical images are stored once and clashing
+    # names are prefixed; returns the stored name -> source file placements.
+    # The merged records are kept as they are written, for copying and plotting
+    # without reading output_path back.
+    placements = {} if dedup is not None else None
+    merged = {'images': [], 'annotations': []}
+
+    def collect(kind, record, merged_record):
+        if merged_record is not None:
+            merged[f'{kind}s'].append(merged_record)
+
+    with CocoStreamWriter(output_path) as writer:
+        merger = CocoMerger(writer, start_id, shared_counter=True)
+        for folder in folders:
+            resolver = dedup.source(os.path.join(folder, split, 'images'), folder) if dedup is not None else None
+            merger.add(os.path.join(folder, split, f'{split}_split.json'), resolver=resolver, on_record=collect)
+            if resolver is not None:
+                placements.update(resolver.placements)
+    logger.info("Combined %s data: %s images, %s annotations", split, writer.counts['images'], writer.counts['annotations'])
+    return merger.next_image_id, placements, merged
+
+def main(*folders, dedup_policy='remap'):
+    setup_logging()
     combined_data_dir = "combined_data"
     annotation_check_dir = "annotation_check"
-    train_dir = os.path.join(combined_data_dir, "train")
-    test_dir = os.path.join(combined_data_dir, "test")
-    val_dir = os.path.join(combined_data_dir, "val")
+    splits = ("train", "test", "val")
 
     create_directory_structure(combined_data_dir)
 
-    train_data1 = read_json(os.path.join(folder1, 'train', 'train_split.json'))
-    test_data1 = read_json(os.path.join(folder1, 'test', 'test_split.json'))
-    val_data1 = read_json(os.path.join(folder1, 'val', 'val_split.json'))
-
-    train_data2 = read_json(os.path.join(folder2, 'train', 'train_split.json'))
-    test_data2 = read_json(os.path.join(folder2, 'test', 'test_split.json'))
-    val_data2 = read_json(os.path.join(folder2, 'val', 'val_split.json'))
-
+    dedup = DedupIndex(combined_data_dir, policy=dedup_policy) if dedup_policy else None
     start_id = 1
-    print("Updating IDs for folder1 data")
-    train_data1, start_id = update_ids(train_data1, start_id)
-    test_data1, start_id = update_ids(test_data1, start_id)
-    val_data1, start_id = update_ids(val_data1, start_id)
-
-    print("\nUpdating IDs for folder2 data")
-    train_data2, start_id = update_ids(train_data2, start_id)
-    test_data2, start_id = update_ids(test_data2, start_id)
-    val_data2, start_id = update_ids(val_data2, start_id)
-
-    print("\nCombining data")
-    combined_train_data = combine_data(train_data1, train_data2)
-    combined_test_data = combine_data(test_data1, test_data2)
-    combined_val_data = combine_data(val_data1, val_data2)
-
-    save_json(combined_train_data, os.path.join(train_dir, "train_split.json"))
-    save_json(combined_test_data, os.path.join(test_dir, "test_split.json"))
-    save_json(combined_val_data, os.path.join(val_dir, "val_split.json"))
-
-    copy_images(os.path.join(folder1, 'train', 'images'), os.path.join(train_dir, "images"))
-    copy_images(os.path.join(folder2, 'train', 'images'), os.path.join(train_dir, "images"))
-    copy_images(os.path.join(folder1, 'test', 'images'), os.path.join(test_dir, "images"))
-    copy_images(os.path.join(folder2, 'test', 'images'), os.path.join(test_dir, "images"))
-    copy_images(os.path.join(folder1, 'val', 'images'), os.path.join(val_dir, "images"))
-    copy_images(os.path.join(folder2, 'val', 'images'), os.path.join(val_dir, "images"))
-
-    print("\nPlotting annotations for training data")
-    plot_annotations(os.path.join(train_dir, "images"), combined_train_data, os.path.join(annotation_check_dir, "train"))
-    print("\nPlotting annotations for test data")
-    plot_annotations(os.path.join(test_dir, "images"), combined_test_data, os.path.join(annotation_check_dir, "test"))
-    print("\nPlotting annotations for validation data")
-    plot_annotations(os.path.join(val_dir, "images"), combined_val_data, os.path.join(annotation_check_dir, "val"))
-
-    print("Data combination and annotation plotting complete.")
-
-# Example usage
-folder1 = '/home/frinksserver/Deepak/OCR/datasets/skh/skh_ocr_fasterrcnn/split_june4'
-folder2 = '/home/frinksserver/Deepak/OCR/data_preparation/fasterrcnn_ocr_dataprep/split'
-main(folder1, folder2)
\ No newline at end of file
+    placements, merged = {}, {}
+    for split in splits:
+        logger.info("Merging %s data from %d folders", split, len(folders))
+        split_json = os.path.join(combined_data_dir, split, f"{split}_split.json")
+        if dedup is not None:
+            # Duplicates are only merged within a split; ids never point into another split
+            dedup.retain(())
+        with stage(f"merge_{split}"):
+            start_id, placements[split], merged[split] = merge_split(folders, split, split_json, start_id, dedup)
+    if dedup is not None:
+        dedup.save()
+        logger.info(dedup)
+        save_json(dedup.report(), os.path.join(combined_data_dir, "dedup_report.json"))
+
+    for split in splits:
+        logger.info("Copying images and plotting annotations for %s data", split)
+        split_dir = os.path.join(combined_data_dir, split)
+        with stage(f"copy_plot_{split}") as s:
+            stats = copy_and_plot_split(folders, split, merged.pop(split), split_dir, os.path.join(annotation_check_dir, split),
+                                        placements=placements[split])
+            s.items = sum(stats.files.values())
+            s.bytes = stats.bytes_written + stats.bytes_avoided
+
+    logger.info("Data combination and annotation plotting complete.")
+    write_report(os.path.join(combined_data_dir, "run_report.json"))
+
+if __name__ == "__main__":
+    # Example usage
+    folder1 = '/home/frinksserver/Deepak/OCR/datasets/skh/skh_ocr_fasterrcnn/split_june4'
+    folder2 = '/home/frinksserver/Deepak/OCR/data_preparation/fasterrcnn_ocr_dataprep/split'
+    main(folder1, folder2)
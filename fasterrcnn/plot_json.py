@@ -7,61 +7,74 @@ out:
     output_dir = "/home/frinksserver/subhra/paddleOCR_data_preparation/split_det_text/train_plot_json"
 '''
 
-import json
 import os
+import sys
 import cv2
-from tqdm import tqdm
 
-def plot_boxes_on_images(json_file_path, images_dir, output_dir):
-    # Load the COCO-formatted JSON file
-    with open(json_file_path, 'r') as f:
-        data = json.load(f)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import CocoIndex
+from json_works.build_cache import BuildCache
+from json_works.geometry import xywh_to_xyxy
+from json_works.instrument import setup_logging, stage, write_report
+from json_works.partition import write_partial
+from json_works.render import render_images, report_failures
+
+def draw_boxes(image_file_path, annotations, output_image_path):
+    # Load the image
+    img = cv2.imread(image_file_path)
+    
+    if img is None:
+        raise FileNotFoundError(f"Could not read image {image_file_path}")
     
-    # Create a dictionary to map image IDs to their file paths
-    image_id_to_file_path = {img['id']: img['file_name'] for img in data['images']}
+    # Draw each bounding box, converted to corner coordinates in one batch
+    color = (0, 0, 255)  # Red color in BGR
+    thickness = 2
+    boxes = xywh_to_xyxy([annotation['bbox'] for annotation in annotations]).astype(int)
+    for x1, y1, x2, y2 in boxes.tolist():
+        img = cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
     
-    # Create a dictionary to hold annotations for each image
-    image_id_to_annotations = {}
-    for annotation in data['annotations']:
-        image_id = annotation['image_id']
-        if image_id not in image_id_to_annotations:
-            image_id_to_annotations[image_id] = []
-        image_id_to_annotations[image_id].append(annotation)
+    # Save the image with bounding boxes
+    cv2.imwrite(output_image_path, img)
+
+def plot_boxes_on_images(json_file_path, images_dir, output_dir, workers=None, use_cache=True, partition=None):
+    # Load the COCO-formatted JSON file and index annotations by image
+    index = CocoIndex.from_json(json_file_path)
+    data = index.data
     
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Process each image
-    for image in tqdm(data['images'], desc="Processing images"):
-        image_id = image['id']
-        image_file_path = os.path.join(images_dir, image_id_to_file_path[image_id])
-        
-        # Load the image
-        img = cv2.imread(image_file_path)
-        
-        if img is None:
-            print(f"Image not found: {image_file_path}")
+    # One small task per image; rendering runs on a process pool
+    tasks = []
+    for image in data['images']:
+        # A sharded worker renders only the images hashed into its shard
+        if partition is not None and not partition.owns(image['id']):
             continue
-        
-        # Draw each bounding box
-        if image_id in image_id_to_annotations:
-            for annotation in image_id_to_annotations[image_id]:
-                bbox = annotation['bbox']
-                x, y, width, height = bbox
-                start_point = (int(x), int(y))
-                end_point = (int(x + width), int(y + height))
-                color = (0, 0, 255)  # Red color in BGR
-                thickness = 2
-                img = cv2.rectangle(img, start_point, end_point, color, thickness)
-        
-        # Save the image with bounding boxes
+        image_file_path = os.path.join(images_dir, image['file_name'])
         output_image_path = os.path.join(output_dir, os.path.basename(image_file_path))
-        cv2.imwrite(output_image_path, img)
+        tasks.append((image_file_path, index.annotations_for(image['id']), output_image_path))
+    
+    # Images whose file, boxes and renderer are unchanged since the last run are skipped
+    cache = BuildCache(output_dir, partition=partition) if use_cache else None
+    failures = render_images(draw_boxes, tasks, workers=workers, desc="Processing images", cache=cache)
+    report_failures(failures)
+    if partition is not None:
+        failed = {task[2] for task, _ in failures}
+        write_partial(output_dir, 'plot', partition, items=len(tasks),
+                      outputs=[task[2] for task in tasks if task[2] not in failed],
+                      failures=[(task[0], error) for task, error in failures])
+
+def main():
+    # Paths to the JSON file, images directory, and output directory
+    json_file_path = "instances_default_converted.json"
+    images_dir = "/home/frinksserver/subhra/paddleOCR_data_preparation/split_det_text/train"
+    output_dir = "/home/frinksserver/subhra/paddleOCR_data_preparation/split_det_text/train_plot_json"
 
-# Paths to the JSON file, images directory, and output directory
-json_file_path = "instances_default_converted.json"
-images_dir = "/home/frinksserver/subhra/paddleOCR_data_preparation/split_det_text/train"
-output_dir = "/home/frinksserver/subhra/paddleOCR_data_preparation/split_det_text/train_plot_json"
+    # Plot the boxes on the images and save them
+    setup_logging()
+    with stage('plot'):
+        plot_boxes_on_images(json_file_path, images_dir, output_dir)
+    write_report(os.path.join(output_dir, 'run_report.json'))
 
-# Plot the boxes on the images and save them
-plot_boxes_on_images(json_file_path, images_dir, output_dir)
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,111 @@
-import json
 import os
-import shutil
-from sklearn.model_selection import train_test_split
-
-# Load COCO annotations
-coco_annotation_path = '/home/frinksserver/Deepak/OCR/datasets/skh/skh_ocr_fasterrcnn/july23_skhocr/instances_default.json'  # Update this path
-with open(coco_annotation_path) as f:
-    coco_dataset = json.load(f)
-
-# Extract image IDs
-image_ids = [img['id'] for img in coco_dataset['images']]
-
-# Split the dataset
-train_ids, test_val_ids = train_test_split(image_ids, test_size=0.30, random_state=42)
-val_ids, test_ids = train_test_split(test_val_ids, test_size=0.5, random_state=42)
-
-def filter_annotations(image_ids, annotations):
-    """Filters annotations to include only those that correspond to the given image IDs."""
-    return [annotation for annotation in annotations if annotation['image_id'] in image_ids]
-
-def create_coco_split(image_ids, coco_dataset, split_name, target_dir):
-    """Creates a COCO-format JSON file for the specified split and saves it to the target directory."""
-    images = [img for img in coco_dataset['images'] if img['id'] in image_ids]
-    annotations = filter_annotations(image_ids, coco_dataset['annotations'])
-    split_dataset = {
-        "info": coco_dataset['info'],
-        "licenses": coco_dataset['licenses'],
-        "images": images,
-        "annotations": annotations,
-        "categories": coco_dataset['categories']
-    }
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works.columnar import ColumnarCoco, load_coco
+from json_works.instrument import logger, setup_logging, stage, write_report
+from json_works.json_io import save_json
+from json_works.materialize import materialize_files
+from json_works.shards import write_shards
+from json_works.splits import split_coco
+
+def create_coco_split(split_data, split_name, target_dir):
+    """Saves one split (a COCO dict or a columnar store) as <target_dir>/<split_name>_split.json."""
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
     json_file_path = os.path.join(target_dir, f'{split_name}_split.json')
-    with open(json_file_path, 'w') as f:
-        json.dump(split_dataset, f)
+    if isinstance(split_data, ColumnarCoco):
+        split_data.to_json(json_file_path)
+    else:
+        save_json(split_data, json_file_path)
 
-def move_images(image_ids, source_dir, target_dir, coco_dataset):
+def move_images(split_data, source_dir, target_dir, mode='hardlink', workers=8, desc="Materializing images"):
+    """Links or copies the images of one split from the source directory to <target_dir>/images.
+
+    mode is one of hardlink, reflink, symlink or copy; links fall back to a copy across filesystems.
+    """
     target_dir = target_dir+"/images"
-    """Copies images from the source directory to the target directory based on the specified image IDs."""
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
-    image_files = [img['file_name'] for img in coco_dataset['images'] if img['id'] in image_ids]
-    for file_name in image_files:
-        source_path = os.path.join(source_dir, file_name)
-        target_path = os.path.join(target_dir, file_name)
-        shutil.copy(source_path, target_path)  # Use shutil.move to move instead of copy
-
-# Define directories
-source_directory = '/home/frinksserver/Deepak/OCR/datasets/skh/skh_ocr_fasterrcnn/july23_skhocr/images'
-train_directory = './split/train'
-val_directory = './split/val'
-test_directory = './split/test'
-
-# Create JSON files for each split and move/copy the images
-create_coco_split(train_ids, coco_dataset, 'train', train_directory)
-create_coco_split(val_ids, coco_dataset, 'val', val_directory)
-create_coco_split(test_ids, coco_dataset, 'test', test_directory)
-
-move_images(train_ids, source_directory, train_directory, coco_dataset)
-move_images(val_ids, source_directory, val_directory, coco_dataset)
-move_images(test_ids, source_directory, test_directory, coco_dataset)
+    # A columnar split lists its file names without building the image records
+    image_files = split_data.file_names() if isinstance(split_data, ColumnarCoco) \
+        else [img['file_name'] for img in split_data['images']]
+    pairs = [(os.path.join(source_dir, file_name), os.path.join(target_dir, file_name)) for file_name in image_files]
+    stats = materialize_files(pairs, mode=mode, workers=workers, desc=desc)
+    logger.info(stats)
+    return stats
+
+def write_split_shards(split_data, source_dir, target_dir, split_name, shard_size=1000, shard_bytes=1 << 30):
+    """Writes the split as <target_dir>/shards/<split>-NNNNNN.tar plus <split>_index.json, see json_works.shards."""
+    # Shards hold the records, which a columnar split builds on access
+    if isinstance(split_data, ColumnarCoco):
+        split_data = split_data.as_coco()
+    index_path, failures = write_shards(split_data, source_dir, os.path.join(target_dir, 'shards'), split_name,
+                                        max_samples=shard_size, max_bytes=shard_bytes,
+                                        desc=f"Writing {split_name} shards")
+    for file_name, error in failures:
+        logger.warning("Could not read image %s: %s", file_name, error)
+    return index_path, len(split_data['images']) - len(failures)
+
+def split_dataset(coco_annotation_path, source_directory, output_directory, ratios=None, seed=42, copy_images=True,
+                  mode='hardlink', output_format='files', shard_size=1000, shard_bytes=1 << 30, loader_cache=False,
+                  stratify=False):
+    """Splits a COCO dataset by ratio, writing <output_directory>/<split>/<split>_split.json and, with copy_images, the images.
+
+    coco_annotation_path may be a JSON file or a columnar store, which is split on its columns.
+    stratify=True applies the ratios within every dominant category, see json_works.splits.
+    output_format='shards' stores the images with their annotations in tar shards instead of loose files.
+    loader_cache=True also writes <split>/loader_cache, the memory-mapped training records of json_works.loader_cache.
+    Returns a dict of split name to the split (a COCO dict, or a columnar store for a columnar input).
+    """
+    ratios = ratios or {'train': 0.70, 'val': 0.15, 'test': 0.15}
+    with stage('load') as s:
+        coco_dataset = load_coco(coco_annotation_path, columnar=True)
+        s.items = coco_dataset.num_images if isinstance(coco_dataset, ColumnarCoco) else len(coco_dataset['images'])
+
+    with stage('split', items=s.items):
+        splits = split_coco(coco_dataset, ratios, seed=seed, stratify=stratify)
+
+    # Create JSON files for each split and move/copy the images
+    with stage('save'):
+        for split_name, split_data in splits.items():
+            create_coco_split(split_data, split_name, os.path.join(output_directory, split_name))
+
+    if copy_images and output_format == 'shards':
+        with stage('shard') as s:
+            for split_name, split_data in splits.items():
+                index_path, written = write_split_shards(split_data, source_directory,
+                                                         os.path.join(output_directory, split_name), split_name,
+                                                         shard_size, shard_bytes)
+                s.items += written
+                logger.info("%s: %s samples indexed in %s", split_name, written, index_path)
+    elif copy_images:
+        with stage('copy') as s:
+            for split_name, split_data in splits.items():
+                stats = move_images(split_data, source_directory, os.path.join(output_directory, split_name), mode=mode,
+                                    desc=f"Copying {split_name} images")
+                s.items += sum(stats.files.values())
+                s.bytes += stats.bytes_written + stats.bytes_avoided
+
+    if loader_cache:
+        from json_works.loader_cache import write_loader_cache
+        with stage('loader_cache'):
+            for split_name, split_data in splits.items():
+                split_dir = os.path.join(output_directory, split_name)
+                # Records point at the split's own copies when there are loose copies, else at the source images
+                image_dir = os.path.join(split_dir, 'images') if copy_images and output_format == 'files' else source_directory
+                write_loader_cache(split_data, image_dir, os.path.join(split_dir, 'loader_cache'))
+
+    return splits
+
+def main():
+    setup_logging()
+    # Load COCO annotations (a JSON file or a columnar store written by json_works.columnar)
+    coco_annotation_path = '/home/frinksserver/Deepak/OCR/datasets/skh/skh_ocr_fasterrcnn/july23_skhocr/instances_default.json'  # Update this path
+    source_directory = '/home/frinksserver/Deepak/OCR/datasets/skh/skh_ocr_fasterrcnn/july23_skhocr/images'
+    # Split the dataset 70/15/15 into ./split/train, ./split/val and ./split/test
+    split_dataset(coco_annotation_path, source_directory, './split', {'train': 0.70, 'val': 0.15, 'test': 0.15}, seed=42)
+    write_report(os.path.join('./split', 'run_report.json'))
+
+if __name__ == "__main__":
+    main()
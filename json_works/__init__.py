@@ -0,0 +1,13 @@
+'''
+Shared helpers for the fasterrcnn and pointrend data preparation scripts.
+
+CocoIndex is re-exported lazily: it needs numpy, which the command line
+entry point should not pay for at start-up.
+'''
+
+
+def __getattr__(name):
+    if name == 'CocoIndex':
+        from .coco_index import CocoIndex
+        return CocoIndex
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
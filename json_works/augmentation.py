@@ -0,0 +1,151 @@
+'''
+Augmentation engine for the pointrend splits.
+
+Each source image is decoded once and every configured variant is applied to
+the in-memory array; the original is passed through as a file copy (or link)
+without re-encoding. Images are fanned out over the render_images process
+pool. Every (image, variant) pair gets its own seed, so the pixels do not
+depend on which worker ran it, and the output JSON is assembled afterwards in
+a fixed order with the same ids a serial run produces.
+
+With a Journal every augmented image is recorded as it finishes, so an
+interrupted run only redoes the images that were in flight, and the output
+JSON is rebuilt from the images the journal lists as done.
+'''
+
+import os
+import random
+
+import cv2
+import numpy as np
+
+from .coco_index import CocoIndex
+from .journal import file_stamp
+from .materialize import materialize_file
+from .render import render_images
+
+# name -> (albumentations transform class, kwargs); plain data so it can be
+# shipped to worker processes and reused by the lazy dataset
+AUGMENTATIONS = {
+    'randbc': ('RandomBrightnessContrast', {'brightness_limit': 0.1, 'contrast_limit': 0.2, 'p': 1}),
+    'gaussblur': ('GaussianBlur', {'blur_limit': (3, 7), 'p': 1}),
+}
+
+
+def build_transforms(config=AUGMENTATIONS):
+    import albumentations as A
+    return {name: getattr(A, transform)(**kwargs) for name, (transform, kwargs) in config.items()}
+
+
+def variant_seed(seed, image_id, variant_index):
+    return int(np.random.SeedSequence([seed, image_id, variant_index]).generate_state(1)[0])
+
+
+def apply_variant(transform, image, seed):
+    if hasattr(transform, 'set_random_seed'):
+        # albumentations 2 draws from the transform's own generators
+        transform.set_random_seed(seed)
+        return transform(image=image)['image']
+    # Older versions draw from the global generators: seed them for this call
+    # only, so callers such as DataLoader workers keep their own streams
+    python_state, numpy_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        return transform(image=image)['image']
+    finally:
+        random.setstate(python_state)
+        np.random.set_state(numpy_state)
+
+
+def variant_file_name(file_name, variant_name):
+    base_name, ext = os.path.splitext(file_name)
+    return f"{base_name}_aug_{variant_name}{ext}"
+
+
+class ImageAugmenter:
+    '''Per-image worker: copy the original, decode once, write every variant.'''
+
+    def __init__(self, output_images_dir, config=AUGMENTATIONS, seed=42, original_mode='copy'):
+        self.output_images_dir = output_images_dir
+        self.config = config
+        self.seed = seed
+        self.original_mode = original_mode
+        self._transforms = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_transforms'] = None
+        return state
+
+    def __call__(self, src_path, image_id, file_name):
+        if self._transforms is None:
+            self._transforms = build_transforms(self.config)
+        image = cv2.imread(src_path)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image {src_path}")
+        materialize_file(src_path, os.path.join(self.output_images_dir, file_name), self.original_mode)
+        for k, (name, transform) in enumerate(self._transforms.items()):
+            aug_image = apply_variant(transform, image, variant_seed(self.seed, image_id, k))
+            cv2.imwrite(os.path.join(self.output_images_dir, variant_file_name(file_name, name)), aug_image)
+
+
+def augmented_coco(data, config=AUGMENTATIONS, exclude_image_ids=()):
+    '''
+    COCO dict for originals followed by their variants, renumbered from 0:
+    all originals first, then each image's variants in config order.
+    '''
+    index = CocoIndex(data)
+    images = [img for img in data['images'] if img['id'] not in exclude_image_ids]
+    new_data = data.copy()
+    new_data['images'] = []
+    new_data['annotations'] = []
+    image_id = 0
+    annotation_id = 0
+
+    def add(img, file_name):
+        nonlocal image_id, annotation_id
+        new_img_info = img.copy()
+        new_img_info['id'] = image_id
+        new_img_info['file_name'] = file_name
+        new_data['images'].append(new_img_info)
+        for ann in index.annotations_for(img['id']):
+            new_ann = ann.copy()
+            new_ann['id'] = annotation_id
+            new_ann['image_id'] = image_id
+            new_data['annotations'].append(new_ann)
+            annotation_id += 1
+        image_id += 1
+
+    for img in images:
+        add(img, img['file_name'])
+    for img in images:
+        for name in config:
+            add(img, variant_file_name(img['file_name'], name))
+    return new_data
+
+
+def augment_coco(data, input_folder, output_images_dir, config=AUGMENTATIONS, seed=42, workers=None, chunksize=4,
+                 original_mode='copy', journal=None):
+    '''
+    Write originals and variants for every image to output_images_dir.
+    Returns (augmented COCO dict, failures); failed images are left out of the dict.
+    '''
+    os.makedirs(output_images_dir, exist_ok=True)
+    augmenter = ImageAugmenter(output_images_dir, config=config, seed=seed, original_mode=original_mode)
+    tasks = [(os.path.join(input_folder, img['file_name']), img['id'], img['file_name']) for img in data['images']]
+
+    def unit_of(task):
+        src_path, image_id, file_name = task
+        outputs = [os.path.join(output_images_dir, file_name)]
+        outputs += [os.path.join(output_images_dir, variant_file_name(file_name, name)) for name in config]
+        return f"{image_id}:{file_name}", outputs, file_stamp(src_path) if os.path.exists(src_path) else None
+
+    failures = render_images(augmenter, tasks, workers=workers, chunksize=chunksize, desc="Augmenting images",
+                             journal=journal, unit_of=unit_of)
+    # The journal also lists units from earlier runs, so this run's failures are excluded on top
+    failed_ids = {task[1] for task, _ in failures}
+    if journal is not None:
+        done = journal.completed()
+        failed_ids |= {img['id'] for img in data['images'] if f"{img['id']}:{img['file_name']}" not in done}
+    return augmented_coco(data, config, exclude_image_ids=failed_ids), failures
@@ -0,0 +1,145 @@
+'''
+On-disk build cache for rendered annotation_check images.
+
+Each output file is recorded with a key hashed from
+    - the source image's size and mtime (or its full content with content_hash=True)
+    - the image's annotations, serialized with sorted keys
+    - the render settings, which by default include a hash of the renderer's source
+An output whose recorded key still matches, and which still exists, is skipped.
+The manifest lives next to the outputs (.render_cache.json) with paths stored
+relative to it, so the folder can be moved without invalidating the cache.
+Outputs are also appended to a journal (.render_cache.journal) as they are
+recorded, so a run that is killed before save() keeps what it rendered; the
+journal is folded into the manifest on the next load and cleared by save().
+'''
+
+import hashlib
+import inspect
+import json
+import os
+
+from .journal import Journal
+
+MANIFEST_NAME = '.render_cache.json'
+JOURNAL_NAME = '.render_cache.journal'
+MANIFEST_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_settings(render_fn, settings=None):
+    '''Settings that invalidate the cache: caller settings plus the renderer's identity and code.'''
+    combined = {'renderer': f"{render_fn.__module__}.{render_fn.__qualname__}"}
+    try:
+        combined['source'] = hashlib.blake2b(inspect.getsource(render_fn).encode(), digest_size=16).hexdigest()
+    except (OSError, TypeError):
+        pass
+    if settings:
+        combined.update(settings)
+    return combined
+
+
+class BuildCache:
+    def __init__(self, output_dir, content_hash=False, partition=None):
+        '''
+        partition: a json_works.partition.Partition; each shard of a sharded
+            render keeps its own manifest and journal, so workers never
+            overwrite or evict each other's entries
+        '''
+        self.output_dir = output_dir
+        suffix = f".{partition.suffix}" if partition is not None else ''
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME.replace('.json', f"{suffix}.json"))
+        self.journal_path = os.path.join(output_dir, JOURNAL_NAME + suffix)
+        self.content_hash = content_hash
+        self.entries = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    self.entries = manifest['entries']
+            except (OSError, ValueError, KeyError):
+                # A corrupt manifest only costs a full re-render
+                self.entries = {}
+        self._journal = None
+        if os.path.exists(self.journal_path):
+            self._journal = Journal(self.journal_path)
+            for rel, entry in self._journal.entries.items():
+                self.entries[rel] = entry['key']
+
+    def _relative(self, output_path):
+        return os.path.relpath(output_path, self.output_dir)
+
+    def key(self, source_path, annotations, settings):
+        try:
+            if self.content_hash:
+                source = file_digest(source_path)
+            else:
+                st = os.stat(source_path)
+                source = f"{st.st_size}:{st.st_mtime_ns}"
+        except OSError:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(source.encode())
+        digest.update(json.dumps(annotations, sort_keys=True, separators=(',', ':')).encode())
+        digest.update(json.dumps(settings, sort_keys=True, separators=(',', ':')).encode())
+        return digest.hexdigest()
+
+    def is_fresh(self, output_path, key):
+        return key is not None and self.entries.get(self._relative(output_path)) == key and os.path.exists(output_path)
+
+    def stale_tasks(self, tasks, settings):
+        '''
+        Split render tasks (source_path, annotations, output_path, ...) into the
+        ones that need rendering. Returns (pending_tasks, pending_keys).
+        '''
+        pending, keys = [], []
+        for task in tasks:
+            key = self.key(task[0], task[1], settings)
+            if not self.is_fresh(task[2], key):
+                pending.append(task)
+                keys.append(key)
+        return pending, keys
+
+    def record(self, output_path, key):
+        if key is not None:
+            self.entries[self._relative(output_path)] = key
+            if self._journal is None:
+                self._journal = Journal(self.journal_path)
+            self._journal.record(self._relative(output_path), [output_path], key)
+
+    def forget(self, output_path):
+        self.entries.pop(self._relative(output_path), None)
+
+    def gc(self, live_outputs, delete_outputs=True):
+        '''
+        Evict entries whose output is not in live_outputs, e.g. images that were
+        removed from the dataset. Their rendered files are deleted too unless
+        delete_outputs is False. Returns the number of evicted entries.
+        '''
+        live = {self._relative(path) for path in live_outputs}
+        stale = [rel for rel in self.entries if rel not in live]
+        for rel in stale:
+            del self.entries[rel]
+            if delete_outputs:
+                path = os.path.join(self.output_dir, rel)
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(stale)
+
+    def save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+        if self._journal is not None:
+            self._journal.close()
+            os.remove(self._journal.path)
+            self._journal = None
@@ -0,0 +1,375 @@
+'''
+Command line entry point for the data preparation steps.
+
+    python -m json_works split --annotations instances_default.json --output split --no-images
+    python -m json_works merge --pipeline pointrend --root biscuits_data
+    python -m json_works merge --pipeline fasterrcnn --folders split_a split_b
+    python -m json_works augment --annotations train.json --images train/images --output aug/train --split-type train
+    python -m json_works tile --annotations combined.json --images combined/images --output tiled --tile-size 1024
+    python -m json_works plot --style contours --annotations train.json --images train/images --output annotation_check/train
+    python -m json_works plot --sheets --sample 20 --annotations train.json --images train/images --output review/train
+    python -m json_works verify --annotations combined_data/combined_json.json --images combined_data/images
+    python -m json_works stats --annotations combined_data/combined_json.json --output stats.json --html stats.html
+    python -m json_works --shards 4 augment --annotations train.json --images train/images --output aug/train
+
+Options can also come from a JSON file given with --config, one object per
+subcommand, e.g. {"split": {"annotations": "all.json", "ratios": {"train": 0.8, "test": 0.2}}};
+options on the command line win. Start-up only imports argparse: every
+subcommand imports what it needs (numpy, cv2, albumentations, the pointrend
+or fasterrcnn script) when it runs, so JSON-only work such as
+split --no-images never loads the image libraries.
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(pipeline, name):
+    '''
+    Import pointrend/<name>.py or fasterrcnn/<name>.py. Both folders have a
+    json_combo.py, so modules are registered as <pipeline>_<name>.
+    '''
+    module_name = f"{pipeline}_{name}"
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(REPO_ROOT, pipeline, f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
+
+
+def parse_ratios(value):
+    '''"train=0.7,val=0.15,test=0.15" (or a dict from the config file) -> {name: ratio}.'''
+    if isinstance(value, dict):
+        return {name: float(ratio) for name, ratio in value.items()}
+    ratios = {}
+    for part in value.split(','):
+        name, _, ratio = part.partition('=')
+        if not ratio:
+            raise argparse.ArgumentTypeError(f"Expected name=ratio, got {part!r}")
+        ratios[name.strip()] = float(ratio)
+    return ratios
+
+
+def cmd_split(args):
+    from .columnar import ColumnarCoco
+
+    train_val_test = load_script('fasterrcnn', 'train_val_test')
+    splits = train_val_test.split_dataset(args.annotations, args.images, args.output, parse_ratios(args.ratios),
+                                          seed=args.seed, copy_images=not args.no_images, mode=args.mode,
+                                          output_format=args.format, shard_size=args.shard_size,
+                                          shard_bytes=args.shard_bytes, loader_cache=args.loader_cache,
+                                          stratify=args.stratify)
+    for name, split in splits.items():
+        if isinstance(split, ColumnarCoco):
+            print(f"{name}: {split.num_images} images, {split.num_annotations} annotations")
+        else:
+            print(f"{name}: {len(split['images'])} images, {len(split['annotations'])} annotations")
+
+
+def cmd_merge(args):
+    if args.pipeline == 'pointrend':
+        require(args, 'root')
+        json_combo = load_script('pointrend', 'json_combo')
+        json_combo.process_annotations(args.root, workers=args.workers, image_mode=args.mode,
+                                       incremental=not args.no_incremental, dedup_policy=args.dedup,
+                                       near_duplicates=args.near_duplicates)
+    else:
+        require(args, 'folders')
+        json_combo = load_script('fasterrcnn', 'json_combo')
+        json_combo.main(*args.folders, dedup_policy=args.dedup)
+
+
+def cmd_augment(args):
+    augment = load_script('pointrend', 'augment')
+    if args.reduce:
+        augment.reduce_augment(args.output, args.split_type, loader_cache=args.loader_cache)
+        return
+    augment.augment_dataset(args.images, args.annotations, args.output, args.split_type, workers=args.workers,
+                            seed=args.seed, resume=not args.no_resume, partition=args.partition,
+                            loader_cache=args.loader_cache)
+
+
+def cmd_tile(args):
+    from .columnar import load_coco
+    from .instrument import stage
+    from .journal import Journal
+    from .json_io import save_json
+    from .render import report_failures
+    from .tiling import tile_coco
+
+    data = load_coco(args.annotations)
+    journal = None
+    if not args.no_resume:
+        journal = Journal(os.path.join(args.output, '.tile.journal'),
+                          settings={'tile_size': args.tile_size, 'overlap': args.overlap,
+                                    'min_visible': args.min_visible, 'keep_empty': not args.drop_empty})
+    try:
+        with stage('tile', items=len(data['images'])):
+            tiled, failures = tile_coco(data, args.images, os.path.join(args.output, 'images'),
+                                        tile_size=args.tile_size, overlap=args.overlap, min_visible=args.min_visible,
+                                        keep_empty=not args.drop_empty, workers=args.workers, journal=journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    report_failures(failures, action="tile")
+    save_json(tiled, os.path.join(args.output, 'tiles.json'))
+    print(f"{len(tiled['images'])} tiles, {len(tiled['annotations'])} annotations")
+
+
+def cmd_plot(args):
+    if args.sheets:
+        from .columnar import load_coco
+        from .contact_sheet import render_contact_sheets, sources_from_manifest
+        sources = sources_from_manifest(args.annotations) if args.sample and args.sample_by == 'source' else None
+        render_contact_sheets(load_coco(args.annotations), args.images, args.output, style=args.style,
+                              sample=args.sample, by=args.sample_by, changed_only=args.changed_only, sources=sources,
+                              tile_size=args.tile_size, workers=args.workers)
+    elif args.reduce:
+        from .partition import reduce_partials
+        reduce_partials(args.output, 'plot')
+    elif args.style == 'contours':
+        plotting = load_script('pointrend', 'plotting')
+        plotting.plot_annotations(plotting.load_json(args.annotations), args.images, args.output,
+                                  workers=args.workers, use_cache=not args.no_cache, partition=args.partition)
+    else:
+        plot_json = load_script('fasterrcnn', 'plot_json')
+        plot_json.plot_boxes_on_images(args.annotations, args.images, args.output, workers=args.workers,
+                                       use_cache=not args.no_cache, partition=args.partition)
+
+
+def cmd_verify(args):
+    from .columnar import load_coco
+    from .instrument import logger
+    from .json_io import save_json
+    from .verify import verify_images
+
+    report = verify_images(load_coco(args.annotations, columnar=True), args.images, check_dimensions=not args.no_dimensions)
+    for file_name in report.missing:
+        logger.warning("Image not found: %s", file_name)
+    for file_name, expected, actual in report.mismatched:
+        logger.warning("Image %s is %sx%s, JSON says %sx%s", file_name, actual[0], actual[1], expected[0], expected[1])
+    for file_name, error in report.unreadable:
+        logger.warning("Could not read image %s: %s", file_name, error)
+    logger.info(report)
+    if args.output:
+        save_json(report.as_dict(), args.output, indent=2)
+    return 0 if report.ok else 1
+
+
+def cmd_stats(args):
+    from .contact_sheet import sources_from_manifest
+    from .instrument import logger, stage
+    from .stats import compute_stats, issue_summary, load_store, write_html, write_json
+
+    with stage('load') as s:
+        store = load_store(args.annotations)
+        s.items = store.num_annotations
+    sources = sources_from_manifest(args.annotations)
+    with stage('stats', items=store.num_annotations):
+        report = compute_stats(store, sources=sources, bins=args.bins)
+    logger.info(issue_summary(report))
+    if args.output:
+        write_json(report, args.output)
+    if args.html:
+        write_html(report, args.html, title=os.path.basename(args.annotations))
+
+
+COMMANDS = {'split': cmd_split, 'merge': cmd_merge, 'augment': cmd_augment, 'plot': cmd_plot, 'verify': cmd_verify,
+            'stats': cmd_stats, 'tile': cmd_tile}
+
+# Options each subcommand cannot run without; checked after the config file is applied
+REQUIRED = {
+    'split': ('annotations', 'output'),
+    'merge': (),
+    'augment': ('annotations', 'images', 'output'),
+    'plot': ('annotations', 'images', 'output'),
+    'verify': ('annotations', 'images'),
+    'stats': ('annotations',),
+    'tile': ('annotations', 'images', 'output'),
+}
+
+
+# Subcommands that can run as K shards -> the stage name of their partial manifests
+SHARDED_STAGES = {
+    'augment': lambda args: f"{args.split_type}_augment",
+    'plot': lambda args: 'plot',
+}
+
+
+class _UsageError(Exception):
+    pass
+
+
+def require(args, *names):
+    missing = [name for name in names if getattr(args, name, None) in (None, [])]
+    if missing:
+        raise _UsageError(f"{args.command}: missing {', '.join('--' + name.replace('_', '-') for name in missing)}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m json_works', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', help="JSON file with options per subcommand")
+    parser.add_argument('--verbose', action='store_true', help="log per-image messages")
+    parser.add_argument('--report', help="write the per-stage timing report to this file")
+    parser.add_argument('--shard', help="augment/plot: only handle shard i/K of the images, see json_works.partition")
+    parser.add_argument('--shards', type=int, help="augment/plot: run K local shard processes, then --reduce")
+    parser.add_argument('--reduce', action='store_true', help="augment/plot: stitch the partial manifests of all shards")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    split = subparsers.add_parser('split', help="split a COCO file into <output>/<split>/<split>_split.json")
+    split.add_argument('--annotations', help="COCO JSON file or columnar store")
+    split.add_argument('--images', help="image folder, needed unless --no-images")
+    split.add_argument('--output')
+    split.add_argument('--ratios', default='train=0.7,val=0.15,test=0.15')
+    split.add_argument('--seed', type=int, default=42)
+    split.add_argument('--stratify', action='store_true', help="keep category proportions in every split")
+    split.add_argument('--no-images', action='store_true', help="write the split JSONs only")
+    split.add_argument('--mode', default='hardlink', choices=('hardlink', 'reflink', 'symlink', 'copy'))
+    split.add_argument('--format', default='files', choices=('files', 'shards'),
+                       help="shards: write <split>/shards/*.tar with an index instead of loose images")
+    split.add_argument('--shard-size', type=int, default=1000, help="samples per shard")
+    split.add_argument('--shard-bytes', type=int, default=1 << 30, help="start a new shard past this size")
+    split.add_argument('--loader-cache', action='store_true', help="also write <split>/loader_cache training records")
+
+    merge = subparsers.add_parser('merge', help="combine CVAT exports (pointrend) or split folders (fasterrcnn)")
+    merge.add_argument('--pipeline', default='pointrend', choices=('pointrend', 'fasterrcnn'))
+    merge.add_argument('--root', help="pointrend: folder holding the *biscuit* exports")
+    merge.add_argument('--folders', nargs='+', help="fasterrcnn: split folders to combine")
+    merge.add_argument('--dedup', default='remap', choices=('remap', 'drop', 'flag'),
+                       help="what to do with byte-identical images, see json_works.dedup")
+    merge.add_argument('--near-duplicates', action='store_true')
+    merge.add_argument('--no-incremental', action='store_true', help="pointrend: rebuild instead of appending")
+    merge.add_argument('--mode', default='hardlink', choices=('hardlink', 'reflink', 'symlink', 'copy'))
+    merge.add_argument('--workers', type=int)
+
+    augment = subparsers.add_parser('augment', help="write augmented variants of a split")
+    augment.add_argument('--annotations')
+    augment.add_argument('--images')
+    augment.add_argument('--output')
+    augment.add_argument('--split-type', default='train')
+    augment.add_argument('--seed', type=int, default=42)
+    augment.add_argument('--workers', type=int)
+    augment.add_argument('--no-resume', action='store_true', help="ignore the checkpoint journal")
+    augment.add_argument('--loader-cache', action='store_true', help="also write <output>/loader_cache training records")
+
+    tile = subparsers.add_parser('tile', help="cut large images into overlapping tiles, see json_works.tiling")
+    tile.add_argument('--annotations')
+    tile.add_argument('--images')
+    tile.add_argument('--output', help="writes <output>/images and <output>/tiles.json")
+    tile.add_argument('--tile-size', type=int, default=1024)
+    tile.add_argument('--overlap', type=int, default=128)
+    tile.add_argument('--min-visible', type=float, default=0.5,
+                      help="keep a cut object when at least this fraction of its area is in the tile")
+    tile.add_argument('--drop-empty', action='store_true', help="skip tiles without annotations")
+    tile.add_argument('--workers', type=int)
+    tile.add_argument('--no-resume', action='store_true', help="ignore the checkpoint journal")
+
+    plot = subparsers.add_parser('plot', help="render annotation_check images")
+    plot.add_argument('--style', default='contours', choices=('contours', 'boxes'))
+    plot.add_argument('--annotations')
+    plot.add_argument('--images')
+    plot.add_argument('--output')
+    plot.add_argument('--workers', type=int)
+    plot.add_argument('--no-cache', action='store_true', help="re-render unchanged images")
+    plot.add_argument('--sheets', action='store_true', help="thumbnails on contact sheets instead of one file per image")
+    plot.add_argument('--sample', type=int, help="sheets: only N images per source folder or category")
+    plot.add_argument('--sample-by', default='source', choices=('source', 'category'))
+    plot.add_argument('--changed-only', action='store_true', help="sheets: only images changed since the last review")
+    plot.add_argument('--tile-size', type=int, default=256)
+
+    verify = subparsers.add_parser('verify', help="check images exist and match the JSON sizes")
+    verify.add_argument('--annotations')
+    verify.add_argument('--images')
+    verify.add_argument('--no-dimensions', action='store_true', help="only check that the files exist")
+    verify.add_argument('--output', help="write the report as JSON")
+
+    stats = subparsers.add_parser('stats', help="counts, histograms and validation issues of a COCO file")
+    stats.add_argument('--annotations', help="COCO JSON file or columnar store")
+    stats.add_argument('--output', help="write the report as JSON")
+    stats.add_argument('--html', help="write the report as an HTML page")
+    stats.add_argument('--bins', type=int, default=20)
+    return parser, subparsers
+
+
+def _without_option(argv, name):
+    rest, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == name:
+            skip = True
+        elif not arg.startswith(name + '='):
+            rest.append(arg)
+    return rest
+
+
+def run_local_shards(args, argv):
+    '''
+    Run the command as args.shards processes of this CLI, one per shard, and
+    reduce their partial manifests; what other machines would do with
+    --shard i/K followed by --reduce.
+    '''
+    from .instrument import logger
+    from .partition import clear_partials
+    clear_partials(args.output, SHARDED_STAGES[args.command](args))
+    rest = _without_option(argv, '--shards')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_ROOT, env.get('PYTHONPATH')]))
+    processes = [subprocess.Popen([sys.executable, '-m', 'json_works', '--shard', f"{index}/{args.shards}"] + rest,
+                                  env=env) for index in range(args.shards)]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        logger.error("Shards %s of %s failed; rerun them with --shard i/%s, then --reduce",
+                     failed, args.shards, args.shards)
+        return 1
+    args.reduce = True
+    return COMMANDS[args.command](args)
+
+
+def main(argv=None):
+    parser, subparsers = build_parser()
+    argv = sys.argv[1:] if argv is None else argv
+    config_args = argparse.ArgumentParser(add_help=False)
+    config_args.add_argument('--config')
+    config_path = config_args.parse_known_args(argv)[0].config
+    if config_path:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        for command, options in config.items():
+            if command in subparsers.choices:
+                subparsers.choices[command].set_defaults(**{k.replace('-', '_'): v for k, v in options.items()})
+    args = parser.parse_args(argv)
+
+    from .instrument import setup_logging, write_report
+    setup_logging(verbose=args.verbose)
+    try:
+        require(args, *REQUIRED[args.command])
+        if args.command == 'split' and (not args.no_images or args.loader_cache):
+            require(args, 'images')
+        args.partition = None
+        if args.shard or args.shards or args.reduce:
+            if args.command not in SHARDED_STAGES or getattr(args, 'sheets', False):
+                raise _UsageError(f"{args.command}: only augment and plot (without --sheets) can be sharded")
+        if args.shard:
+            from .partition import Partition
+            try:
+                args.partition = Partition.parse(args.shard)
+            except ValueError as e:
+                raise _UsageError(str(e))
+        if args.shards:
+            status = run_local_shards(args, argv)
+        else:
+            status = COMMANDS[args.command](args)
+    except _UsageError as e:
+        parser.error(str(e))
+    if args.report:
+        write_report(args.report)
+    return status or 0
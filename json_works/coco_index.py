@@ -0,0 +1,111 @@
+'''
+Indexed view over a COCO-formatted dict.
+
+Building the index is a single pass over images, annotations and categories;
+every lookup afterwards is a dict access instead of a scan of the full
+annotation list. ColumnarIndex answers the same lookups from the columns of a
+ColumnarCoco, building only the records a lookup returns.
+'''
+
+from collections import defaultdict
+
+import numpy as np
+
+from .json_io import load_json
+
+
+class CocoIndex:
+    def __init__(self, data):
+        self.data = data
+        self.images = {img['id']: img for img in data.get('images', [])}
+        self.categories = {cat['id']: cat for cat in data.get('categories', [])}
+        self.annotations_by_image = defaultdict(list)
+        self.annotations_by_category = defaultdict(list)
+        for ann in data.get('annotations', []):
+            self.annotations_by_image[ann['image_id']].append(ann)
+            if 'category_id' in ann:
+                self.annotations_by_category[ann['category_id']].append(ann)
+
+    @classmethod
+    def from_json(cls, file_path):
+        # A columnar store saved by json_works.columnar is indexed in place instead of converted to dicts
+        from .columnar import ColumnarCoco, is_columnar
+        if is_columnar(file_path):
+            return ColumnarIndex(ColumnarCoco.load(file_path))
+        return cls(load_json(file_path))
+
+    def image(self, image_id):
+        return self.images[image_id]
+
+    def annotations_for(self, image_id):
+        # .get keeps lookups for unannotated images from growing the defaultdict
+        return self.annotations_by_image.get(image_id, [])
+
+    def annotations_for_category(self, category_id):
+        return self.annotations_by_category.get(category_id, [])
+
+    def category_name(self, category_id):
+        return self.categories[category_id]['name']
+
+    def orphan_annotations(self):
+        '''Annotations whose image_id has no matching image record.'''
+        return [ann for image_id, anns in self.annotations_by_image.items()
+                if image_id not in self.images for ann in anns]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __iter__(self):
+        for image_id, img in self.images.items():
+            yield img, self.annotations_for(image_id)
+
+
+class ColumnarIndex(CocoIndex):
+    '''
+    CocoIndex over a ColumnarCoco. Ids are looked up by binary search on
+    sorted copies of the id columns; data is the store's lazy COCO view
+    (ColumnarCoco.as_coco), so iterating it builds the records on the fly.
+    '''
+
+    def __init__(self, store):
+        self.store = store
+        self.data = store.as_coco()
+        self.categories = {cat['id']: cat for cat in store.meta.get('categories', [])}
+        image_ids = np.asarray(store.image_id)
+        self._image_order = np.argsort(image_ids, kind='stable')
+        self._sorted_image_ids = image_ids[self._image_order]
+        category_ids = np.asarray(store.ann_category_id)
+        self._category_order = np.argsort(category_ids, kind='stable')
+        self._sorted_category_ids = category_ids[self._category_order]
+
+    def _annotations(self, rows):
+        return [self.store.annotation(int(row)) for row in np.sort(rows)]
+
+    def image(self, image_id):
+        pos = np.searchsorted(self._sorted_image_ids, image_id)
+        if pos == len(self._sorted_image_ids) or self._sorted_image_ids[pos] != image_id:
+            raise KeyError(image_id)
+        return self.store.image(int(self._image_order[pos]))
+
+    def annotations_for(self, image_id):
+        return self._annotations(self.store.annotation_indices(image_id))
+
+    def annotations_for_category(self, category_id):
+        lo, hi = np.searchsorted(self._sorted_category_ids, [category_id, category_id + 1])
+        return self._annotations(self._category_order[lo:hi])
+
+    def orphan_annotations(self):
+        known = np.isin(self.store.ann_image_id, self._sorted_image_ids)
+        return self._annotations(np.flatnonzero(~known))
+
+    @property
+    def images(self):
+        # Builds every image record; prefer image() for lookups
+        return {img['id']: img for img in self.data['images']}
+
+    def __len__(self):
+        return len(np.unique(self._sorted_image_ids))
+
+    def __iter__(self):
+        for img in self.data['images']:
+            yield img, self.annotations_for(img['id'])
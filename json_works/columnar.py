@@ -0,0 +1,396 @@
+'''
+Columnar, memory-mappable store for COCO datasets.
+
+Image and annotation fields become NumPy columns; polygon coordinates are one
+flat float array addressed through two offset arrays:
+
+    ann_poly_offsets[i]:ann_poly_offsets[i + 1]   polygons of annotation i
+    poly_offsets[p]:poly_offsets[p + 1]           coordinates of polygon p
+
+Fields without a column (CVAT attributes, license, RLE segmentations, ...) are
+kept per record as a JSON string so the store converts back to the same COCO
+records. Strings (file names and those JSON strings) are packed the same way,
+UTF-8 bytes in one array addressed through an offsets array:
+
+    image_file_name_offsets[i]:image_file_name_offsets[i + 1]   bytes of image i's name
+                                                                in image_file_name_bytes
+
+A store is saved either as one .npz file or as a directory of raw .npy files
+plus meta.json; the directory form is memory-mapped on load. Records are built
+from the columns only when asked for: as_coco() is a read-only COCO dict whose
+images and annotations are converted on access, and select() cuts a store down
+to some of its images without building any.
+
+    python -m json_works.columnar instances_default.json instances_default.coco
+'''
+
+import json
+import os
+import sys
+from array import array
+from collections.abc import Sequence
+
+import numpy as np
+
+from .json_io import CocoStreamWriter, iter_top_level, load_json
+
+IMAGE_FIELDS = ('id', 'width', 'height', 'file_name')
+ANNOTATION_FIELDS = ('id', 'image_id', 'category_id', 'segmentation', 'area', 'bbox', 'iscrowd')
+STRING_COLUMNS = ('image_file_name', 'image_extra', 'ann_extra')
+META_NAME = 'meta.json'
+
+
+def _extra(record, fields):
+    extra = {k: v for k, v in record.items() if k not in fields}
+    return json.dumps(extra) if extra else ''
+
+
+def lengths_to_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths, dtype=np.int64)
+    return offsets
+
+
+def gather_ranges(starts, ends):
+    '''Concatenation of arange(s, e) for every (s, e) pair, without a Python loop.'''
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return shifts + np.arange(total)
+
+
+def pack_strings(values):
+    '''(UTF-8 bytes, offsets) of a list of strings: value i is bytes[offsets[i]:offsets[i + 1]].'''
+    encoded = [value.encode('utf-8') for value in values]
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), lengths_to_offsets([len(b) for b in encoded])
+
+
+class _Builder:
+    def __init__(self, float_dtype):
+        self.float_dtype = float_dtype
+        self.meta = {}
+        self.image_id, self.image_width, self.image_height = array('q'), array('q'), array('q')
+        self.image_file_name, self.image_extra = [], []
+        self.ann_id, self.ann_image_id, self.ann_category_id = array('q'), array('q'), array('q')
+        self.ann_bbox, self.ann_area, self.ann_iscrowd = array('d'), array('d'), array('b')
+        self.ann_polygonal, self.ann_extra = array('b'), []
+        self.ann_poly_offsets, self.poly_offsets, self.coords = array('q', [0]), array('q', [0]), array('d')
+
+    def add_image(self, img):
+        self.image_id.append(img['id'])
+        self.image_width.append(img.get('width', -1))
+        self.image_height.append(img.get('height', -1))
+        self.image_file_name.append(img.get('file_name', ''))
+        self.image_extra.append(_extra(img, IMAGE_FIELDS))
+
+    def add_annotation(self, ann):
+        self.ann_id.append(ann['id'])
+        self.ann_image_id.append(ann['image_id'])
+        self.ann_category_id.append(ann.get('category_id', -1))
+        bbox = ann.get('bbox')
+        self.ann_bbox.extend(bbox if bbox is not None and len(bbox) == 4 else (np.nan,) * 4)
+        self.ann_area.append(ann['area'] if ann.get('area') is not None else np.nan)
+        self.ann_iscrowd.append(ann.get('iscrowd', 0))
+
+        segmentation = ann.get('segmentation')
+        polygonal = isinstance(segmentation, list) and all(isinstance(poly, list) for poly in segmentation)
+        fields = ANNOTATION_FIELDS if polygonal else tuple(f for f in ANNOTATION_FIELDS if f != 'segmentation')
+        if bbox is not None and len(bbox) != 4:
+            fields = tuple(f for f in fields if f != 'bbox')
+        self.ann_polygonal.append(polygonal)
+        self.ann_extra.append(_extra(ann, fields))
+        if polygonal:
+            for poly in segmentation:
+                self.coords.extend(poly)
+                self.poly_offsets.append(len(self.coords))
+        self.ann_poly_offsets.append(len(self.poly_offsets) - 1)
+
+    def build(self):
+        f = self.float_dtype
+        columns = {
+            'image_id': np.frombuffer(self.image_id, dtype=np.int64),
+            'image_width': np.frombuffer(self.image_width, dtype=np.int64).astype(np.int32),
+            'image_height': np.frombuffer(self.image_height, dtype=np.int64).astype(np.int32),
+            'ann_id': np.frombuffer(self.ann_id, dtype=np.int64),
+            'ann_image_id': np.frombuffer(self.ann_image_id, dtype=np.int64),
+            'ann_category_id': np.frombuffer(self.ann_category_id, dtype=np.int64).astype(np.int32),
+            'ann_bbox': np.frombuffer(self.ann_bbox, dtype=np.float64).astype(f).reshape(-1, 4),
+            'ann_area': np.frombuffer(self.ann_area, dtype=np.float64).astype(f),
+            'ann_iscrowd': np.frombuffer(self.ann_iscrowd, dtype=np.int8).astype(np.uint8),
+            'ann_polygonal': np.frombuffer(self.ann_polygonal, dtype=np.int8).astype(bool),
+            'ann_poly_offsets': np.frombuffer(self.ann_poly_offsets, dtype=np.int64),
+            'poly_offsets': np.frombuffer(self.poly_offsets, dtype=np.int64),
+            'coords': np.frombuffer(self.coords, dtype=np.float64).astype(f),
+        }
+        for name in STRING_COLUMNS:
+            columns[f'{name}_bytes'], columns[f'{name}_offsets'] = pack_strings(getattr(self, name))
+        return ColumnarCoco(columns, self.meta)
+
+
+class _Records(Sequence):
+    '''Read-only list of a store's image or annotation records, converted from the columns on access.'''
+
+    def __init__(self, rows, count, chunk_size=65536):
+        self._rows = rows
+        self._count = count
+        self._chunk_size = chunk_size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._count)
+            return list(self._rows(start, stop))[::step] if step > 0 else [self[k] for k in range(start, stop, step)]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(f"Record {i} out of range for {self._count} records")
+        return next(self._rows(i, i + 1))
+
+    def __iter__(self):
+        for start in range(0, self._count, self._chunk_size):
+            yield from self._rows(start, start + self._chunk_size)
+
+
+class ColumnarCoco:
+    def __init__(self, columns, meta):
+        columns = dict(columns)
+        for name in STRING_COLUMNS:
+            # Stores saved before strings were packed hold them as fixed-width unicode columns
+            if name in columns:
+                columns[f'{name}_bytes'], columns[f'{name}_offsets'] = pack_strings(np.asarray(columns.pop(name)).tolist())
+        self.columns = columns
+        self.meta = meta
+        self._ann_order = None
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('columns')
+        if columns is not None and name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    @property
+    def num_images(self):
+        return len(self.columns['image_id'])
+
+    @property
+    def num_annotations(self):
+        return len(self.columns['ann_id'])
+
+    # Conversion from COCO
+
+    @classmethod
+    def from_coco(cls, data, float_dtype=np.float64):
+        builder = _Builder(float_dtype)
+        for key, value in data.items():
+            if key not in ('images', 'annotations'):
+                builder.meta[key] = value
+        for img in data.get('images', []):
+            builder.add_image(img)
+        for ann in data.get('annotations', []):
+            builder.add_annotation(ann)
+        return builder.build()
+
+    @classmethod
+    def from_json(cls, file_path, float_dtype=np.float64):
+        '''Convert a COCO JSON file record by record, without loading the whole tree.'''
+        builder = _Builder(float_dtype)
+        for key, value in iter_top_level(file_path):
+            if key == 'images':
+                builder.add_image(value)
+            elif key == 'annotations':
+                builder.add_annotation(value)
+            else:
+                builder.meta[key] = value
+        return builder.build()
+
+    # Record access
+
+    def strings(self, name, start=0, stop=None):
+        '''Values start:stop of a packed string column (image_file_name, image_extra or ann_extra).'''
+        offsets = self.columns[f'{name}_offsets']
+        stop = len(offsets) - 1 if stop is None else min(stop, len(offsets) - 1)
+        if start >= stop:
+            return []
+        bounds = offsets[start:stop + 1].tolist()
+        base = bounds[0]
+        raw = self.columns[f'{name}_bytes'][base:bounds[-1]].tobytes()
+        return [raw[a - base:b - base].decode('utf-8') for a, b in zip(bounds, bounds[1:])]
+
+    def file_names(self):
+        return self.strings('image_file_name')
+
+    def polygons(self, i):
+        '''Polygons of annotation i as a list of flat coordinate arrays (views into coords).'''
+        poly_offsets, coords = self.columns['poly_offsets'], self.columns['coords']
+        start, end = self.columns['ann_poly_offsets'][i:i + 2]
+        return [coords[poly_offsets[p]:poly_offsets[p + 1]] for p in range(start, end)]
+
+    def annotation_indices(self, image_id):
+        '''Row indices of the annotations of image_id (sorted once, then binary search).'''
+        if self._ann_order is None:
+            order = np.argsort(self.columns['ann_image_id'], kind='stable')
+            self._ann_order = (order, self.columns['ann_image_id'][order])
+        order, sorted_ids = self._ann_order
+        lo, hi = np.searchsorted(sorted_ids, [image_id, image_id + 1])
+        return order[lo:hi]
+
+    def _image_rows(self, start, stop):
+        c = self.columns
+        rows = zip(c['image_id'][start:stop].tolist(), c['image_width'][start:stop].tolist(),
+                   c['image_height'][start:stop].tolist(), self.strings('image_file_name', start, stop),
+                   self.strings('image_extra', start, stop))
+        for image_id, width, height, file_name, extra in rows:
+            img = {'id': image_id}
+            if width >= 0:
+                img['width'] = width
+            if height >= 0:
+                img['height'] = height
+            img['file_name'] = file_name
+            if extra:
+                img.update(json.loads(extra))
+            yield img
+
+    def _annotation_rows(self, start, stop):
+        c = self.columns
+        poly_offsets, coords = c['poly_offsets'], c['coords']
+        ann_poly_offsets = c['ann_poly_offsets'][start:stop + 1].tolist()
+        rows = zip(c['ann_id'][start:stop].tolist(), c['ann_image_id'][start:stop].tolist(),
+                   c['ann_category_id'][start:stop].tolist(), c['ann_polygonal'][start:stop].tolist(),
+                   c['ann_area'][start:stop].tolist(), c['ann_bbox'][start:stop].tolist(),
+                   c['ann_iscrowd'][start:stop].tolist(), self.strings('ann_extra', start, stop))
+        for k, (ann_id, image_id, category_id, polygonal, area, bbox, iscrowd, extra) in enumerate(rows):
+            ann = {'id': ann_id, 'image_id': image_id}
+            if category_id >= 0:
+                ann['category_id'] = category_id
+            if polygonal:
+                first, last = ann_poly_offsets[k], ann_poly_offsets[k + 1]
+                bounds = poly_offsets[first:last + 1].tolist()
+                ann['segmentation'] = [coords[a:b].tolist() for a, b in zip(bounds, bounds[1:])]
+            if area == area:  # NaN marks a missing value
+                ann['area'] = area
+            if bbox[0] == bbox[0]:
+                ann['bbox'] = bbox
+            ann['iscrowd'] = iscrowd
+            if extra:
+                ann.update(json.loads(extra))
+            yield ann
+
+    def image(self, i):
+        return next(self._image_rows(i, i + 1))
+
+    def annotation(self, i):
+        return next(self._annotation_rows(i, i + 1))
+
+    def iter_images(self, chunk_size=65536):
+        return iter(_Records(self._image_rows, self.num_images, chunk_size))
+
+    def iter_annotations(self, chunk_size=65536):
+        # Columns are converted to Python values a chunk at a time
+        return iter(_Records(self._annotation_rows, self.num_annotations, chunk_size))
+
+    def select(self, image_rows):
+        '''
+        Store of the images at image_rows (in that order) and their
+        annotations (in store order), with the same meta. Works on the
+        columns only; no record is built.
+        '''
+        c = self.columns
+        image_rows = np.asarray(image_rows, dtype=np.int64)
+        ann_rows = np.flatnonzero(np.isin(c['ann_image_id'], np.asarray(c['image_id'])[image_rows]))
+        columns = {name: np.asarray(c[name])[image_rows] for name in ('image_id', 'image_width', 'image_height')}
+        for name in ('ann_id', 'ann_image_id', 'ann_category_id', 'ann_bbox', 'ann_area', 'ann_iscrowd', 'ann_polygonal'):
+            columns[name] = np.asarray(c[name])[ann_rows]
+        for name, rows in (('image_file_name', image_rows), ('image_extra', image_rows), ('ann_extra', ann_rows)):
+            offsets = np.asarray(c[f'{name}_offsets'])
+            columns[f'{name}_bytes'] = np.asarray(c[f'{name}_bytes'])[gather_ranges(offsets[rows], offsets[rows + 1])]
+            columns[f'{name}_offsets'] = lengths_to_offsets(np.diff(offsets)[rows])
+        ann_poly_offsets, poly_offsets = np.asarray(c['ann_poly_offsets']), np.asarray(c['poly_offsets'])
+        polys = gather_ranges(ann_poly_offsets[ann_rows], ann_poly_offsets[ann_rows + 1])
+        columns['ann_poly_offsets'] = lengths_to_offsets(np.diff(ann_poly_offsets)[ann_rows])
+        columns['poly_offsets'] = lengths_to_offsets(np.diff(poly_offsets)[polys])
+        columns['coords'] = np.asarray(c['coords'])[gather_ranges(poly_offsets[polys], poly_offsets[polys + 1])]
+        return ColumnarCoco(columns, dict(self.meta))
+
+    # Conversion back to COCO
+
+    def as_coco(self):
+        '''COCO dict whose images and annotations are read-only lists built from the columns on access.'''
+        data = {k: v for k, v in self.meta.items() if k in ('info', 'licenses')}
+        data['images'] = _Records(self._image_rows, self.num_images)
+        data['annotations'] = _Records(self._annotation_rows, self.num_annotations)
+        data.update({k: v for k, v in self.meta.items() if k not in ('info', 'licenses')})
+        return data
+
+    def to_coco(self):
+        data = {k: v for k, v in self.meta.items() if k in ('info', 'licenses')}
+        data['images'] = list(self.iter_images())
+        data['annotations'] = list(self.iter_annotations())
+        data.update({k: v for k, v in self.meta.items() if k not in ('info', 'licenses')})
+        return data
+
+    def to_json(self, file_path):
+        with CocoStreamWriter(file_path, header=self.meta) as writer:
+            for img in self.iter_images():
+                writer.write_image(img)
+            for ann in self.iter_annotations():
+                writer.write_annotation(ann)
+
+    # Persistence
+
+    def save(self, path):
+        '''Save as path.npz when path ends with .npz, else as a directory of .npy files.'''
+        if path.endswith('.npz'):
+            np.savez(path, _meta=np.array(json.dumps(self.meta)), **self.columns)
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(column))
+        with open(os.path.join(path, META_NAME), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''Load a saved store; directory stores are memory-mapped unless mmap=False.'''
+        if path.endswith('.npz'):
+            with np.load(path) as npz:
+                columns = {name: npz[name] for name in npz.files if name != '_meta'}
+                meta = json.loads(str(npz['_meta']))
+            return cls(columns, meta)
+        columns = {}
+        for file_name in os.listdir(path):
+            if file_name.endswith('.npy'):
+                columns[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode='r' if mmap else None)
+        with open(os.path.join(path, META_NAME), 'r') as f:
+            meta = json.load(f)
+        return cls(columns, meta)
+
+
+def is_columnar(path):
+    return path.endswith('.npz') or os.path.isfile(os.path.join(path, META_NAME))
+
+
+def load_coco(path, columnar=False):
+    '''
+    COCO dict from either a JSON file or a columnar store. With columnar=True
+    a columnar store is returned as a ColumnarCoco instead of converted.
+    '''
+    if is_columnar(path):
+        store = ColumnarCoco.load(path)
+        return store if columnar else store.to_coco()
+    return load_json(path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m json_works.columnar <input .json|.npz|dir> <output .json|.npz|dir>")
+    src, dst = sys.argv[1:]
+    store = ColumnarCoco.load(src) if is_columnar(src) else ColumnarCoco.from_json(src)
+    if dst.endswith('.json'):
+        store.to_json(dst)
+    else:
+        store.save(dst)
+    print(f"Wrote {store.num_images} images, {store.num_annotations} annotations to {dst}")
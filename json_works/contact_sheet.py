@@ -0,0 +1,201 @@
+'''
+Contact sheets for reviewing annotations without one full-size file per image.
+
+Images are drawn as thumbnails (tile_size on the long side, JPEGs decoded at a
+reduced scale) with their contours or boxes scaled onto them and a caption
+strip with the file name and annotation count, then tiled columns x rows per
+sheet:
+
+    <output_dir>/sheet_0000.jpg, sheet_0001.jpg, ...
+    <output_dir>/sheets.json        sheet -> file names, in tile order
+
+Which images go on the sheets:
+    sample=N, by='source'     N random images per source folder
+    sample=N, by='category'   N random images per category (an image counts once)
+    changed_only=True         only images whose file or annotations changed
+                              since the last review of output_dir
+The sampling is seeded, so a re-run shows the same images. Sheets are
+rendered on the process pool of json_works.render, one task per sheet.
+'''
+
+import hashlib
+import json
+import os
+import random
+from collections import defaultdict
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .coco_index import CocoIndex
+from .incremental import MergeManifest
+from .instrument import logger
+from .journal import file_stamp
+from .render import render_images, report_failures
+
+STATE_NAME = '.contact_sheet_state.json'
+STATE_VERSION = 1
+CAPTION_HEIGHT = 14
+
+
+def sources_from_manifest(annotations_path):
+    '''file name -> source folder from the incremental merge manifest next to a combined file, if any.'''
+    manifest = MergeManifest(annotations_path)
+    return {file_name: name for name, entry in manifest.sources.items() for file_name in entry['file_names']}
+
+
+def _source_of(image, sources):
+    if sources and image['file_name'] in sources:
+        return sources[image['file_name']]
+    # Without a manifest, fall back to the folder part of the file name
+    return os.path.dirname(image['file_name'])
+
+
+def sample_images(data, sample, by='source', seed=42, sources=None):
+    '''
+    Up to `sample` images per source folder or per category, chosen with a
+    seeded shuffle. Returns image records in dataset order.
+    '''
+    index = CocoIndex(data)
+    groups = defaultdict(list)
+    if by == 'source':
+        for img in data['images']:
+            groups[_source_of(img, sources)].append(img['id'])
+    elif by == 'category':
+        for category in data.get('categories', []):
+            ids = dict.fromkeys(ann['image_id'] for ann in index.annotations_for_category(category['id']))
+            groups[category['id']] = list(ids)
+    else:
+        raise ValueError(f"Unknown sampling group: {by}, expected 'source' or 'category'")
+    rng = random.Random(seed)
+    chosen = set()
+    for key in sorted(groups, key=str):
+        ids = [image_id for image_id in groups[key] if image_id not in chosen]
+        rng.shuffle(ids)
+        chosen.update(ids[:sample])
+    return [img for img in data['images'] if img['id'] in chosen]
+
+
+def _tile(image_path, annotations, caption, tile_size, style):
+    '''One thumbnail with its annotations drawn at thumbnail scale and a caption strip below.'''
+    tile = Image.new('RGB', (tile_size, tile_size + CAPTION_HEIGHT), color='black')
+    draw = ImageDraw.Draw(tile)
+    font = ImageFont.load_default()
+    try:
+        with Image.open(image_path) as image:
+            width, height = image.size
+            image.draft('RGB', (tile_size, tile_size))
+            image = image.convert('RGB')
+            image.thumbnail((tile_size, tile_size))
+            scale = image.width / width
+            tile.paste(image, (0, 0))
+    except Exception as e:
+        draw.text((4, tile_size // 2), f"{type(e).__name__}", fill=(255, 0, 0), font=font)
+        draw.text((2, tile_size + 1), caption, fill=(255, 255, 255), font=font)
+        return tile
+    for annotation in annotations:
+        if style == 'boxes':
+            x, y, w, h = (v * scale for v in annotation['bbox'])
+            draw.rectangle([x, y, x + w, y + h], outline=(255, 0, 0), width=1)
+        else:
+            for points in annotation.get('segmentation') or ():
+                if isinstance(points, list) and len(points) >= 4 and len(points) % 2 == 0:
+                    xy = [(points[k] * scale, points[k + 1] * scale) for k in range(0, len(points), 2)]
+                    draw.line(xy + [xy[0]], fill=(255, 0, 0), width=1)
+    draw.text((2, tile_size + 1), caption, fill=(255, 255, 255), font=font)
+    return tile
+
+
+def render_sheet(output_path, tiles, tile_size=256, columns=6, style='contours'):
+    '''Render [(image_path, annotations, caption), ...] as one mosaic JPEG.'''
+    rows = -(-len(tiles) // columns)
+    cell_height = tile_size + CAPTION_HEIGHT
+    sheet = Image.new('RGB', (columns * tile_size, rows * cell_height), color=(32, 32, 32))
+    for k, (image_path, annotations, caption) in enumerate(tiles):
+        sheet.paste(_tile(image_path, annotations, caption, tile_size, style),
+                    ((k % columns) * tile_size, (k // columns) * cell_height))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    sheet.save(output_path, quality=85)
+
+
+class _ReviewState:
+    '''Image keys as of the last review, to find the images that changed since.'''
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, STATE_NAME)
+        self.keys = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    state = json.load(f)
+                if state.get('version') == STATE_VERSION:
+                    self.keys = state['keys']
+            except (OSError, ValueError, KeyError):
+                self.keys = {}
+
+    @staticmethod
+    def key(image_path, annotations, settings):
+        try:
+            stamp = file_stamp(image_path)
+        except OSError:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(stamp.encode())
+        digest.update(json.dumps(annotations, sort_keys=True, separators=(',', ':')).encode())
+        digest.update(json.dumps(settings, sort_keys=True, separators=(',', ':')).encode())
+        return digest.hexdigest()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'keys': self.keys}, f)
+        os.replace(tmp_path, self.path)
+
+
+def render_contact_sheets(data, image_folder, output_dir, style='contours', sample=None, by='source',
+                          changed_only=False, sources=None, tile_size=256, columns=6, rows=5, seed=42, workers=None):
+    '''
+    Render the selected images of a COCO dict into contact sheets under
+    output_dir; see the module docstring for the selection options. Sheets
+    from an earlier run are replaced. Returns the list of sheet paths.
+    '''
+    index = CocoIndex(data)
+    images = sample_images(data, sample, by=by, seed=seed, sources=sources) if sample else list(data['images'])
+
+    os.makedirs(output_dir, exist_ok=True)
+    state = _ReviewState(output_dir)
+    settings = {'style': style, 'tile_size': tile_size}
+    keys = {img['file_name']: state.key(os.path.join(image_folder, img['file_name']),
+                                        index.annotations_for(img['id']), settings) for img in images}
+    if changed_only:
+        changed = [img for img in images if keys[img['file_name']] is None
+                   or state.keys.get(img['file_name']) != keys[img['file_name']]]
+        logger.info("%s of %s images changed since the last review", len(changed), len(images))
+        images = changed
+
+    for name in os.listdir(output_dir):
+        if name.startswith('sheet_') and name.endswith('.jpg'):
+            os.remove(os.path.join(output_dir, name))
+
+    per_sheet = columns * rows
+    tasks, listing = [], {}
+    for start in range(0, len(images), per_sheet):
+        batch = images[start:start + per_sheet]
+        output_path = os.path.join(output_dir, f"sheet_{start // per_sheet:04d}.jpg")
+        tiles = []
+        for img in batch:
+            annotations = index.annotations_for(img['id'])
+            caption = f"{os.path.basename(img['file_name'])[:32]} ({len(annotations)})"
+            tiles.append((os.path.join(image_folder, img['file_name']), annotations, caption))
+        tasks.append((output_path, tiles, tile_size, columns, style))
+        listing[os.path.basename(output_path)] = [img['file_name'] for img in batch]
+
+    failures = render_images(render_sheet, tasks, workers=workers, desc=f"Rendering contact sheets for {output_dir}")
+    report_failures(failures)
+    failed = {os.path.basename(task[0]) for task, _ in failures}
+    for sheet, file_names in listing.items():
+        if sheet not in failed:
+            state.keys.update((file_name, keys[file_name]) for file_name in file_names)
+    state.save()
+    with open(os.path.join(output_dir, 'sheets.json'), 'w') as f:
+        json.dump(listing, f, indent=2)
+    return [task[0] for task in tasks if os.path.basename(task[0]) not in failed]
@@ -0,0 +1,270 @@
+'''
+Content-hash deduplication for dataset merges.
+
+Every source image is hashed (xxh3-128 when xxhash is installed, BLAKE2b
+otherwise) on a thread pool; hashes are cached on disk by path, size and mtime
+next to the merged output (.dedup_index.json), so unchanged files are not read
+again. While sources are merged, the first image with a given hash becomes the
+canonical copy and later byte-identical images are handled by policy:
+
+    remap  store the image once, move the duplicate's annotations onto it (default)
+    drop   store the image once, discard the duplicate's annotations
+    flag   keep both records, only report them
+
+Two different files exported under the same name no longer overwrite each
+other: the later one is stored as <source>_<name>. With near_duplicates=True a
+64-bit difference hash is computed as well and images within max_distance
+bits of an earlier one are reported (never merged); candidates are found by
+splitting the hash into max_distance + 1 bands, any pair that close agrees
+exactly on at least one band.
+
+The findings (duplicates, near duplicates, renames) are saved with the hashes.
+On an incremental merge, retain() carries over the findings of the sources that
+are not merged again, so the report covers the whole merged dataset and not
+just the folders merged in this run.
+'''
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from .instrument import logger
+from .verify import list_directory
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+POLICIES = ('remap', 'drop', 'flag')
+STATE_NAME = '.dedup_index.json'
+STATE_VERSION = 1
+HASH_ALGORITHM = 'xxh3_128' if xxhash is not None else 'blake2b'
+
+
+def content_hash(path, chunk_size=1 << 20):
+    digest = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def perceptual_hash(path, size=8):
+    '''64-bit difference hash: sign of the horizontal gradient of a (size + 1) x size grayscale thumbnail.'''
+    with Image.open(path) as image:
+        # JPEGs are decoded at a reduced scale, which is all the thumbnail needs
+        image.draft('L', ((size + 1) * 4, size * 4))
+        pixels = np.asarray(image.convert('L').resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = np.packbits((pixels[:, 1:] > pixels[:, :-1]).ravel())
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DedupIndex:
+    def __init__(self, state_dir, policy='remap', near_duplicates=False, max_distance=3, workers=16):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown dedup policy: {policy}, expected one of {POLICIES}")
+        self.state_path = os.path.join(state_dir, STATE_NAME)
+        self.policy = policy
+        self.near_duplicates = near_duplicates
+        self.max_distance = max_distance
+        self.workers = workers
+        self.hashes = {}     # abs path -> [size, mtime_ns, digest, phash]
+        self.canonical = {}  # digest -> [merged image id, file name, source, phash]
+        self.names = {}      # file name in the merged dataset -> digest
+        self.duplicates, self.near, self.renamed = [], [], []
+        self._previous = {'duplicates': [], 'near': [], 'renamed': []}  # findings of earlier runs, by kind
+        self._phashes = []   # (phash, file name) of canonical images
+        self._buckets = defaultdict(list)
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    state = json.load(f)
+                if state.get('version') == STATE_VERSION and state.get('algorithm') == HASH_ALGORITHM:
+                    self.hashes = state['hashes']
+                    self.canonical = state['canonical']
+                    findings = state.get('findings', {})
+                    self._previous = {kind: [tuple(row) for row in findings.get(kind, [])] for kind in self._previous}
+            except (OSError, ValueError, KeyError):
+                self.hashes, self.canonical = {}, {}
+                self._previous = {'duplicates': [], 'near': [], 'renamed': []}
+        self._rebuild()
+
+    def _rebuild(self):
+        self.names = {entry[1]: digest for digest, entry in self.canonical.items()}
+        self._phashes = []
+        self._buckets = defaultdict(list)
+        for entry in self.canonical.values():
+            if entry[3] is not None:
+                self._add_phash(entry[3], entry[1])
+
+    def retain(self, sources):
+        '''
+        Forget canonical images of every source not listed, e.g. before a full
+        rebuild, and the earlier runs' findings about them.
+        '''
+        sources = set(sources)
+        self.canonical = {digest: entry for digest, entry in self.canonical.items() if entry[2] in sources}
+        self._previous = {kind: [row for row in rows if row[0] in sources] for kind, rows in self._previous.items()}
+        self._rebuild()
+
+    def _findings(self):
+        '''Findings carried over from earlier runs followed by this run's.'''
+        return {'duplicates': self._previous['duplicates'] + self.duplicates,
+                'near': self._previous['near'] + self.near,
+                'renamed': self._previous['renamed'] + self.renamed}
+
+    def hash_files(self, paths):
+        '''{path: (digest, phash)} for every readable path, reusing cached hashes.'''
+        def one(path):
+            key = os.path.abspath(path)
+            try:
+                st = os.stat(key)
+                cached = self.hashes.get(key)
+                if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                    digest, phash = cached[2], cached[3]
+                else:
+                    digest, phash = content_hash(key), None
+                if self.near_duplicates and phash is None:
+                    phash = perceptual_hash(key)
+                return path, key, [st.st_size, st.st_mtime_ns, digest, phash]
+            except Exception as e:
+                logger.warning("Could not hash %s: %s: %s", path, type(e).__name__, e)
+                return path, key, None
+
+        paths = list(paths)
+        result = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            for path, key, entry in tqdm(executor.map(one, paths), total=len(paths), desc="Hashing images"):
+                if entry is not None:
+                    self.hashes[key] = entry
+                    result[path] = (entry[2], entry[3])
+        return result
+
+    def source(self, images_dir, name):
+        '''Resolver for one source folder; its whole image directory is hashed up front.'''
+        return SourceResolver(self, images_dir, name)
+
+    def _near_match(self, phash):
+        bands = self.max_distance + 1
+        width = 64 // bands
+        mask = (1 << width) - 1
+        seen = set()
+        for band in range(bands):
+            for k in self._buckets.get((band, (phash >> (band * width)) & mask), ()):
+                if k not in seen:
+                    seen.add(k)
+                    distance = hamming(phash, self._phashes[k][0])
+                    if distance <= self.max_distance:
+                        return self._phashes[k][1], distance
+        return None
+
+    def _add_phash(self, phash, file_name):
+        bands = self.max_distance + 1
+        width = 64 // bands
+        mask = (1 << width) - 1
+        k = len(self._phashes)
+        self._phashes.append((phash, file_name))
+        for band in range(bands):
+            self._buckets[(band, (phash >> (band * width)) & mask)].append(k)
+
+    def report(self):
+        findings = self._findings()
+        return {
+            'policy': self.policy,
+            'duplicates': [{'source': s, 'file_name': f, 'canonical': c} for s, f, c in findings['duplicates']],
+            'near_duplicates': [{'source': s, 'file_name': f, 'similar_to': c, 'distance': d}
+                                for s, f, c, d in findings['near']],
+            'renamed': [{'source': s, 'file_name': f, 'stored_as': n} for s, f, n in findings['renamed']],
+        }
+
+    def __str__(self):
+        findings = self._findings()
+        return (f"Dedup ({self.policy}): {len(findings['duplicates'])} exact duplicates, "
+                f"{len(findings['near'])} near duplicates, {len(findings['renamed'])} renamed on name clashes")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'algorithm': HASH_ALGORITHM,
+                       'hashes': self.hashes, 'canonical': self.canonical, 'findings': self._findings()}, f)
+        os.replace(tmp_path, self.state_path)
+
+
+class SourceResolver:
+    '''
+    Per-source view of a DedupIndex, handed to CocoMerger.add. final_names maps
+    the source's file names to the names stored in the merged dataset, and
+    placements maps those stored names to the source files to copy; neither
+    contains the duplicates that are stored only once. depends_on lists the
+    other sources whose images those duplicates were mapped onto.
+    '''
+
+    def __init__(self, index, images_dir, name):
+        self.index = index
+        self.images_dir = images_dir
+        self.name = name
+        self.keep_annotations = index.policy == 'remap'
+        self.final_names = {}
+        self.placements = {}
+        self.depends_on = set()
+        listing = sorted(list_directory(images_dir))
+        self._hashes = index.hash_files([os.path.join(images_dir, file_name) for file_name in listing])
+
+    def _hash(self, file_name):
+        path = os.path.join(self.images_dir, file_name)
+        if path not in self._hashes and os.path.isfile(path):
+            self._hashes.update(self.index.hash_files([path]))
+        return self._hashes.get(path, (None, None))
+
+    def resolve(self, image):
+        '''Merged id of the canonical copy when image duplicates one and the policy merges them, else None.'''
+        digest, _ = self._hash(image['file_name'])
+        entry = self.index.canonical.get(digest) if digest is not None else None
+        if entry is None:
+            return None
+        self.index.duplicates.append((self.name, image['file_name'], entry[1]))
+        logger.debug("%s in %s duplicates %s", image['file_name'], self.name, entry[1])
+        if self.index.policy == 'flag':
+            return None
+        if entry[2] != self.name:
+            self.depends_on.add(entry[2])
+        return entry[0]
+
+    def register(self, image, new_id):
+        '''Record a stored image; returns the file name it is stored under.'''
+        file_name = image['file_name']
+        digest, phash = self._hash(file_name)
+        final = file_name
+        owner = self.index.names.get(final)
+        if owner is not None and digest is not None and owner != digest:
+            prefix = os.path.basename(os.path.normpath(self.name))
+            final = f"{prefix}_{file_name}"
+            k = 1
+            while final in self.index.names:
+                final = f"{prefix}_{k}_{file_name}"
+                k += 1
+            self.index.renamed.append((self.name, file_name, final))
+        exact = digest is not None and digest in self.index.canonical
+        if digest is not None:
+            self.index.names[final] = digest
+            self.index.canonical.setdefault(digest, [new_id, final, self.name, phash])
+        if phash is not None and not exact:
+            match = self.index._near_match(phash)
+            if match is not None:
+                self.index.near.append((self.name, file_name, match[0], match[1]))
+            self.index._add_phash(phash, final)
+        self.final_names[file_name] = final
+        self.placements[final] = os.path.join(self.images_dir, file_name)
+        return final
@@ -0,0 +1,147 @@
+'''
+Vectorized geometry for COCO boxes and polygons.
+
+Boxes are (N, 4) arrays, xywh unless the function says otherwise. Polygons
+are either one flat [x0, y0, x1, y1, ...] sequence, or many polygons packed
+into one flat coordinate array plus an offsets array (polygon p is
+coords[offsets[p]:offsets[p + 1]]), the layout json_works.columnar stores.
+Width/height arguments may be scalars or one value per box.
+'''
+
+import numpy as np
+
+
+def _boxes(bboxes):
+    return np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+
+
+def _scale(width, height):
+    width = np.asarray(width, dtype=np.float64)
+    height = np.asarray(height, dtype=np.float64)
+    return np.stack(np.broadcast_arrays(width, height, width, height), axis=-1)
+
+
+def normalize_bboxes(bboxes, width, height):
+    return _boxes(bboxes) / _scale(width, height)
+
+
+def denormalize_bboxes(bboxes, width, height):
+    return _boxes(bboxes) * _scale(width, height)
+
+
+def xywh_to_xyxy(bboxes):
+    boxes = _boxes(bboxes).copy()
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes
+
+
+def xyxy_to_xywh(bboxes):
+    boxes = _boxes(bboxes).copy()
+    boxes[:, 2:] -= boxes[:, :2]
+    return boxes
+
+
+def is_normalized(bboxes):
+    '''True when every coordinate of every box is <= 1; checked once per dataset, not per box.'''
+    boxes = _boxes(bboxes)
+    return boxes.size > 0 and bool(np.all(boxes <= 1))
+
+
+def clip_bboxes(bboxes, width, height):
+    '''Clip xywh boxes to the image; boxes fully outside end up with zero width/height.'''
+    boxes = xywh_to_xyxy(bboxes)
+    boxes = np.clip(boxes, 0, _scale(width, height))
+    return xyxy_to_xywh(boxes)
+
+
+def clamp_points(points, width, height):
+    '''Clamp a flat polygon into [0, width] x [0, height]; returns an (N, 2) array.'''
+    xy = np.asarray(points).reshape(-1, 2)
+    return np.clip(xy, 0, [width, height])
+
+
+def clip_polygon(points, x_min, y_min, x_max, y_max):
+    '''
+    Clip a flat polygon to a rectangle (Sutherland-Hodgman, vectorized over the
+    vertices for each of the four edges). Returns an (M, 2) array, empty when
+    the polygon lies outside the rectangle.
+    '''
+    xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    for axis, bound, keep_greater in ((0, x_min, True), (0, x_max, False), (1, y_min, True), (1, y_max, False)):
+        if len(xy) == 0:
+            break
+        nxt = np.roll(xy, -1, axis=0)
+        cur_in = xy[:, axis] >= bound if keep_greater else xy[:, axis] <= bound
+        nxt_in = np.roll(cur_in, -1)
+        delta = nxt[:, axis] - xy[:, axis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(delta != 0, (bound - xy[:, axis]) / delta, 0.0)
+        crossing = xy + t[:, None] * (nxt - xy)
+        crossing[:, axis] = bound
+        # For each edge (cur -> nxt): emit cur if inside, then the crossing point if the edge crosses
+        out = np.empty((2 * len(xy), 2))
+        out[0::2] = xy
+        out[1::2] = crossing
+        keep = np.empty(2 * len(xy), dtype=bool)
+        keep[0::2] = cur_in
+        keep[1::2] = cur_in != nxt_in
+        xy = out[keep]
+    return xy
+
+
+def polygon_area(points):
+    xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = xy[:, 0], xy[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def _packed(coords, offsets):
+    coords = np.asarray(coords, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    # Vertex index ranges; a trailing odd coordinate is ignored
+    return coords[0::2], coords[1::2], offsets[:-1] // 2, offsets[1:] // 2
+
+
+def polygon_areas(coords, offsets):
+    '''Shoelace area of every polygon in a packed coords/offsets layout.'''
+    x, y, starts, ends = _packed(coords, offsets)
+    n = min(len(x), len(y))
+    x, y = x[:n], y[:n]
+    # Successor of each vertex within its own polygon; the last one wraps to the first
+    nxt = np.arange(1, n + 1)
+    valid = ends > starts
+    nxt[ends[valid] - 1] = starts[valid]
+    nxt[nxt >= n] = 0
+    cross = x * y[nxt] - y * x[nxt]
+    cumulative = np.concatenate(([0.0], np.cumsum(cross)))
+    return 0.5 * np.abs(cumulative[ends] - cumulative[starts])
+
+
+def polygons_bbox(coords, offsets):
+    '''xywh bbox of every polygon in a packed coords/offsets layout (NaN for empty polygons).'''
+    x, y, starts, ends = _packed(coords, offsets)
+    boxes = np.full((len(starts), 4), np.nan)
+    valid = ends > starts
+    if not valid.any():
+        return boxes
+    s, e = starts[valid], ends[valid]
+    # reduceat reduces [s[i], s[i + 1]); polygons are contiguous, so only the last needs cutting at e[-1]
+    x, y = x[:e[-1]], y[:e[-1]]
+    x_min, y_min = np.minimum.reduceat(x, s), np.minimum.reduceat(y, s)
+    boxes[valid, 0] = x_min
+    boxes[valid, 1] = y_min
+    boxes[valid, 2] = np.maximum.reduceat(x, s) - x_min
+    boxes[valid, 3] = np.maximum.reduceat(y, s) - y_min
+    return boxes
+
+
+def segmentation_bbox(segmentation):
+    '''xywh bbox enclosing all polygons of one COCO segmentation.'''
+    xy = np.concatenate([np.asarray(poly, dtype=np.float64) for poly in segmentation]).reshape(-1, 2)
+    x_min, y_min = xy.min(axis=0)
+    x_max, y_max = xy.max(axis=0)
+    return [float(x_min), float(y_min), float(x_max - x_min), float(y_max - y_min)]
+
+
+def segmentation_area(segmentation):
+    return sum(polygon_area(poly) for poly in segmentation)
@@ -0,0 +1,200 @@
+'''
+Manifest for incremental merges into one combined COCO file.
+
+Every source folder is recorded with
+    - a key hashed from its annotation JSON (full content) and its image
+      directory listing (name, size, mtime), plus the merge settings
+    - the image and annotation id ranges reserved for it in the combined file
+    - the file names it contributed, so outputs can be cleaned up later
+    - the sources it depends on through deduplication (its duplicates were
+      stored as another source's image)
+On the next run, sources whose key is unchanged keep their records and ids:
+they are streamed over from the previous combined file. Changed sources are
+merged again into their old id range when they still fit, otherwise into a
+fresh range after every other source, like new sources. A source that
+depends on a changed or removed one is merged again too. The manifest also
+stores the combined file's size and mtime; if the file was touched by
+anything else, everything is merged again.
+'''
+
+import hashlib
+import json
+import os
+
+from .build_cache import file_digest
+from .json_io import iter_top_level
+from .merge import CocoMerger
+
+MANIFEST_NAME = '.merge_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def source_key(json_path, images_dir, settings=None):
+    '''Hash of a source's annotation file, its image listing and the merge settings.'''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(file_digest(json_path).encode())
+    try:
+        with os.scandir(images_dir) as entries:
+            listing = sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in entries if e.is_file())
+    except FileNotFoundError:
+        listing = []
+    digest.update(json.dumps(listing, separators=(',', ':')).encode())
+    digest.update(json.dumps(settings, sort_keys=True, separators=(',', ':')).encode())
+    return digest.hexdigest()
+
+
+def _count_kept(source, image_filter):
+    '''(file names of the images image_filter keeps, number of their annotations) of a path or COCO dict.'''
+    if isinstance(source, str):
+        records = iter_top_level(source)
+    else:
+        records = [('images', img) for img in source.get('images', [])]
+        records += [('annotations', ann) for ann in source.get('annotations', [])]
+    kept_ids, file_names, annotation_image_ids = set(), [], []
+    for key, value in records:
+        if key == 'images' and (image_filter is None or image_filter(value)):
+            kept_ids.add(value['id'])
+            file_names.append(value['file_name'])
+        elif key == 'annotations':
+            # Annotations may come before images, so they are matched once everything is read
+            annotation_image_ids.append(value['image_id'])
+    return file_names, sum(1 for image_id in annotation_image_ids if image_id in kept_ids)
+
+
+def _output_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class MergePlan:
+    def __init__(self, unchanged, changed, added, removed):
+        self.unchanged = unchanged
+        self.changed = changed
+        self.added = added
+        self.removed = removed
+
+    @property
+    def to_merge(self):
+        return self.changed + self.added
+
+    def __str__(self):
+        return (f"{len(self.unchanged)} sources unchanged, {len(self.changed)} changed, "
+                f"{len(self.added)} new, {len(self.removed)} removed")
+
+
+class MergeManifest:
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.manifest_path = os.path.join(os.path.dirname(os.path.abspath(output_path)), MANIFEST_NAME)
+        self.sources = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                # Records of unchanged sources come from the previous output,
+                # so the manifest is only trusted together with that exact file
+                if manifest.get('version') == MANIFEST_VERSION and manifest.get('output') == _output_stamp(output_path):
+                    self.sources = manifest['sources']
+            except (OSError, ValueError, KeyError):
+                self.sources = {}
+
+    def plan(self, keys):
+        '''Compare source name -> key with the recorded sources.'''
+        unchanged, changed, added = [], [], []
+        for name, key in keys.items():
+            entry = self.sources.get(name)
+            if entry is None:
+                added.append(name)
+            elif entry['key'] == key:
+                unchanged.append(name)
+            else:
+                changed.append(name)
+        removed = [name for name in self.sources if name not in keys]
+        # Duplicates stored as another source's image must follow that source
+        stale = set(changed) | set(removed)
+        while True:
+            dependents = [name for name in unchanged if stale & set(self.sources[name].get('depends_on', ()))]
+            if not dependents:
+                break
+            for name in dependents:
+                unchanged.remove(name)
+                changed.append(name)
+                stale.add(name)
+        return MergePlan(unchanged, changed, added, removed)
+
+    def _next_ids(self, exclude):
+        image_end = annotation_end = 1
+        for name, entry in self.sources.items():
+            if name not in exclude:
+                image_end = max(image_end, entry['image_ids'][1])
+                annotation_end = max(annotation_end, entry['annotation_ids'][1])
+        return image_end, annotation_end
+
+    def copy_unchanged(self, writer, unchanged):
+        '''
+        Stream the records of the unchanged sources from the previous output
+        into writer, ids untouched. Returns the number of images copied.
+        '''
+        ranges = [self.sources[name]['image_ids'] for name in unchanged]
+        annotation_ranges = [self.sources[name]['annotation_ids'] for name in unchanged]
+        if not ranges or not os.path.exists(self.output_path):
+            return 0
+        kept = set()
+        for key, value in iter_top_level(self.output_path):
+            if key == 'images':
+                if any(start <= value['id'] < stop for start, stop in ranges):
+                    kept.add(value['id'])
+                    writer.write_image(value)
+            elif key == 'annotations':
+                # Checked by id as well: a deduplicated source's annotations can sit on another source's image
+                if value['image_id'] in kept and any(start <= value['id'] < stop for start, stop in annotation_ranges):
+                    writer.write_annotation(value)
+        return len(kept)
+
+    def merge_source(self, writer, name, key, source, image_filter=None, resolver=None, on_record=None):
+        '''
+        Merge one new or changed source (path or COCO dict; a path is streamed
+        twice, once to count its records and once to merge them). It keeps its
+        previous id range when its images and annotations still fit, otherwise
+        it is placed after every other source. resolver and on_record are passed
+        on to CocoMerger.add. Returns the CocoMerger id map.
+        '''
+        file_names, annotation_count = _count_kept(source, image_filter)
+
+        entry = self.sources.get(name)
+        if (entry is not None and len(file_names) <= entry['image_ids'][1] - entry['image_ids'][0]
+                and annotation_count <= entry['annotation_ids'][1] - entry['annotation_ids'][0]):
+            image_range, annotation_range = entry['image_ids'], entry['annotation_ids']
+        else:
+            image_start, annotation_start = self._next_ids(exclude={name})
+            image_range = [image_start, image_start + len(file_names)]
+            annotation_range = [annotation_start, annotation_start + annotation_count]
+
+        merger = CocoMerger(writer, image_range[0], annotation_range[0], header_keys=())
+        id_map = merger.add(source, image_filter=image_filter, name=name, resolver=resolver, on_record=on_record)
+        self.sources[name] = {
+            'key': key,
+            'image_ids': image_range,
+            'annotation_ids': annotation_range,
+            'file_names': list(resolver.placements) if resolver is not None else file_names,
+            'depends_on': sorted(resolver.depends_on) if resolver is not None else [],
+        }
+        return id_map
+
+    def file_names(self, name):
+        entry = self.sources.get(name)
+        return set(entry['file_names']) if entry else set()
+
+    def remove(self, name):
+        return self.sources.pop(name, None)
+
+    def save(self):
+        '''Record the sources together with the output they were written to; call after the output is closed.'''
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'output': _output_stamp(self.output_path),
+                       'sources': self.sources}, f)
+        os.replace(tmp_path, self.manifest_path)
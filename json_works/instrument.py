@@ -0,0 +1,115 @@
+'''
+Logging and per-stage instrumentation for the scripts.
+
+Everything logs through the `json_works` logger. setup_logging() shows INFO
+and above by default, so per-image messages (logged at DEBUG) stay quiet
+unless JSON_WORKS_LOG_LEVEL=DEBUG or verbose=True.
+
+Stages are timed with `with stage('copy') as s: ...`; set s.items / s.bytes
+inside the block for images/s and MB/s. Setting JSON_WORKS_PROFILE to a stage
+name runs that stage under cProfile, writes <stage>.prof to the current
+directory and logs the top functions. write_report() dumps every stage of the
+run as JSON.
+'''
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+from . import json_io
+
+logger = logging.getLogger('json_works')
+
+
+def setup_logging(level=None, verbose=False):
+    if level is None:
+        level = 'DEBUG' if verbose else os.environ.get('JSON_WORKS_LOG_LEVEL', 'INFO')
+    logging.basicConfig(format='%(message)s')
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+class StageStats:
+    def __init__(self, name, items=0, bytes=0):
+        self.name = name
+        self.items = items
+        self.bytes = bytes
+        self.seconds = 0.0
+
+    def as_dict(self):
+        rates = {}
+        if self.seconds > 0:
+            rates = {'items_per_s': self.items / self.seconds, 'mb_per_s': self.bytes / 1e6 / self.seconds}
+        return {'name': self.name, 'seconds': self.seconds, 'items': self.items, 'bytes': self.bytes, **rates}
+
+    def __str__(self):
+        text = f"{self.name}: {self.seconds:.2f} s"
+        if self.items:
+            text += f", {self.items} items"
+            if self.seconds > 0:
+                text += f" ({self.items / self.seconds:.1f}/s)"
+        if self.bytes:
+            text += f", {self.bytes / 1e6:.1f} MB"
+            if self.seconds > 0:
+                text += f" ({self.bytes / 1e6 / self.seconds:.1f} MB/s)"
+        return text
+
+
+class Instrumentation:
+    def __init__(self, profile_stage=None, profile_dir='.'):
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name, items=0, bytes=0):
+        stats = StageStats(name, items, bytes)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stats
+        finally:
+            if profiler:
+                profiler.disable()
+            stats.seconds = time.perf_counter() - start
+            self.stages.append(stats)
+            logger.info(str(stats))
+            if profiler:
+                self._dump_profile(name, profiler)
+
+    def _dump_profile(self, name, profiler):
+        path = os.path.join(self.profile_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+        logger.info("Profile of %s written to %s\n%s", name, path, out.getvalue())
+
+    def report(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'total_seconds': time.time() - self.started,
+            'stages': [stats.as_dict() for stats in self.stages],
+        }
+
+    def write_report(self, file_path):
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        json_io.save_json(self.report(), file_path, indent=2)
+        logger.info("Run report written to %s", file_path)
+
+
+# Shared by the scripts and the library helpers they call
+instrumentation = Instrumentation(profile_stage=os.environ.get('JSON_WORKS_PROFILE'))
+
+
+def stage(name, items=0, bytes=0):
+    return instrumentation.stage(name, items, bytes)
+
+
+def write_report(file_path):
+    instrumentation.write_report(file_path)
@@ -0,0 +1,112 @@
+'''
+Append-only checkpoint journal for long-running jobs.
+
+Every completed unit of work (one image copied, augmented or rendered) is
+appended as one JSON line with the sizes of the files it produced and an
+optional key describing its inputs:
+
+    {"unit": "12:img.png", "key": "1234:1718000000", "outputs": {"images/img.png": 1234}}
+
+A unit counts as done on a restart only when its key still matches and every
+output still exists with the recorded size, so files left half-written by a
+crash are redone. The first line holds the job settings; a journal written
+with other settings is discarded. A line cut short by a kill is dropped on
+load. Output paths are stored relative to the journal, like the render cache.
+'''
+
+import json
+import os
+
+from .instrument import logger
+
+
+def file_stamp(path):
+    '''size:mtime of a file, the cheap input key used for source images.'''
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _canonical(settings):
+    return json.loads(json.dumps(settings, sort_keys=True))
+
+
+class Journal:
+    def __init__(self, path, settings=None):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.settings = _canonical(settings)
+        self.entries = {}
+        self._file = None
+        if os.path.exists(path):
+            self._load()
+        if self._file is None:
+            os.makedirs(self.base_dir, exist_ok=True)
+            self._file = open(path, 'w', encoding='utf-8')
+            self._write({'settings': self.settings})
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        # Keep only complete lines; a kill mid-write leaves a partial last one
+        complete = content[:content.rfind(b'\n') + 1]
+        lines = complete.decode('utf-8', errors='replace').splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else None
+        except ValueError:
+            header = None
+        if header is None or header.get('settings') != self.settings:
+            if lines:
+                logger.info("Settings changed since %s was written, starting over", self.path)
+            return
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+                self.entries[entry['unit']] = entry
+            except (ValueError, KeyError):
+                continue
+        if len(complete) != len(content):
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(complete))
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self.entries:
+            logger.info("Resuming from %s: %s units already done", self.path, len(self.entries))
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        # Flushed per unit so a killed process loses at most the unit in flight
+        self._file.flush()
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.base_dir)
+
+    def is_done(self, unit, key=None):
+        entry = self.entries.get(unit)
+        if entry is None or entry.get('key') != key:
+            return False
+        for rel, size in entry['outputs'].items():
+            try:
+                if os.path.getsize(os.path.join(self.base_dir, rel)) != size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def record(self, unit, outputs, key=None):
+        entry = {'unit': unit, 'key': key,
+                 'outputs': {self._relative(path): os.path.getsize(path) for path in outputs}}
+        self.entries[unit] = entry
+        self._write(entry)
+
+    def completed(self):
+        return set(self.entries)
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,241 @@
+'''
+JSON reading and writing for the COCO files used across the scripts.
+
+load_json/save_json use orjson when it is installed and fall back to the
+stdlib json module otherwise (JSON_WORKS_BACKEND=json forces the fallback).
+Output is compact by default; pass indent=2 for a human-readable file.
+
+iter_top_level walks the top-level object of a COCO file and yields the
+`images` and `annotations` arrays one record at a time, so only a buffer of
+the file and the current record are held in memory. CocoStreamWriter is the
+write side: records are spooled to temporary files as they arrive and
+assembled into one JSON document on close, so the header (info, licenses,
+categories) can be set at any point before that.
+'''
+
+import json
+import os
+import re
+import shutil
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+STREAM_KEYS = ('images', 'annotations')
+BACKENDS = ('orjson', 'json') if orjson is not None else ('json',)
+_backend = os.environ.get('JSON_WORKS_BACKEND', BACKENDS[0])
+if _backend not in BACKENDS:
+    _backend = 'json'
+
+
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"JSON backend {name!r} is not available, choose from {BACKENDS}")
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+def loads(data, backend=None):
+    if (backend or _backend) == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=None, backend=None):
+    '''Serialize to str; compact unless indent is given.'''
+    if (backend or _backend) == 'orjson':
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    if indent:
+        return json.dumps(obj, indent=indent)
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def load_json(file_path, backend=None):
+    if (backend or _backend) == 'orjson':
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(data, file_path, indent=None, backend=None):
+    if (backend or _backend) == 'orjson':
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=option))
+        return
+    with open(file_path, 'w', encoding='utf-8') as f:
+        if indent:
+            json.dump(data, f, indent=indent)
+        else:
+            json.dump(data, f, separators=(',', ':'))
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+
+    def fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"Malformed JSON in {self.f.name}: expected one of {chars!r}, got {c!r}")
+        self.pos += 1
+        return c
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Usually a record cut at the chunk boundary; a real error surfaces at EOF
+                if not self.fill():
+                    raise
+                continue
+            # A number ending exactly at the buffer end may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_top_level(file_path, stream_keys=STREAM_KEYS, chunk_size=1 << 16):
+    '''
+    Yield (key, value) for every top-level member of a JSON object. Members in
+    stream_keys whose value is an array yield (key, element) once per element.
+    '''
+    with open(file_path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.expect(':')
+            if key in stream_keys and reader.peek() == '[':
+                reader.pos += 1
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield key, reader.decode()
+                        if reader.expect(',]') == ']':
+                            break
+            else:
+                yield key, reader.decode()
+            if reader.expect(',}') == '}':
+                return
+
+
+def iter_records(file_path, key):
+    '''Yield the elements of one top-level array, e.g. iter_records(path, 'annotations').'''
+    for member, value in iter_top_level(file_path):
+        if member == key:
+            yield value
+
+
+def iter_images(file_path):
+    return iter_records(file_path, 'images')
+
+
+def iter_annotations(file_path):
+    return iter_records(file_path, 'annotations')
+
+
+def read_header(file_path):
+    '''Every top-level member except the streamed images/annotations arrays.'''
+    return {key: value for key, value in iter_top_level(file_path) if key not in STREAM_KEYS}
+
+
+class CocoStreamWriter:
+    '''
+    Write a compact COCO file record by record. Output key order is info,
+    licenses, images, annotations, then any other header keys (categories,
+    ...), the order of the dicts these scripts build. The file is written to a
+    temporary name and renamed into place on close.
+    '''
+
+    def __init__(self, file_path, header=None):
+        self.file_path = file_path
+        self.header = dict(header or {})
+        self.counts = {key: 0 for key in STREAM_KEYS}
+        spool_dir = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(spool_dir, exist_ok=True)
+        self._spools = {key: tempfile.TemporaryFile('w+', encoding='utf-8', dir=spool_dir) for key in STREAM_KEYS}
+
+    def _write(self, key, record):
+        spool = self._spools[key]
+        if self.counts[key]:
+            spool.write(',')
+        spool.write(dumps(record))
+        self.counts[key] += 1
+
+    def write_image(self, image):
+        self._write('images', image)
+
+    def write_annotation(self, annotation):
+        self._write('annotations', annotation)
+
+    def close(self):
+        leading = [key for key in ('info', 'licenses') if key in self.header]
+        trailing = [key for key in self.header if key not in leading and key not in STREAM_KEYS]
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            out.write('{')
+            for key in leading:
+                out.write(f"{dumps(key)}:{dumps(self.header[key])},")
+            for i, key in enumerate(STREAM_KEYS):
+                spool = self._spools[key]
+                spool.seek(0)
+                out.write(f"{',' if i else ''}{dumps(key)}:[")
+                shutil.copyfileobj(spool, out)
+                out.write(']')
+            for key in trailing:
+                out.write(f",{dumps(key)}:{dumps(self.header[key])}")
+            out.write('}')
+        os.replace(tmp_path, self.file_path)
+        self._discard()
+
+    def _discard(self):
+        for spool in self._spools.values():
+            spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
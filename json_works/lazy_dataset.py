@@ -0,0 +1,96 @@
+'''
+Lazy view of an augmented dataset, generated on demand instead of on disk.
+
+Samples are ordered like augment_coco's output: every original first, then
+each image's variants in config order. Variant pixels use the same per-(image,
+variant) seeds as augment_coco, so sample i here matches image i of a
+materialized run. Decoded source images can be kept in a bounded LRU cache so
+the variants of one image do not decode it again.
+'''
+
+import os
+from collections import OrderedDict
+
+import cv2
+
+from .augmentation import AUGMENTATIONS, apply_variant, build_transforms, variant_file_name, variant_seed
+from .coco_index import CocoIndex
+
+
+class LazyAugmentedDataset:
+    def __init__(self, data, image_folder, config=AUGMENTATIONS, seed=42, cache_size=0):
+        '''
+        data: COCO dict or path to a COCO JSON
+        cache_size: number of decoded source images to keep (0 disables the cache)
+        '''
+        self.index = CocoIndex.from_json(data) if isinstance(data, str) else CocoIndex(data)
+        self.image_folder = image_folder
+        self.config = config
+        self.seed = seed
+        self.cache_size = cache_size
+        self.images = list(self.index.data['images'])
+        self.variant_names = list(config)
+        self._transforms = None
+        self._cache = OrderedDict()
+
+    def __getstate__(self):
+        # DataLoader workers rebuild transforms and start with an empty cache
+        state = self.__dict__.copy()
+        state['_transforms'] = None
+        state['_cache'] = OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self.images) * (1 + len(self.variant_names))
+
+    def locate(self, idx):
+        '''(image record, variant index or None for the original) for sample idx.'''
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Sample index {idx} out of range for {len(self)} samples")
+        n = len(self.images)
+        if idx < n:
+            return self.images[idx], None
+        image_index, variant = divmod(idx - n, len(self.variant_names))
+        return self.images[image_index], variant
+
+    def image_info(self, idx):
+        '''Image record for sample idx, with the file name a materialized run would use.'''
+        img, variant = self.locate(idx)
+        if variant is None:
+            return img
+        info = img.copy()
+        info['file_name'] = variant_file_name(img['file_name'], self.variant_names[variant])
+        return info
+
+    def _decode(self, img):
+        cached = self._cache.get(img['id'])
+        if cached is not None:
+            self._cache.move_to_end(img['id'])
+            return cached
+        path = os.path.join(self.image_folder, img['file_name'])
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image {path}")
+        if self.cache_size > 0:
+            self._cache[img['id']] = image
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return image
+
+    def __getitem__(self, idx):
+        img, variant = self.locate(idx)
+        image = self._decode(img)
+        annotations = self.index.annotations_for(img['id'])
+        if variant is None:
+            # Cached arrays are shared, so callers get their own copy
+            return (image.copy() if self.cache_size > 0 else image), annotations
+        if self._transforms is None:
+            self._transforms = build_transforms(self.config)
+        transform = self._transforms[self.variant_names[variant]]
+        return apply_variant(transform, image, variant_seed(self.seed, img['id'], variant)), annotations
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
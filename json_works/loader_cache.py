@@ -0,0 +1,193 @@
+'''
+Precomputed per-image training records, written once and memory-mapped.
+
+A split's COCO JSON is turned into flat arrays, saved as raw .npy files in a
+directory (like the columnar store) so every job maps them instead of parsing
+and converting JSON at start-up:
+
+    image_id, width, height          one row per image
+    name_bytes, name_offsets         UTF-8 file names, packed
+    box_offsets                      box_offsets[i]:box_offsets[i + 1] are image i's objects
+    boxes                            float32 XYXY, one row per object
+    category_ids, iscrowd            per object
+    ann_poly_offsets, poly_offsets   polygons of each object, as in json_works.columnar
+    coords                           float32 polygon coordinates
+
+Objects are grouped by image, so record i is a handful of slices: O(1)
+random access without an index. meta.json holds the categories and the image
+folder, relative to the cache so both can be moved together.
+LoaderCache(path)[i] gives a plain record; detectron2_record(i) and
+torchvision_target(i) give the dicts those libraries' loaders expect.
+
+    python -m json_works.loader_cache train_split.json train/images train/loader_cache
+'''
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from .columnar import ColumnarCoco, gather_ranges, lengths_to_offsets
+from .geometry import xywh_to_xyxy
+
+META_NAME = 'meta.json'
+CACHE_VERSION = 1
+BOX_MODE_XYXY_ABS = 0  # detectron2.structures.BoxMode.XYXY_ABS
+
+
+def write_loader_cache(data, image_folder, output_dir):
+    '''
+    Write the loader cache of a COCO dict (or ColumnarCoco) whose images live
+    in image_folder. Annotations of unknown images are left out. The cache is
+    built next to output_dir and swapped in when complete.
+    '''
+    store = data if isinstance(data, ColumnarCoco) else ColumnarCoco.from_coco(data)
+    c = store.columns
+    image_ids = np.asarray(c['image_id'])
+    ann_image_ids = np.asarray(c['ann_image_id'])
+
+    # Objects in image order: stable sort by the row of their image
+    row_of = np.argsort(image_ids, kind='stable')
+    pos = np.searchsorted(image_ids[row_of], ann_image_ids)
+    pos = np.minimum(pos, max(len(image_ids) - 1, 0))
+    known = image_ids[row_of][pos] == ann_image_ids if len(image_ids) else np.zeros(len(ann_image_ids), dtype=bool)
+    ann_row = row_of[pos]
+    order = np.flatnonzero(known)[np.argsort(ann_row[known], kind='stable')]
+    box_offsets = lengths_to_offsets(np.bincount(ann_row[order], minlength=len(image_ids)))
+
+    # Polygons of the selected objects, in the same order
+    ann_poly_offsets = np.asarray(c['ann_poly_offsets'])
+    poly_offsets = np.asarray(c['poly_offsets'])
+    polys = gather_ranges(ann_poly_offsets[order], ann_poly_offsets[order + 1])
+    coord_index = gather_ranges(poly_offsets[polys], poly_offsets[polys + 1])
+
+    boxes = np.asarray(c['ann_bbox'], dtype=np.float64)[order]
+    columns = {
+        'image_id': image_ids.astype(np.int64),
+        'width': np.asarray(c['image_width']).astype(np.int32),
+        'height': np.asarray(c['image_height']).astype(np.int32),
+        'name_bytes': np.asarray(c['image_file_name_bytes']),
+        'name_offsets': np.asarray(c['image_file_name_offsets']),
+        'box_offsets': box_offsets,
+        'boxes': np.nan_to_num(xywh_to_xyxy(boxes)).astype(np.float32),
+        'category_ids': np.asarray(c['ann_category_id'])[order].astype(np.int32),
+        'iscrowd': np.asarray(c['ann_iscrowd'])[order].astype(np.uint8),
+        'ann_poly_offsets': lengths_to_offsets(np.diff(ann_poly_offsets)[order]),
+        'poly_offsets': lengths_to_offsets(np.diff(poly_offsets)[polys]),
+        'coords': np.asarray(c['coords'])[coord_index].astype(np.float32),
+    }
+    categories = store.meta.get('categories', [])
+    meta = {
+        'version': CACHE_VERSION,
+        'image_root': os.path.relpath(os.path.abspath(image_folder), os.path.abspath(output_dir)),
+        'categories': categories,
+    }
+
+    tmp_dir = output_dir.rstrip(os.sep) + '.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, column in columns.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(column))
+    with open(os.path.join(tmp_dir, META_NAME), 'w') as f:
+        json.dump(meta, f)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(tmp_dir, output_dir)
+    return output_dir
+
+
+class LoaderCache:
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, META_NAME), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != CACHE_VERSION:
+            raise ValueError(f"{path} is a loader cache of version {self.meta.get('version')}, expected {CACHE_VERSION}")
+        self.columns = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r' if mmap else None)
+                        for name in os.listdir(path) if name.endswith('.npy')}
+        self.image_root = os.path.normpath(os.path.join(path, self.meta['image_root']))
+        # Detectron2 and torchvision expect contiguous class indices
+        self.categories = self.meta['categories']
+        self.thing_classes = [cat.get('name', str(cat['id'])) for cat in self.categories]
+        self._contiguous = {cat['id']: k for k, cat in enumerate(self.categories)}
+
+    def __len__(self):
+        return len(self.columns['image_id'])
+
+    def file_name(self, i):
+        start, end = self.columns['name_offsets'][i:i + 2]
+        return bytes(self.columns['name_bytes'][start:end]).decode('utf-8')
+
+    def __getitem__(self, i):
+        '''Record of image i; arrays are views into the mapped files.'''
+        c = self.columns
+        if i < 0:
+            i += len(self)
+        first, last = c['box_offsets'][i:i + 2]
+        ann_poly = c['ann_poly_offsets'][first:last + 1]
+        poly_offsets, coords = c['poly_offsets'], c['coords']
+        polygons = []
+        for a, b in zip(ann_poly[:-1].tolist(), ann_poly[1:].tolist()):
+            polygons.append([coords[poly_offsets[p]:poly_offsets[p + 1]] for p in range(a, b)])
+        return {
+            'file_name': os.path.join(self.image_root, self.file_name(i)),
+            'image_id': int(c['image_id'][i]),
+            'width': int(c['width'][i]),
+            'height': int(c['height'][i]),
+            'boxes': c['boxes'][first:last],
+            'category_ids': c['category_ids'][first:last],
+            'iscrowd': c['iscrowd'][first:last],
+            'polygons': polygons,
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def labels(self, category_ids):
+        return np.array([self._contiguous[cat_id] for cat_id in category_ids.tolist()], dtype=np.int64)
+
+    def detectron2_record(self, i):
+        '''Dataset dict as registered in detectron2's DatasetCatalog (boxes in XYXY_ABS).'''
+        record = self[i]
+        labels = self.labels(record['category_ids']).tolist()
+        annotations = []
+        for box, label, iscrowd, polygons in zip(record['boxes'].tolist(), labels, record['iscrowd'].tolist(),
+                                                 record['polygons']):
+            annotations.append({'bbox': box, 'bbox_mode': BOX_MODE_XYXY_ABS, 'category_id': label,
+                                'segmentation': [poly.tolist() for poly in polygons], 'iscrowd': iscrowd})
+        return {'file_name': record['file_name'], 'image_id': record['image_id'], 'height': record['height'],
+                'width': record['width'], 'annotations': annotations}
+
+    def detectron2_dicts(self):
+        return [self.detectron2_record(i) for i in range(len(self))]
+
+    def torchvision_target(self, i):
+        '''(image path, target) as torchvision detection models take them; tensors when torch is installed.'''
+        record = self[i]
+        boxes = np.array(record['boxes'], dtype=np.float32)
+        target = {
+            'boxes': boxes,
+            'labels': self.labels(record['category_ids']),
+            'image_id': record['image_id'],
+            'area': (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]),
+            'iscrowd': np.array(record['iscrowd'], dtype=np.int64),
+        }
+        try:
+            import torch
+        except ImportError:
+            return record['file_name'], target
+        return record['file_name'], {key: torch.as_tensor(value) for key, value in target.items()}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        sys.exit("usage: python -m json_works.loader_cache <split .json|.npz|dir> <image folder> <output dir>")
+    src, images, dst = sys.argv[1:]
+    from .stats import load_store
+    store = load_store(src)
+    write_loader_cache(store, images, dst)
+    print(f"Wrote loader records for {store.num_images} images, {store.num_annotations} annotations to {dst}")
@@ -0,0 +1,161 @@
+'''
+Put image files into split/merge directories without duplicating bytes.
+
+Modes:
+    hardlink  new directory entry for the same inode
+    reflink   copy-on-write clone (btrfs, xfs, ...), Linux FICLONE ioctl
+    symlink   relative symbolic link to the source
+    copy      real byte copy
+
+Every mode falls back to a real copy when the link cannot be made, e.g. a
+hardlink across filesystems or a reflink on ext4. Files are processed on a
+bounded thread pool and the returned stats report how many bytes were actually
+written versus avoided. With a Journal, pairs already placed by an earlier
+(possibly interrupted) run are skipped and each finished pair is recorded.
+'''
+
+import errno
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from .journal import file_stamp
+
+MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# errnos that mean "this filesystem pair cannot link/clone", not a real failure
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP,
+                    errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EACCES}
+
+
+class MaterializeStats:
+    def __init__(self):
+        self.files = Counter()
+        self.bytes_written = 0
+        self.bytes_avoided = 0
+        self.fallbacks = 0
+        self.resumed = 0
+
+    def add(self, requested_mode, used_mode, size):
+        self.files[used_mode] += 1
+        if used_mode == 'copy':
+            self.bytes_written += size
+        else:
+            self.bytes_avoided += size
+        if used_mode != requested_mode:
+            self.fallbacks += 1
+
+    def merge(self, other):
+        self.files.update(other.files)
+        self.bytes_written += other.bytes_written
+        self.bytes_avoided += other.bytes_avoided
+        self.fallbacks += other.fallbacks
+        self.resumed += other.resumed
+        return self
+
+    def as_dict(self):
+        return {
+            'files': dict(self.files),
+            'bytes_written': self.bytes_written,
+            'bytes_avoided': self.bytes_avoided,
+            'fallbacks': self.fallbacks,
+            'resumed': self.resumed,
+        }
+
+    def __str__(self):
+        modes = ', '.join(f"{mode}: {count}" for mode, count in sorted(self.files.items()))
+        return (f"Materialized {sum(self.files.values())} files ({modes}); "
+                f"{self.bytes_written / 1e6:.1f} MB written, {self.bytes_avoided / 1e6:.1f} MB avoided"
+                + (f", {self.fallbacks} fell back to copy" if self.fallbacks else "")
+                + (f", {self.resumed} already done" if self.resumed else ""))
+
+
+def _remove_existing(dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "reflink is not supported on this platform")
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copymode(src, dst)
+
+
+def _link(src, dst, mode):
+    if mode == 'hardlink':
+        os.link(src, dst)
+    elif mode == 'reflink':
+        _reflink(src, dst)
+    elif mode == 'symlink':
+        os.symlink(os.path.relpath(os.path.abspath(src), os.path.dirname(os.path.abspath(dst))), dst)
+    else:
+        raise ValueError(f"Unknown materialize mode: {mode}")
+
+
+def materialize_file(src, dst, mode='hardlink', data=None):
+    '''
+    Place src at dst using mode, falling back to a copy. Returns (used_mode, size).
+    data, when given, is the content of src already in memory; a copy writes it
+    instead of reading src again.
+    '''
+    if mode not in MODES:
+        raise ValueError(f"Unknown materialize mode: {mode}, expected one of {MODES}")
+    size = os.path.getsize(src)
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return mode, size
+
+    if mode != 'copy':
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return mode, size
+        _remove_existing(dst)
+        try:
+            _link(src, dst, mode)
+            return mode, size
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+    else:
+        # shutil.copy would write through a symlink/hardlink left by a previous link-mode run
+        _remove_existing(dst)
+
+    if data is None:
+        shutil.copy(src, dst)
+    else:
+        with open(dst, 'wb') as f:
+            f.write(data)
+        shutil.copymode(src, dst)
+    return 'copy', size
+
+
+def materialize_files(pairs, mode='hardlink', workers=8, desc="Materializing images", journal=None):
+    '''Materialize (src, dst) pairs on a bounded thread pool. Returns MaterializeStats.'''
+    pairs = list(pairs)
+    stats = MaterializeStats()
+    if journal is not None:
+        keys = [file_stamp(src) if os.path.exists(src) else None for src, _ in pairs]
+        pending = [(pair, key) for pair, key in zip(pairs, keys) if not journal.is_done(pair[1], key)]
+        stats.resumed = len(pairs) - len(pending)
+        pairs = [pair for pair, _ in pending]
+        keys = [key for _, key in pending]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(lambda pair: materialize_file(pair[0], pair[1], mode), pairs)
+        for k, (used_mode, size) in enumerate(tqdm(results, total=len(pairs), desc=desc)):
+            stats.add(mode, used_mode, size)
+            if journal is not None:
+                journal.record(pairs[k][1], [pairs[k][1]], keys[k])
+    return stats
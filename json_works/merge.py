@@ -0,0 +1,165 @@
+'''
+N-way COCO merge that streams records straight to a CocoStreamWriter.
+
+Sources are added one at a time, either as a path (streamed with
+iter_top_level, never loaded whole) or as an already loaded dict. Image and
+annotation ids are remapped on the fly; the only per-source state kept is the
+old -> new image id map. A dedup resolver (json_works.dedup) can map an image
+onto an already merged copy and rename it on a file name clash. An on_record
+callback sees every record next to what was written for it, so callers can
+build per-image work (copies, plots) in the same pass instead of reading the
+merged file back.
+'''
+
+from .instrument import logger
+from .json_io import CocoStreamWriter, iter_records, iter_top_level
+
+HEADER_KEYS = ('info', 'licenses', 'categories')
+
+
+class CocoMerger:
+    def __init__(self, writer, next_image_id=1, next_annotation_id=1, shared_counter=False, header_keys=HEADER_KEYS):
+        '''
+        shared_counter: draw image and annotation ids from one counter, as the
+            fasterrcnn update_ids did, so ids are unique across both
+        header_keys: top-level keys taken from the first source that has them
+        '''
+        self.writer = writer
+        self.shared_counter = shared_counter
+        self.header_keys = header_keys
+        self._next = {'image': next_image_id, 'annotation': next_image_id if shared_counter else next_annotation_id}
+        self.sources = []
+
+    def _new_id(self, kind):
+        kind = 'image' if self.shared_counter else kind
+        new_id = self._next[kind]
+        self._next[kind] += 1
+        return new_id
+
+    @property
+    def next_image_id(self):
+        return self._next['image']
+
+    @property
+    def next_annotation_id(self):
+        return self._next['image' if self.shared_counter else 'annotation']
+
+    def _header(self, key, value):
+        if key in self.header_keys and key not in self.writer.header:
+            self.writer.header[key] = value
+
+    def _image(self, image, image_filter, id_map, skipped, stats, copy, resolver):
+        if image_filter is not None and not image_filter(image):
+            skipped[image['id']] = False
+            return None
+        if resolver is not None:
+            target = resolver.resolve(image)
+            if target is not None:
+                # Stored once: its annotations move onto the merged copy or are dropped
+                if resolver.keep_annotations:
+                    id_map[image['id']] = target
+                else:
+                    skipped[image['id']] = True
+                stats['duplicates'] += 1
+                return None
+        image = image.copy() if copy else image
+        new_id = self._new_id('image')
+        id_map[image['id']] = new_id
+        image['id'] = new_id
+        if resolver is not None:
+            image['file_name'] = resolver.register(image, new_id)
+        self.writer.write_image(image)
+        stats['images'] += 1
+        return image
+
+    def _annotation(self, annotation, id_map, skipped, stats, copy):
+        new_image_id = id_map.get(annotation['image_id'])
+        if new_image_id is None:
+            if annotation['image_id'] not in skipped:
+                stats['orphans'] += 1
+            elif skipped[annotation['image_id']]:
+                stats['dropped'] += 1
+            return None
+        annotation = annotation.copy() if copy else annotation
+        annotation['id'] = self._new_id('annotation')
+        annotation['image_id'] = new_image_id
+        self.writer.write_annotation(annotation)
+        stats['annotations'] += 1
+        return annotation
+
+    def add(self, source, image_filter=None, name=None, resolver=None, on_record=None):
+        '''
+        Append one source (path or COCO dict). image_filter(image) -> False drops
+        the image and its annotations. resolver is a dedup SourceResolver for the
+        source's image folder. on_record(kind, record, merged) is called with
+        every image and annotation of the source, unchanged, and the record
+        written for it (None when it was filtered out, stored as a duplicate
+        or dropped). Returns the old -> new image id map.
+        '''
+        # skipped: old image id -> True when it is a duplicate whose annotations are dropped
+        id_map, skipped = {}, {}
+        # Records streamed from a path are remapped in place unless the callback needs the originals
+        copy = on_record is not None
+
+        def image(value, copy):
+            merged = self._image(value, image_filter, id_map, skipped, stats, copy, resolver)
+            if on_record is not None:
+                on_record('image', value, merged)
+
+        def annotation(value, copy):
+            merged = self._annotation(value, id_map, skipped, stats, copy)
+            if on_record is not None:
+                on_record('annotation', value, merged)
+
+        stats = {'name': name or (source if isinstance(source, str) else f"source {len(self.sources)}"),
+                 'images': 0, 'annotations': 0, 'orphans': 0, 'duplicates': 0, 'dropped': 0}
+
+        if isinstance(source, str):
+            seen_images = deferred = False
+            for key, value in iter_top_level(source):
+                if key == 'images':
+                    seen_images = True
+                    image(value, copy)
+                elif key == 'annotations':
+                    if not seen_images:
+                        # Annotations stored before images: remap them in a second pass
+                        deferred = True
+                        continue
+                    annotation(value, copy)
+                else:
+                    self._header(key, value)
+            if deferred:
+                for value in iter_records(source, 'annotations'):
+                    annotation(value, copy)
+        else:
+            for key, value in source.items():
+                if key not in ('images', 'annotations'):
+                    self._header(key, value)
+            for value in source.get('images', []):
+                image(value, True)
+            for value in source.get('annotations', []):
+                annotation(value, True)
+
+        logger.info("Merged %s: %s images, %s annotations%s", stats['name'], stats['images'], stats['annotations'],
+                    f", {stats['duplicates']} duplicate images stored once" if stats['duplicates'] else "")
+        if stats['orphans']:
+            logger.warning("%s annotations in %s refer to non-existent images", stats['orphans'], stats['name'])
+        if stats['dropped']:
+            logger.warning("Dropped %s annotations of %s duplicate images in %s", stats['dropped'], stats['duplicates'],
+                           stats['name'])
+        self.sources.append(stats)
+        return id_map
+
+
+def merge_coco(sources, output_path, header=None, next_image_id=1, next_annotation_id=1, shared_counter=False,
+               image_filter=None):
+    '''
+    Merge any number of COCO sources into output_path. Returns the merger so
+    callers can continue numbering from merger.next_image_id.
+    '''
+    with CocoStreamWriter(output_path, header=header) as writer:
+        merger = CocoMerger(writer, next_image_id, next_annotation_id, shared_counter=shared_counter)
+        for source in sources:
+            merger.add(source, image_filter=image_filter)
+    logger.info("Combined data: %s images, %s annotations", writer.counts['images'], writer.counts['annotations'])
+    return merger
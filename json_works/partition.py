@@ -0,0 +1,157 @@
+'''
+Split one job over K workers by hashing image ids into K shards.
+
+A worker given Partition(i, K) (or "i/K" on the command line) only handles
+the images that hash into shard i, so K local processes, or processes on
+several machines sharing the storage, can run augment, the annotation_check
+renderers or the copy helpers side by side. Every worker keeps its own
+journal and render cache and, when done, writes a partial manifest:
+
+    <output_dir>/.partials/<stage>-<i>-of-<K>.json
+        {"stage", "shard", "count", "items", "outputs", "failures", "data"}
+
+where data is the COCO dict the worker produced, if any. reduce_partials
+checks that all K partials are there and stitches their data into one COCO
+file, renumbering image and annotation ids shard by shard so they are
+globally unique and the same for the same partials.
+'''
+
+import hashlib
+import os
+import re
+
+from .instrument import logger
+from .json_io import CocoStreamWriter, dumps, load_json
+from .merge import CocoMerger
+
+PARTIAL_DIR = '.partials'
+PARTIAL_VERSION = 1
+
+
+def shard_of(key, count):
+    '''Stable shard of an image id (or file name): the same in every process and on every machine.'''
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+class Partition:
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        '''"i/K" -> Partition(i, K).'''
+        match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', str(value))
+        if match is None:
+            raise ValueError(f"Expected a shard as i/K, got {value!r}")
+        return cls(int(match.group(1)), int(match.group(2)))
+
+    @property
+    def suffix(self):
+        return f"{self.index}-of-{self.count}"
+
+    def owns(self, key):
+        return shard_of(key, self.count) == self.index
+
+    def select(self, data):
+        '''The shard's part of a COCO dict: its images and their annotations, header unchanged.'''
+        images = [img for img in data['images'] if self.owns(img['id'])]
+        image_ids = {img['id'] for img in images}
+        subset = data.copy()
+        subset['images'] = images
+        subset['annotations'] = [ann for ann in data['annotations'] if ann['image_id'] in image_ids]
+        return subset
+
+    def __str__(self):
+        return f"shard {self.index}/{self.count}"
+
+
+def partial_path(output_dir, stage, partition):
+    return os.path.join(output_dir, PARTIAL_DIR, f"{stage}-{partition.suffix}.json")
+
+
+def write_partial(output_dir, stage, partition, items=0, outputs=(), failures=(), data=None):
+    '''
+    Record a finished shard. outputs are paths the worker wrote, stored
+    relative to output_dir; failures are (source, error) pairs.
+    '''
+    path = partial_path(output_dir, stage, partition)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        'version': PARTIAL_VERSION,
+        'stage': stage,
+        'shard': partition.index,
+        'count': partition.count,
+        'items': items,
+        'outputs': [os.path.relpath(p, output_dir) for p in outputs],
+        'failures': [[str(source), error] for source, error in failures],
+        'data': data,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(dumps(record))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_partials(output_dir, stage):
+    '''Partials of one stage in shard order; raises RuntimeError if any shard is missing or they disagree on K.'''
+    partial_dir = os.path.join(output_dir, PARTIAL_DIR)
+    pattern = re.compile(rf"{re.escape(stage)}-(\d+)-of-(\d+)\.json")
+    found = {}
+    for name in os.listdir(partial_dir) if os.path.isdir(partial_dir) else ():
+        match = pattern.fullmatch(name)
+        if match:
+            found[(int(match.group(1)), int(match.group(2)))] = os.path.join(partial_dir, name)
+    counts = {count for _, count in found}
+    if not found:
+        raise RuntimeError(f"No partial manifests for {stage} in {partial_dir}")
+    if len(counts) != 1:
+        raise RuntimeError(f"Partial manifests for {stage} in {partial_dir} were written with different shard counts "
+                           f"{sorted(counts)}; remove the stale ones")
+    count = counts.pop()
+    missing = [index for index in range(count) if (index, count) not in found]
+    if missing:
+        raise RuntimeError(f"{stage}: shards {missing} of {count} have not finished")
+    return [load_json(found[(index, count)]) for index in range(count)]
+
+
+def reduce_partials(output_dir, stage, output_path=None, next_image_id=0, next_annotation_id=0):
+    '''
+    Check every shard of a stage finished and, with output_path, stitch their
+    data into one COCO file. Returns a summary dict.
+    '''
+    partials = load_partials(output_dir, stage)
+    summary = {
+        'stage': stage,
+        'shards': len(partials),
+        'items': sum(p['items'] for p in partials),
+        'outputs': sum(len(p['outputs']) for p in partials),
+        'failures': [failure for p in partials for failure in p['failures']],
+    }
+    if output_path is not None:
+        writer = CocoStreamWriter(output_path)
+        merger = CocoMerger(writer, next_image_id, next_annotation_id)
+        for partial in partials:
+            if partial['data'] is not None:
+                merger.add(partial['data'], name=f"shard {partial['shard']}")
+        writer.close()
+        summary['images'] = writer.counts['images']
+        summary['annotations'] = writer.counts['annotations']
+    logger.info("%s: %s shards, %s items, %s failures", stage, summary['shards'], summary['items'],
+                len(summary['failures']))
+    for source, error in summary['failures']:
+        logger.warning("  %s: %s", source, error)
+    return summary
+
+
+def clear_partials(output_dir, stage):
+    partial_dir = os.path.join(output_dir, PARTIAL_DIR)
+    if not os.path.isdir(partial_dir):
+        return
+    for name in os.listdir(partial_dir):
+        if name.startswith(f"{stage}-") and name.endswith('.json'):
+            os.remove(os.path.join(partial_dir, name))
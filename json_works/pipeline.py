@@ -0,0 +1,139 @@
+'''
+Single-pass copy-and-render pipeline: every source image is read from disk
+once and fanned out from memory.
+
+    read  ->  [at most queue_size in flight]  ->  render (process pool)
+      \\-> write/link into the destinations
+
+Reader threads load each source file's bytes, place it at its destinations
+(a link where the mode allows, otherwise a write of the bytes already read)
+and hand the bytes to the render processes of json_works.render, so the
+per-annotation drawing loops run outside this process's GIL. Only the encoded
+bytes and the render arguments are pickled; decoding happens in the worker.
+The renderer gets an in-memory file object where it would get a path, so
+PIL.Image.open works unchanged and cv2 code goes through imread() below.
+queue_size caps how many images are held in memory at once; reads of later
+images overlap rendering of earlier ones. With renderers=1 the reader threads
+render themselves, without a pool.
+'''
+
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from .materialize import MaterializeStats, materialize_file
+from .render import _init_worker, _mp_context, _render_task, resolve_workers
+
+
+class ImageJob:
+    '''
+    One source image: copy it to each of destinations and, with render_args,
+    call render_fn(image, *render_args). render_args follow the render task
+    convention (annotations, output_path, ...); extra_outputs are linked from
+    output_path once it is written, for the same rendering under other names.
+    '''
+
+    def __init__(self, source, destinations=(), render_args=None, extra_outputs=()):
+        self.source = source
+        self.destinations = list(destinations)
+        self.render_args = render_args
+        self.extra_outputs = list(extra_outputs)
+
+
+def imread(source):
+    '''cv2.imread for a path, or decode the in-memory file a pipeline renderer receives.'''
+    # Imported here so PIL-only pipelines do not pay for cv2
+    import cv2
+    import numpy as np
+    if isinstance(source, io.BytesIO):
+        return cv2.imdecode(np.frombuffer(source.getbuffer(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(source)
+
+
+def run_pipeline(jobs, render_fn=None, mode='hardlink', readers=4, renderers=None, queue_size=16,
+                 desc="Processing images"):
+    '''
+    Run every job; returns (MaterializeStats, failures) where failures are
+    (job, error) pairs, as with render_images.
+    '''
+    jobs = list(jobs)
+    to_render = sum(1 for job in jobs if job.render_args is not None)
+    renderers = resolve_workers(renderers, to_render)
+    stats = MaterializeStats()
+    failures = []
+    lock = threading.Lock()
+    # Released when a render finishes, which bounds the bytes held in memory
+    slots = threading.BoundedSemaphore(max(1, queue_size))
+    progress = tqdm(total=len(jobs), desc=desc)
+    executor = None
+    if renderers > 1:
+        executor = ProcessPoolExecutor(max_workers=renderers, mp_context=_mp_context(),
+                                       initializer=_init_worker, initargs=(render_fn,))
+
+    def fail(job, e):
+        with lock:
+            failures.append((job, e if isinstance(e, str) else f"{type(e).__name__}: {e}"))
+
+    def done():
+        with lock:
+            progress.update()
+
+    def finish(job, error):
+        if error is None:
+            try:
+                output_path = job.render_args[1]
+                for extra in job.extra_outputs:
+                    os.makedirs(os.path.dirname(os.path.abspath(extra)), exist_ok=True)
+                    materialize_file(output_path, extra, 'hardlink')
+            except Exception as e:
+                error = e
+        if error is not None:
+            fail(job, error)
+        done()
+
+    def rendered(job, future):
+        slots.release()
+        error = future.exception()
+        finish(job, future.result() if error is None else error)
+
+    def read(job):
+        try:
+            needs_bytes = job.render_args is not None or (job.destinations and mode == 'copy')
+            data = None
+            if needs_bytes:
+                with open(job.source, 'rb') as f:
+                    data = f.read()
+            for dst in job.destinations:
+                os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                used_mode, size = materialize_file(job.source, dst, mode, data=data)
+                with lock:
+                    stats.add(mode, used_mode, size)
+        except Exception as e:
+            fail(job, e)
+            done()
+            return
+        if job.render_args is None:
+            done()
+        elif executor is None:
+            finish(job, _render_task((io.BytesIO(data), *job.render_args), render_fn))
+        else:
+            slots.acquire()
+            try:
+                future = executor.submit(_render_task, (io.BytesIO(data), *job.render_args))
+            except Exception:
+                slots.release()
+                raise
+            future.add_done_callback(lambda future, job=job: rendered(job, future))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, readers)) as reader_pool:
+            for _ in reader_pool.map(read, jobs):
+                pass
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        progress.close()
+    return stats, failures
@@ -0,0 +1,134 @@
+'''
+Process-pool runner for the annotation_check renderers.
+
+A render task is the tuple of arguments for one call of a renderer such as
+plot_contours(image_path, annotations, output_path). The renderer is handed to
+each worker once at start-up, so only the small per-image tuples are pickled,
+in chunks of `chunksize`. Both the serial and the parallel path call the same
+renderer with the same arguments, so the files they write are identical.
+
+Tasks start with (source_path, annotations, output_path); that is what the
+optional BuildCache keys on to skip images whose inputs have not changed.
+Tasks of other shapes (e.g. augmentation) can be checkpointed in a Journal
+instead, with unit_of(task) naming the unit of work and its outputs. Both are
+updated as each task finishes, so a killed run resumes where it stopped.
+'''
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from .build_cache import render_settings
+from .instrument import logger
+
+_worker_render_fn = None
+
+
+def _init_worker(render_fn):
+    global _worker_render_fn
+    _worker_render_fn = render_fn
+
+
+def _render_task(task, render_fn=None):
+    try:
+        (render_fn or _worker_render_fn)(*task)
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def _mp_context():
+    # The scripts do their work at import time, so workers must not re-import
+    # __main__ the way spawn/forkserver would
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def resolve_workers(workers, task_count):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, task_count))
+
+
+def output_unit(task):
+    '''Journal unit of a render task: named by and producing its output_path.'''
+    return task[2], [task[2]], None
+
+
+def render_images(render_fn, tasks, workers=None, chunksize=8, desc="Rendering", cache=None, settings=None,
+                  journal=None, unit_of=output_unit):
+    '''
+    Run render_fn(*task) for every task, serially when workers == 1, else on a
+    process pool (workers=None uses every core).
+    With a BuildCache, tasks whose key is unchanged are skipped and outputs no
+    longer produced by any task are evicted; settings are extra render options
+    folded into the key.
+    With a Journal, tasks whose unit_of(task) -> (unit, outputs, key) is
+    already done are skipped and every finished task is recorded.
+    Failures do not stop the run; they are returned as (task, error) pairs.
+    '''
+    tasks = list(tasks)
+    if cache is None:
+        if journal is None:
+            return _run_tasks(render_fn, tasks, workers, chunksize, desc)
+        units = {id(task): unit_of(task) for task in tasks}
+        pending = [task for task in tasks if not journal.is_done(units[id(task)][0], units[id(task)][2])]
+        if len(pending) < len(tasks):
+            logger.info("%s of %s tasks already done, resuming", len(tasks) - len(pending), len(tasks))
+
+        def done(task):
+            unit, outputs, key = units[id(task)]
+            journal.record(unit, outputs, key)
+        return _run_tasks(render_fn, pending, workers, chunksize, desc, on_done=done)
+
+    pending, keys = cache.stale_tasks(tasks, render_settings(render_fn, settings))
+    if len(pending) < len(tasks):
+        logger.info("%s of %s images unchanged since last render, skipping", len(tasks) - len(pending), len(tasks))
+    # Recorded as each image finishes; the cache journals them until save()
+    key_of = {id(task): key for task, key in zip(pending, keys)}
+    failures = _run_tasks(render_fn, pending, workers, chunksize, desc,
+                          on_done=lambda task: cache.record(task[2], key_of[id(task)]))
+
+    for task, _ in failures:
+        cache.forget(task[2])
+    cache.gc([task[2] for task in tasks])
+    cache.save()
+    return failures
+
+
+def _run_tasks(render_fn, tasks, workers, chunksize, desc, on_done=None):
+    if not tasks:
+        return []
+    workers = resolve_workers(workers, len(tasks))
+
+    if workers == 1:
+        results = (_render_task(task, render_fn) for task in tasks)
+        return _collect_failures(tasks, results, desc, on_done)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(),
+                             initializer=_init_worker, initargs=(render_fn,)) as executor:
+        results = executor.map(_render_task, tasks, chunksize=max(1, chunksize))
+        return _collect_failures(tasks, results, desc, on_done)
+
+
+def _collect_failures(tasks, results, desc, on_done=None):
+    failures = []
+    for task, error in zip(tasks, tqdm(results, total=len(tasks), desc=desc)):
+        if error is not None:
+            failures.append((task, error))
+        elif on_done is not None:
+            on_done(task)
+    return failures
+
+
+def report_failures(failures, action="render"):
+    if not failures:
+        return
+    logger.warning("%s images failed to %s:", len(failures), action)
+    for task, error in failures:
+        # Render tasks are tuples; pipeline jobs carry their source path
+        source = task.source if hasattr(task, 'source') else task[0]
+        logger.warning("  %s: %s", source, error)
@@ -0,0 +1,199 @@
+'''
+WebDataset-style tar shards for split datasets.
+
+A split is written as <prefix>-000000.tar, <prefix>-000001.tar, ... next to
+<prefix>_index.json. A new shard starts after max_samples samples or once a
+shard reaches max_bytes. Every sample is two tar members sharing a key:
+
+    00000042.jpg    the image file's bytes, unchanged
+    00000042.json   {"image": <image record>, "annotations": [...]}
+
+so shards can be streamed sequentially by any tar/WebDataset reader. The
+index holds the dataset header (info, licenses, categories), the shard list
+and, per sample, the byte offset and size of both members inside its shard;
+ShardedDataset uses it to read any sample with one seek. Closing the writer
+removes the shards of an earlier, larger run with the same prefix, so the
+directory only holds what the new index lists.
+'''
+
+import io
+import os
+import re
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from .coco_index import CocoIndex
+from .json_io import dumps, load_json, loads, save_json
+
+INDEX_SUFFIX = '_index.json'
+
+
+def shard_name(prefix, number):
+    return f"{prefix}-{number:06d}.tar"
+
+
+def _read_ahead(paths, workers, window):
+    '''Yield (path, bytes or exception) in order, with up to `window` reads in flight.'''
+    def read(path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(read, path)))
+            if len(pending) >= window:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+class ShardWriter:
+    def __init__(self, output_dir, prefix, max_samples=1000, max_bytes=1 << 30):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.samples = []
+        self._tar = None
+        self._tmp_path = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _open(self):
+        name = shard_name(self.prefix, len(self.shards))
+        self._tmp_path = os.path.join(self.output_dir, name + '.tmp')
+        self._tar = tarfile.open(self._tmp_path, 'w', format=tarfile.PAX_FORMAT)
+        self.shards.append({'name': name, 'samples': 0, 'bytes': 0})
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        shard = self.shards[-1]
+        final_path = os.path.join(self.output_dir, shard['name'])
+        os.replace(self._tmp_path, final_path)
+        shard['bytes'] = os.path.getsize(final_path)
+        self._tar = None
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+        # The data ends the member, padded to whole 512-byte blocks
+        padded = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        return self._tar.offset - padded
+
+    def write(self, image_bytes, ext, record):
+        shard = self.shards[-1] if self.shards else None
+        if shard is None or shard['samples'] >= self.max_samples or self._tar.offset >= self.max_bytes:
+            self._close_shard()
+            self._open()
+            shard = self.shards[-1]
+        key = f"{len(self.samples):08d}"
+        json_bytes = dumps(record).encode('utf-8')
+        image_offset = self._add_member(f"{key}{ext}", image_bytes)
+        json_offset = self._add_member(f"{key}.json", json_bytes)
+        self.samples.append([len(self.shards) - 1, key, image_offset, len(image_bytes), json_offset, len(json_bytes)])
+        shard['samples'] += 1
+
+    def close(self, header=None):
+        self._close_shard()
+        index = dict(header or {})
+        index['shards'] = self.shards
+        index['sample_fields'] = ['shard', 'key', 'image_offset', 'image_size', 'json_offset', 'json_size']
+        index['samples'] = self.samples
+        index_path = os.path.join(self.output_dir, self.prefix + INDEX_SUFFIX)
+        save_json(index, index_path)
+        self._remove_stale()
+        return index_path
+
+    def _remove_stale(self):
+        '''Delete <prefix>-NNNNNN.tar files (and leftover .tmp files) the index does not list.'''
+        pattern = re.compile(rf"{re.escape(self.prefix)}-\d{{6}}\.tar(\.tmp)?")
+        current = {shard['name'] for shard in self.shards}
+        for name in os.listdir(self.output_dir):
+            if pattern.fullmatch(name) and name not in current:
+                os.remove(os.path.join(self.output_dir, name))
+
+
+def write_shards(data, image_folder, output_dir, prefix, max_samples=1000, max_bytes=1 << 30, workers=8,
+                 desc="Writing shards"):
+    '''
+    Write every image of a COCO dict with its annotations into tar shards.
+    Missing or unreadable images are skipped and returned as (file_name, error)
+    pairs. Returns (index path, failures).
+    '''
+    index = CocoIndex(data)
+    writer = ShardWriter(output_dir, prefix, max_samples=max_samples, max_bytes=max_bytes)
+    images = {os.path.join(image_folder, img['file_name']): img for img in data['images']}
+    failures = []
+    for path, content in tqdm(_read_ahead(images, workers, window=4 * max(1, workers)), total=len(images), desc=desc):
+        img = images[path]
+        if isinstance(content, Exception):
+            failures.append((img['file_name'], f"{type(content).__name__}: {content}"))
+            continue
+        ext = os.path.splitext(img['file_name'])[1].lower() or '.bin'
+        writer.write(content, ext, {'image': img, 'annotations': index.annotations_for(img['id'])})
+    header = {key: value for key, value in data.items() if key not in ('images', 'annotations')}
+    return writer.close(header), failures
+
+
+class ShardedDataset:
+    '''Random and sequential access to the samples of a shard index.'''
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.root = os.path.dirname(os.path.abspath(index_path))
+        index = load_json(index_path)
+        self.shards = index.pop('shards')
+        self.samples = index.pop('samples')
+        index.pop('sample_fields', None)
+        self.header = index
+        self._files = {}
+
+    def __getstate__(self):
+        # Workers reopen shard files on first use
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _file(self, shard):
+        f = self._files.get(shard)
+        if f is None:
+            f = self._files[shard] = open(os.path.join(self.root, self.shards[shard]['name']), 'rb')
+        return f
+
+    def read(self, idx):
+        '''(image bytes, {"image": ..., "annotations": [...]}) for sample idx.'''
+        shard, _, image_offset, image_size, json_offset, json_size = self.samples[idx]
+        f = self._file(shard)
+        f.seek(image_offset)
+        image_bytes = f.read(image_size)
+        f.seek(json_offset)
+        record = loads(f.read(json_size))
+        return image_bytes, record
+
+    def __getitem__(self, idx):
+        return self.read(idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.read(idx)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
@@ -0,0 +1,156 @@
+'''
+Seeded multi-way dataset splitting.
+
+Images are assigned to any number of named splits by ratio in one vectorized
+pass. Split sizes are allocated by largest remainder: every split gets the
+floor of its share and the images left over go to the splits with the largest
+fractional parts, so 3 images at 70/15/15 become 2/1/0 rather than 3/0/0.
+With stratification each image is labelled with its dominant category and the
+allocation is made within every label group, so rare classes still land in
+every split. Annotations are then partitioned in a single pass with a
+dict lookup from image id to split. A ColumnarCoco is split on its columns
+(ColumnarCoco.select) without building any record.
+'''
+
+from collections import Counter
+
+import numpy as np
+
+from .columnar import ColumnarCoco
+
+
+def _normalized_ratios(ratios):
+    names = list(ratios)
+    weights = np.asarray([ratios[name] for name in names], dtype=np.float64)
+    if len(names) == 0 or np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError(f"Invalid split ratios: {ratios}")
+    return names, weights / weights.sum()
+
+
+def _allocate(sizes, weights):
+    '''
+    Largest-remainder split sizes: a (len(sizes), len(weights)) array whose
+    row g sums to sizes[g]. Leftover images go to the largest fractional
+    parts, ties to the earlier split.
+    '''
+    exact = np.asarray(sizes, dtype=np.float64)[:, None] * weights[None, :]
+    quotas = np.floor(exact).astype(np.int64)
+    leftover = np.asarray(sizes, dtype=np.int64) - quotas.sum(axis=1)
+    order = np.argsort(-(exact - quotas), axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(len(weights))[None, :].repeat(len(quotas), axis=0), axis=1)
+    return quotas + (rank < leftover[:, None])
+
+
+def _columnar_strata(store):
+    ann_image_ids = np.asarray(store.ann_image_id)
+    category_ids = np.asarray(store.ann_category_id).astype(np.int64)
+    image_ids = np.asarray(store.image_id)
+    strata = np.full(len(image_ids), -1, dtype=np.int64)
+    if len(ann_image_ids) == 0:
+        return strata.tolist()
+    # Runs of equal (image, category) pairs, with their size and first annotation row
+    order = np.lexsort((category_ids, ann_image_ids))
+    key_image, key_category = ann_image_ids[order], category_ids[order]
+    starts = np.flatnonzero(np.concatenate(([True], (key_image[1:] != key_image[:-1])
+                                            | (key_category[1:] != key_category[:-1]))))
+    counts = np.diff(np.append(starts, len(order)))
+    first = np.minimum.reduceat(order, starts)
+    # Per image the largest count wins, ties going to the category seen first, as in Counter.most_common
+    best = np.lexsort((first, -counts, key_image[starts]))
+    pair_images = key_image[starts][best]
+    winners = best[np.concatenate(([True], pair_images[1:] != pair_images[:-1]))]
+    winner_images, winner_categories = key_image[starts][winners], key_category[starts][winners]
+    pos = np.minimum(np.searchsorted(winner_images, image_ids), len(winner_images) - 1)
+    found = winner_images[pos] == image_ids
+    strata[found] = winner_categories[pos[found]]
+    return strata.tolist()
+
+
+def image_strata(data):
+    '''Dominant category per image; -1 for images with no annotations.'''
+    if isinstance(data, ColumnarCoco):
+        return _columnar_strata(data)
+    counts = {}
+    for ann in data['annotations']:
+        counts.setdefault(ann['image_id'], Counter())[ann.get('category_id', -1)] += 1
+    strata = []
+    for img in data['images']:
+        image_counts = counts.get(img['id'])
+        # most_common breaks ties by first occurrence, which keeps this deterministic
+        strata.append(image_counts.most_common(1)[0][0] if image_counts else -1)
+    return strata
+
+
+def assign_splits(image_ids, ratios, seed=42, strata=None):
+    '''
+    Assign image ids to named splits.
+
+    ratios: mapping of split name to weight, e.g. {'train': 0.7, 'val': 0.15, 'test': 0.15}
+    strata: optional label per image; ratios are then applied within each label
+    Returns a dict of split name to the list of ids in that split, in input order.
+    '''
+    names, weights = _normalized_ratios(ratios)
+    ids = np.asarray(image_ids)
+    n = len(ids)
+    if n == 0:
+        return {name: [] for name in names}
+
+    if strata is None:
+        codes = np.zeros(n, dtype=np.int64)
+    else:
+        _, codes = np.unique(np.asarray(strata), return_inverse=True)
+        codes = codes.reshape(-1)
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(n)
+
+    # Rank of every image within its stratum after shuffling
+    shuffled_codes = codes[order]
+    grouped = np.argsort(shuffled_codes, kind='stable')
+    group_sizes = np.bincount(shuffled_codes)
+    group_starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[grouped] = np.arange(n) - group_starts[shuffled_codes[grouped]]
+
+    # The first quotas[g, 0] images of stratum g go to the first split, the next quotas[g, 1] to the second, ...
+    bounds = np.cumsum(_allocate(group_sizes, weights), axis=1)
+    split_of = np.empty(n, dtype=np.int64)
+    split_of[order] = (ranks[:, None] >= bounds[shuffled_codes]).sum(axis=1)
+
+    return {name: ids[split_of == k].tolist() for k, name in enumerate(names)}
+
+
+def partition_annotations(annotations, split_ids):
+    '''Partition annotations by the split their image was assigned to.'''
+    split_of = {image_id: name for name, ids in split_ids.items() for image_id in ids}
+    partitioned = {name: [] for name in split_ids}
+    for ann in annotations:
+        name = split_of.get(ann['image_id'])
+        if name is not None:
+            partitioned[name].append(ann)
+    return partitioned
+
+
+def split_coco(data, ratios, seed=42, stratify=False):
+    '''Split a COCO dict into one COCO dict per named split (a ColumnarCoco into one store per split).'''
+    strata = image_strata(data) if stratify else None
+    if isinstance(data, ColumnarCoco):
+        image_ids = np.asarray(data.image_id)
+        split_ids = assign_splits(image_ids, ratios, seed=seed, strata=strata)
+        return {name: data.select(np.flatnonzero(np.isin(image_ids, ids))) for name, ids in split_ids.items()}
+    split_ids = assign_splits([img['id'] for img in data['images']], ratios, seed=seed, strata=strata)
+
+    split_of = {image_id: name for name, ids in split_ids.items() for image_id in ids}
+    images = {name: [] for name in split_ids}
+    for img in data['images']:
+        images[split_of[img['id']]].append(img)
+    annotations = partition_annotations(data['annotations'], split_ids)
+
+    splits = {}
+    for name in split_ids:
+        split = {k: v for k, v in data.items() if k not in ('images', 'annotations')}
+        split['images'] = images[name]
+        split['annotations'] = annotations[name]
+        splits[name] = split
+    return splits
@@ -0,0 +1,280 @@
+'''
+Dataset statistics and validation in one vectorized pass over a columnar store.
+
+compute_stats(store) works on the NumPy columns of json_works.columnar, never
+on per-record dicts, and returns a JSON-ready report:
+
+    summary                  image / annotation / category / polygon counts
+    categories, sources      images and annotations per category and per
+                             source folder
+    histograms               bbox width, height and area, polygon area
+                             (log-spaced bins), annotations per image
+    issues                   count and example ids of
+        duplicate_image_ids, duplicate_annotation_ids
+        orphan_annotations           image_id not in images
+        unknown_categories           category_id not in categories
+        missing_bbox, degenerate_bbox (width or height <= 0)
+        bbox_out_of_bounds           outside the image's width x height
+        odd_length_polygons          a trailing x without its y
+        degenerate_polygons          fewer than 3 points or zero area
+        polygon_out_of_bounds        any vertex outside the image
+        images_without_annotations
+
+Reports are written as JSON or as a self-contained HTML page.
+
+    python -m json_works.stats combined_data/combined_json.json report.json report.html
+'''
+
+import html
+import os
+import sys
+
+import numpy as np
+
+from .columnar import ColumnarCoco, is_columnar
+from .geometry import polygon_areas
+from .json_io import save_json
+
+
+def _histogram(values, bins=20, log=True, integer=False):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if log:
+        values = values[values > 0]
+    if not len(values):
+        return {'edges': [], 'counts': [], 'log': log}
+    lo, hi = values.min(), values.max()
+    if integer and hi - lo < 4 * bins:
+        # One bin per count while that stays readable
+        edges = np.arange(lo, hi + 2)
+    elif lo == hi:
+        edges = np.array([lo, hi])
+    elif log:
+        edges = np.logspace(np.log10(lo), np.log10(hi), bins + 1)
+    else:
+        edges = np.linspace(lo, hi, bins + 1)
+    counts, edges = np.histogram(values, bins=edges)
+    return {'edges': edges.tolist(), 'counts': counts.tolist(), 'log': log}
+
+
+def _describe(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {'min': float(values.min()), 'mean': float(values.mean()), 'median': p50, 'p90': p90, 'p99': p99,
+            'max': float(values.max())}
+
+
+def _duplicates(ids):
+    unique, counts = np.unique(ids, return_counts=True)
+    return unique[counts > 1]
+
+
+def _issue(ids, max_examples):
+    ids = np.asarray(ids)
+    return {'count': int(len(ids)), 'examples': ids[:max_examples].tolist()}
+
+
+def _source_names(file_names, sources):
+    sources = sources or {}
+    # Without a merge manifest the folder part of the file name is the source
+    return [sources.get(name) or os.path.dirname(name) for name in file_names]
+
+
+def compute_stats(store, sources=None, bins=20, max_examples=20):
+    '''
+    Statistics and validation issues of a ColumnarCoco. sources maps file
+    names to source folders (see contact_sheet.sources_from_manifest).
+    '''
+    c = store.columns
+    image_ids, ann_ids = np.asarray(c['image_id']), np.asarray(c['ann_id'])
+    ann_image_ids, ann_category_ids = np.asarray(c['ann_image_id']), np.asarray(c['ann_category_id'])
+    widths = np.asarray(c['image_width'], dtype=np.float64)
+    heights = np.asarray(c['image_height'], dtype=np.float64)
+    bbox = np.asarray(c['ann_bbox'], dtype=np.float64)
+    ann_poly_offsets = np.asarray(c['ann_poly_offsets'])
+    poly_offsets = np.asarray(c['poly_offsets'])
+    coords = np.asarray(c['coords'], dtype=np.float64)
+    num_images, num_annotations = len(image_ids), len(ann_ids)
+    num_polygons = len(poly_offsets) - 1
+
+    # Row of each annotation's image (-1 for orphans); the first row wins for duplicate image ids
+    order = np.argsort(image_ids, kind='stable')
+    sorted_ids = image_ids[order]
+    pos = np.searchsorted(sorted_ids, ann_image_ids)
+    pos = np.minimum(pos, max(len(sorted_ids) - 1, 0))
+    found = (sorted_ids[pos] == ann_image_ids) if num_images else np.zeros(num_annotations, dtype=bool)
+    ann_row = np.where(found, order[pos] if num_images else 0, -1)
+    ann_width = np.where(found, widths[np.maximum(ann_row, 0)] if num_images else np.nan, np.nan)
+    ann_height = np.where(found, heights[np.maximum(ann_row, 0)] if num_images else np.nan, np.nan)
+    ann_width[ann_width < 0] = np.nan
+    ann_height[ann_height < 0] = np.nan
+
+    # Categories
+    categories = store.meta.get('categories', [])
+    category_names = {cat['id']: cat.get('name', str(cat['id'])) for cat in categories}
+    cat_ids, cat_index, cat_counts = np.unique(ann_category_ids, return_inverse=True, return_counts=True)
+    # Distinct (category, image row) pairs as one int64 key; orphans have no image to count
+    pairs = np.unique(cat_index[found].astype(np.int64) * max(num_images, 1) + ann_row[found])
+    image_counts = np.bincount(pairs // max(num_images, 1), minlength=len(cat_ids))
+    category_images = dict(zip(cat_ids.tolist(), image_counts.tolist()))
+    category_rows = [{'id': cat['id'], 'name': cat.get('name', ''), 'annotations': 0, 'images': 0}
+                     for cat in categories]
+    by_id = {row['id']: row for row in category_rows}
+    for cat_id, count in zip(cat_ids.tolist(), cat_counts.tolist()):
+        row = by_id.get(cat_id)
+        if row is None:
+            row = by_id[cat_id] = {'id': cat_id, 'name': None, 'annotations': 0, 'images': 0}
+            category_rows.append(row)
+        row['annotations'] = count
+        row['images'] = category_images.get(cat_id, 0)
+    unknown_category = ~np.isin(ann_category_ids, np.array(list(category_names), dtype=np.int64))
+
+    # Sources
+    source_names = _source_names(store.file_names(), sources)
+    source_keys, image_source = np.unique(np.array(source_names, dtype=str), return_inverse=True) \
+        if num_images else (np.array([], dtype=str), np.array([], dtype=np.int64))
+    source_images = np.bincount(image_source, minlength=len(source_keys))
+    source_annotations = np.bincount(image_source[ann_row[found]], minlength=len(source_keys))
+    source_rows = [{'source': name, 'images': int(n_img), 'annotations': int(n_ann)}
+                   for name, n_img, n_ann in zip(source_keys.tolist(), source_images, source_annotations)]
+
+    # Annotations per image
+    per_image = np.bincount(ann_row[found], minlength=num_images) if num_images else np.zeros(0, dtype=np.int64)
+    empty_images = image_ids[per_image == 0]
+
+    # Boxes
+    missing_bbox = np.isnan(bbox).any(axis=1)
+    bw, bh = bbox[:, 2], bbox[:, 3]
+    degenerate_bbox = ~missing_bbox & ((bw <= 0) | (bh <= 0))
+    with np.errstate(invalid='ignore'):
+        bbox_oob = ~missing_bbox & ((bbox[:, 0] < 0) | (bbox[:, 1] < 0)
+                                    | (bbox[:, 0] + bw > ann_width) | (bbox[:, 1] + bh > ann_height))
+
+    # Polygons: per-polygon lengths and areas, per-coordinate bounds checks
+    poly_lengths = np.diff(poly_offsets)
+    poly_ann = np.repeat(np.arange(num_annotations), np.diff(ann_poly_offsets))
+    odd_polygons = poly_lengths % 2 == 1
+    # polygon_areas pairs coordinates globally, so the dangling x of odd polygons is dropped first
+    even_lengths = poly_lengths - poly_lengths % 2
+    coord_poly = np.repeat(np.arange(num_polygons), poly_lengths)
+    position = np.arange(len(coords)) - poly_offsets[coord_poly] if num_polygons else np.zeros(0, dtype=np.int64)
+    paired = position < even_lengths[coord_poly] if num_polygons else np.zeros(0, dtype=bool)
+    even_offsets = np.concatenate(([0], np.cumsum(even_lengths)))
+    areas = polygon_areas(coords[paired], even_offsets) if num_polygons else np.zeros(0)
+    degenerate_polygons = (poly_lengths < 6) | (areas <= 0)
+    ann_polygon_area = np.bincount(poly_ann, weights=areas, minlength=num_annotations) if num_polygons \
+        else np.zeros(num_annotations)
+    coord_ann = poly_ann[coord_poly] if num_polygons else np.zeros(0, dtype=np.int64)
+    is_y = position % 2 == 1
+    limit = np.where(is_y, ann_height[coord_ann], ann_width[coord_ann]) if len(coords) else np.zeros(0)
+    with np.errstate(invalid='ignore'):
+        coord_oob = (coords < 0) | (coords > limit)
+    polygon_oob = np.zeros(num_annotations, dtype=bool)
+    polygon_oob[coord_ann[coord_oob]] = True
+    polygonal = np.asarray(c['ann_polygonal'], dtype=bool)
+
+    issues = {
+        'duplicate_image_ids': _issue(_duplicates(image_ids), max_examples),
+        'duplicate_annotation_ids': _issue(_duplicates(ann_ids), max_examples),
+        'orphan_annotations': _issue(ann_ids[~found], max_examples),
+        'unknown_categories': _issue(ann_ids[unknown_category], max_examples),
+        'missing_bbox': _issue(ann_ids[missing_bbox], max_examples),
+        'degenerate_bbox': _issue(ann_ids[degenerate_bbox], max_examples),
+        'bbox_out_of_bounds': _issue(ann_ids[bbox_oob], max_examples),
+        'odd_length_polygons': _issue(np.unique(ann_ids[poly_ann[odd_polygons]]), max_examples),
+        'degenerate_polygons': _issue(np.unique(ann_ids[poly_ann[degenerate_polygons]]), max_examples),
+        'polygon_out_of_bounds': _issue(ann_ids[polygon_oob], max_examples),
+        'images_without_annotations': _issue(empty_images, max_examples),
+    }
+    return {
+        'summary': {
+            'images': int(num_images),
+            'annotations': int(num_annotations),
+            'categories': len(categories),
+            'polygons': int(num_polygons),
+            'polygonal_annotations': int(polygonal.sum()),
+            'issues': int(sum(issue['count'] for issue in issues.values())),
+        },
+        'categories': category_rows,
+        'sources': source_rows,
+        'annotations_per_image': {**_describe(per_image), 'histogram': _histogram(per_image, bins, log=False, integer=True)},
+        'histograms': {
+            'bbox_width': _histogram(bw[~missing_bbox], bins),
+            'bbox_height': _histogram(bh[~missing_bbox], bins),
+            'bbox_area': _histogram((bw * bh)[~missing_bbox], bins),
+            'polygon_area': _histogram(ann_polygon_area[polygonal], bins),
+        },
+        'issues': issues,
+    }
+
+
+def load_store(path):
+    '''ColumnarCoco from a columnar store or a COCO JSON file.'''
+    return ColumnarCoco.load(path) if is_columnar(path) else ColumnarCoco.from_json(path)
+
+
+def write_json(report, path):
+    save_json(report, path, indent=2)
+
+
+def _table(headers, rows):
+    head = ''.join(f"<th>{html.escape(str(h))}</th>" for h in headers)
+    body = ''.join('<tr>' + ''.join(f"<td>{html.escape(str(v))}</td>" for v in row) + '</tr>' for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def _bars(histogram):
+    counts, edges = histogram['counts'], histogram['edges']
+    if not counts:
+        return '<p>no values</p>'
+    top = max(counts) or 1
+    rows = []
+    for count, lo, hi in zip(counts, edges, edges[1:]):
+        rows.append(f"<tr><td>{lo:.4g} – {hi:.4g}</td><td>{count}</td>"
+                    f"<td><div class=\"bar\" style=\"width:{300 * count // top}px\"></div></td></tr>")
+    return f"<table>{''.join(rows)}</table>"
+
+
+def write_html(report, path, title="Dataset report"):
+    parts = [f"<h1>{html.escape(title)}</h1>",
+             _table(('', ''), report['summary'].items()),
+             "<h2>Issues</h2>",
+             _table(('check', 'count', 'example ids'),
+                    [(name, issue['count'], ', '.join(map(str, issue['examples'])))
+                     for name, issue in report['issues'].items()]),
+             "<h2>Categories</h2>",
+             _table(('id', 'name', 'annotations', 'images'),
+                    [(row['id'], row['name'], row['annotations'], row['images']) for row in report['categories']]),
+             "<h2>Sources</h2>",
+             _table(('source', 'images', 'annotations'),
+                    [(row['source'], row['images'], row['annotations']) for row in report['sources']]),
+             "<h2>Annotations per image</h2>",
+             _table(('', ''), [(k, v) for k, v in report['annotations_per_image'].items() if k != 'histogram']),
+             _bars(report['annotations_per_image']['histogram'])]
+    for name, histogram in report['histograms'].items():
+        parts += [f"<h2>{html.escape(name.replace('_', ' '))}</h2>", _bars(histogram)]
+    style = ("body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:1em}"
+             "td,th{border:1px solid #ccc;padding:2px 8px;text-align:left}.bar{background:#4a7;height:12px}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>"
+                f"<style>{style}</style></head><body>{''.join(parts)}</body></html>")
+
+
+def issue_summary(report):
+    found = {name: issue['count'] for name, issue in report['issues'].items() if issue['count']}
+    if not found:
+        return f"{report['summary']['images']} images, {report['summary']['annotations']} annotations, no issues"
+    return (f"{report['summary']['images']} images, {report['summary']['annotations']} annotations, issues: "
+            + ', '.join(f"{name} {count}" for name, count in found.items()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.exit("usage: python -m json_works.stats <input .json|.npz|dir> <report.json> [report.html]")
+    report = compute_stats(load_store(sys.argv[1]))
+    write_json(report, sys.argv[2])
+    if len(sys.argv) == 4:
+        write_html(report, sys.argv[3], title=os.path.basename(sys.argv[1]))
+    print(issue_summary(report))
@@ -0,0 +1,216 @@
+'''
+Cut large images into overlapping tiles and remap their annotations.
+
+Tiles are tile_size x tile_size with `overlap` pixels shared between
+neighbours; the last row and column are aligned to the image edge so every
+tile is full size (an image smaller than a tile becomes one tile). Each
+image's annotations go into a GridIndex keyed by bbox, so a tile only looks
+at the annotations in the grid cells it covers. Polygons are clipped to the
+tile with geometry.clip_polygon and shifted into tile coordinates, boxes are
+recomputed from the clipped polygons (or clipped directly when there are
+none), and an object is kept only when at least min_visible of its area lies
+inside the tile.
+
+The COCO output is planned in the main process with ids in image, then tile
+order; cutting runs on the render_images process pool with one task per
+source image, so every image is decoded once however many tiles it yields.
+A tile of image.png at (x, y) is stored as image_x<x>_y<y>.png, and its image
+record keeps source_image_id and the tile offset.
+'''
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from .coco_index import CocoIndex
+from .geometry import clip_polygon, polygon_area, xywh_to_xyxy
+from .journal import file_stamp
+from .render import render_images
+from .verify import image_size
+
+
+def tile_starts(length, tile_size, overlap):
+    '''Start offsets along one axis; the last tile ends at the edge.'''
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError(f"overlap ({overlap}) must be smaller than tile_size ({tile_size})")
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_grid(width, height, tile_size, overlap=0):
+    '''(x0, y0, x1, y1) of every tile, row by row.'''
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in tile_starts(height, tile_size, overlap) for x in tile_starts(width, tile_size, overlap)]
+
+
+class GridIndex:
+    '''Uniform grid over xyxy boxes: query() only tests the boxes in the cells a rectangle covers.'''
+
+    def __init__(self, boxes, cell_size):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = float(cell_size)
+        self.cells = defaultdict(list)
+        cells = np.floor(self.boxes / self.cell_size).astype(np.int64)
+        for k, (cx0, cy0, cx1, cy1) in enumerate(cells.tolist()):
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    self.cells[(cx, cy)].append(k)
+
+    def query(self, x0, y0, x1, y1):
+        '''Indices of the boxes overlapping the rectangle, in insertion order.'''
+        candidates = set()
+        for cy in range(int(y0 // self.cell_size), int(np.ceil(y1 / self.cell_size))):
+            for cx in range(int(x0 // self.cell_size), int(np.ceil(x1 / self.cell_size))):
+                candidates.update(self.cells.get((cx, cy), ()))
+        if not candidates:
+            return []
+        candidates = np.fromiter(sorted(candidates), dtype=np.int64)
+        b = self.boxes[candidates]
+        overlap = (b[:, 0] < x1) & (b[:, 2] > x0) & (b[:, 1] < y1) & (b[:, 3] > y0)
+        return candidates[overlap].tolist()
+
+
+def _polygons(annotation):
+    segmentation = annotation.get('segmentation')
+    if isinstance(segmentation, list):
+        return [poly for poly in segmentation if isinstance(poly, list) and len(poly) >= 6 and len(poly) % 2 == 0]
+    return []
+
+
+def clip_annotation(annotation, tile, min_visible=0.5):
+    '''
+    The annotation cut to tile (x0, y0, x1, y1) in tile coordinates, or None
+    when less than min_visible of its area is inside. Returns a new dict
+    without an id.
+    '''
+    x0, y0, x1, y1 = tile
+    polygons = _polygons(annotation)
+    if polygons:
+        full_area = sum(polygon_area(poly) for poly in polygons)
+        clipped = [clip_polygon(poly, x0, y0, x1, y1) for poly in polygons]
+        clipped = [xy - (x0, y0) for xy in clipped if len(xy) >= 3]
+        area = sum(polygon_area(xy.ravel()) for xy in clipped)
+        if not clipped or area <= 0 or (full_area > 0 and area / full_area < min_visible):
+            return None
+        xy = np.concatenate(clipped)
+        (bx0, by0), (bx1, by1) = xy.min(axis=0), xy.max(axis=0)
+        segmentation = [np.round(poly, 2).ravel().tolist() for poly in clipped]
+    else:
+        bx0, by0, bx1, by1 = xywh_to_xyxy(annotation['bbox'])[0].tolist()
+        full_area = (bx1 - bx0) * (by1 - by0)
+        bx0, by0 = max(bx0, x0) - x0, max(by0, y0) - y0
+        bx1, by1 = min(bx1, x1) - x0, min(by1, y1) - y0
+        area = max(bx1 - bx0, 0) * max(by1 - by0, 0)
+        if area <= 0 or (full_area > 0 and area / full_area < min_visible):
+            return None
+        # Nothing usable to clip; a box-only object stays box-only
+        segmentation = []
+    new_ann = {k: v for k, v in annotation.items() if k != 'id'}
+    new_ann['segmentation'] = segmentation
+    new_ann['bbox'] = [round(float(bx0), 2), round(float(by0), 2), round(float(bx1 - bx0), 2), round(float(by1 - by0), 2)]
+    new_ann['area'] = round(float(area), 2)
+    return new_ann
+
+
+def tile_file_name(file_name, x, y):
+    base_name, ext = os.path.splitext(file_name)
+    return f"{base_name}_x{x}_y{y}{ext}"
+
+
+def cut_tiles(src_path, tiles, output_images_dir):
+    '''Decode src_path once and write every (x0, y0, x1, y1, file_name) crop of it.'''
+    import cv2
+    image = cv2.imread(src_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f"Could not read image {src_path}")
+    for x0, y0, x1, y1, file_name in tiles:
+        output_path = os.path.join(output_images_dir, file_name)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if not cv2.imwrite(output_path, image[y0:y1, x0:x1]):
+            raise OSError(f"Could not write {output_path}")
+
+
+def plan_tiles(data, input_folder, tile_size=1024, overlap=128, min_visible=0.5, keep_empty=True):
+    '''
+    COCO dict of the tiles and the cutting tasks, without touching pixels
+    (image sizes come from the JSON, or the file header when missing).
+    Returns (tiled COCO dict, tasks, source_image_id of every task).
+    '''
+    index = CocoIndex(data)
+    tiled = {key: value for key, value in data.items() if key not in ('images', 'annotations')}
+    tiled['images'], tiled['annotations'] = [], []
+    tasks, task_images = [], []
+    image_id = annotation_id = 1
+    for img in data['images']:
+        src_path = os.path.join(input_folder, img['file_name'])
+        width, height = img.get('width'), img.get('height')
+        if not width or not height:
+            width, height = image_size(src_path)
+        annotations = index.annotations_for(img['id'])
+        boxes = xywh_to_xyxy([ann['bbox'] for ann in annotations]) if annotations else np.zeros((0, 4))
+        grid = GridIndex(boxes, cell_size=max(tile_size - overlap, 1))
+        crops = []
+        for tile in tile_grid(width, height, tile_size, overlap):
+            clipped = [clip_annotation(annotations[k], tile, min_visible) for k in grid.query(*tile)]
+            clipped = [ann for ann in clipped if ann is not None]
+            if not clipped and not keep_empty:
+                continue
+            x0, y0, x1, y1 = tile
+            file_name = tile_file_name(img['file_name'], x0, y0)
+            new_img = {k: v for k, v in img.items() if k not in ('id', 'file_name', 'width', 'height')}
+            new_img.update({'id': image_id, 'file_name': file_name, 'width': x1 - x0, 'height': y1 - y0,
+                            'source_image_id': img['id'], 'tile': [x0, y0]})
+            tiled['images'].append(new_img)
+            for ann in clipped:
+                ann['id'] = annotation_id
+                ann['image_id'] = image_id
+                tiled['annotations'].append(ann)
+                annotation_id += 1
+            crops.append((x0, y0, x1, y1, file_name))
+            image_id += 1
+        if crops:
+            tasks.append((src_path, crops))
+            task_images.append(img['id'])
+    return tiled, tasks, task_images
+
+
+def tile_coco(data, input_folder, output_images_dir, tile_size=1024, overlap=128, min_visible=0.5, keep_empty=True,
+              workers=None, journal=None):
+    '''
+    Cut every image into tiles under output_images_dir. With a Journal, images
+    already cut are skipped. Returns (tiled COCO dict, failures); the tiles of
+    images that failed are left out of the dict.
+    '''
+    os.makedirs(output_images_dir, exist_ok=True)
+    tiled, tasks, task_images = plan_tiles(data, input_folder, tile_size, overlap, min_visible, keep_empty)
+    tasks = [(src_path, crops, output_images_dir) for src_path, crops in tasks]
+
+    def unit_of(task):
+        src_path, crops, _ = task
+        outputs = [os.path.join(output_images_dir, crop[4]) for crop in crops]
+        if not os.path.exists(src_path):
+            return os.path.relpath(src_path, input_folder), outputs, None
+        # The crop list is part of the key: a changed plan (threshold, empty tiles, ...) cuts the image again
+        plan = hashlib.blake2b(json.dumps(crops).encode(), digest_size=8).hexdigest()
+        return os.path.relpath(src_path, input_folder), outputs, f"{file_stamp(src_path)}:{plan}"
+
+    failures = render_images(cut_tiles, tasks, workers=workers, chunksize=1, desc="Cutting tiles",
+                             journal=journal, unit_of=unit_of)
+    # The journal also lists units from earlier runs, so this run's failures are excluded on top
+    failed_paths = {task[0] for task, _ in failures}
+    if journal is not None:
+        done = journal.completed()
+        failed_paths |= {task[0] for task in tasks if unit_of(task)[0] not in done}
+    if failed_paths:
+        failed = {image_id for task, image_id in zip(tasks, task_images) if task[0] in failed_paths}
+        kept = {img['id'] for img in tiled['images'] if img['source_image_id'] not in failed}
+        tiled['images'] = [img for img in tiled['images'] if img['id'] in kept]
+        tiled['annotations'] = [ann for ann in tiled['annotations'] if ann['image_id'] in kept]
+    return tiled, failures
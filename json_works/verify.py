@@ -0,0 +1,136 @@
+'''
+Bulk image verification for COCO datasets.
+
+Existence is checked against one os.scandir per image directory instead of a
+stat per image, and the width/height in the JSON are compared with the image
+header only (PIL reads the size without decoding pixels) on a thread pool.
+Directory listings and probed sizes are cached for the life of the process:
+a listing is reused while the directory's mtime is unchanged, a size while the
+file's size and mtime are, so a second pass over the same data is nearly free.
+A ColumnarCoco is checked from its file name and size columns directly.
+'''
+
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from .columnar import ColumnarCoco
+
+_listings = {}
+_sizes = {}
+
+
+def list_directory(directory):
+    '''Set of file names in directory (empty when it does not exist), from one scandir.'''
+    directory = os.path.abspath(directory)
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return frozenset()
+    cached = _listings.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with os.scandir(directory) as entries:
+        names = frozenset(entry.name for entry in entries if entry.is_file())
+    _listings[directory] = (mtime, names)
+    return names
+
+
+def image_size(path):
+    '''(width, height) read from the image header.'''
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    size = _sizes.get(key)
+    if size is None:
+        from PIL import Image
+        with Image.open(path) as image:
+            size = image.size
+        _sizes[key] = size
+    return size
+
+
+def clear_cache():
+    _listings.clear()
+    _sizes.clear()
+
+
+class VerificationReport:
+    def __init__(self):
+        self.checked = 0
+        self.missing = []
+        self.extra = []
+        self.mismatched = []  # (file_name, (json width, json height), (width, height))
+        self.unreadable = []  # (file_name, error)
+
+    @property
+    def ok(self):
+        return not (self.missing or self.mismatched or self.unreadable)
+
+    def as_dict(self):
+        return {
+            'checked': self.checked,
+            'missing': self.missing,
+            'extra': self.extra,
+            'mismatched': [{'file_name': f, 'json': list(j), 'actual': list(a)} for f, j, a in self.mismatched],
+            'unreadable': [{'file_name': f, 'error': e} for f, e in self.unreadable],
+        }
+
+    def __str__(self):
+        return (f"Checked {self.checked} images: {len(self.missing)} missing, {len(self.extra)} extra, "
+                f"{len(self.mismatched)} with mismatched dimensions, {len(self.unreadable)} unreadable")
+
+
+def _image_entries(data):
+    '''(file_name, width, height) per image; None for a size the JSON does not give.'''
+    if isinstance(data, ColumnarCoco):
+        sizes = zip(data.image_width.tolist(), data.image_height.tolist())
+        return [(file_name, width if width >= 0 else None, height if height >= 0 else None)
+                for file_name, (width, height) in zip(data.file_names(), sizes)]
+    return [(img['file_name'], img.get('width'), img.get('height')) for img in data['images']]
+
+
+def verify_images(data, image_folder, check_dimensions=True, workers=16):
+    '''
+    Check every image of a COCO dict (or ColumnarCoco) against image_folder.
+    `extra` lists files in the scanned directories that no image record
+    refers to.
+    '''
+    report = VerificationReport()
+    entries = _image_entries(data)
+    by_directory = defaultdict(list)
+    for entry in entries:
+        directory, name = os.path.split(entry[0])
+        by_directory[directory].append((name, entry))
+
+    present = []
+    for directory, named in by_directory.items():
+        listing = list_directory(os.path.join(image_folder, directory))
+        referenced = set()
+        for name, entry in named:
+            referenced.add(name)
+            if name in listing:
+                present.append(entry)
+            else:
+                report.missing.append(entry[0])
+        report.extra.extend(os.path.join(directory, name) for name in sorted(listing - referenced))
+    report.checked = len(entries)
+
+    if check_dimensions:
+        to_probe = [entry for entry in present if entry[1] is not None and entry[2] is not None]
+
+        def probe(entry):
+            try:
+                return entry, image_size(os.path.join(image_folder, entry[0])), None
+            except Exception as e:
+                return entry, None, f"{type(e).__name__}: {e}"
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for (file_name, width, height), size, error in tqdm(executor.map(probe, to_probe), total=len(to_probe),
+                                                                desc="Checking image sizes"):
+                if error:
+                    report.unreadable.append((file_name, error))
+                elif size != (width, height):
+                    report.mismatched.append((file_name, (width, height), size))
+    return report
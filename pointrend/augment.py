@@ -1,88 +1,72 @@
 import os
-import json
-import cv2
-import numpy as np
-import albumentations as A
+import sys
 from tqdm import tqdm
 from PIL import Image, ImageDraw, ImageFont
-import shutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import CocoIndex, json_io
+from json_works.columnar import load_coco
+from json_works.geometry import clamp_points
+from json_works.augmentation import AUGMENTATIONS, augment_coco
+from json_works.build_cache import BuildCache
+from json_works.instrument import logger, setup_logging, stage, write_report
+from json_works.journal import Journal
+from json_works.partition import reduce_partials, write_partial
+from json_works.render import render_images, report_failures
 
 def load_json(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
+    # Also loads columnar stores (.npz or directory) written by json_works.columnar
+    return load_coco(file_path)
 
 def save_json(data, file_path):
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=2)
+    json_io.save_json(data, file_path)
 
-def augment_dataset(input_folder, input_annotation, output_folder, split_type):
-    os.makedirs(os.path.join(output_folder, 'images'), exist_ok=True)
-    
-    with open(input_annotation, 'r') as f:
-        annotations = json.load(f)
-    
-    augmentations = {
-        'randbc': A.RandomBrightnessContrast(brightness_limit=0.1, contrast_limit=0.2, p=1),
-        'gaussblur': A.GaussianBlur(blur_limit=(3, 7), p=1)
-    }
-    
-    new_annotations = annotations.copy()
-    new_annotations['images'] = []
-    new_annotations['annotations'] = []
-    image_id = 0
-    annotation_id = 0
-    
-    for img in tqdm(annotations['images'], desc="Processing original images"):
-        src_path = os.path.join(input_folder, img['file_name'])
-        dst_path = os.path.join(output_folder, 'images', img['file_name'])
-        cv2.imwrite(dst_path, cv2.imread(src_path))
-        
-        new_img_info = img.copy()
-        new_img_info['id'] = image_id
-        new_annotations['images'].append(new_img_info)
-        
-        for ann in annotations['annotations']:
-            if ann['image_id'] == img['id']:
-                new_ann = ann.copy()
-                new_ann['id'] = annotation_id
-                new_ann['image_id'] = image_id
-                new_annotations['annotations'].append(new_ann)
-                annotation_id += 1
-        
-        image_id += 1
-    
-    for img in tqdm(annotations['images'], desc="Augmenting images"):
-        img_path = os.path.join(input_folder, img['file_name'])
-        image = cv2.imread(img_path)
-        
-        for aug_name, aug_transform in augmentations.items():
-            augmented = aug_transform(image=image)
-            aug_image = augmented['image']
-            
-            base_name, ext = os.path.splitext(img['file_name'])
-            new_file_name = f"{base_name}_aug_{aug_name}{ext}"
-            
-            output_path = os.path.join(output_folder, 'images', new_file_name)
-            cv2.imwrite(output_path, aug_image)
-            
-            new_img_info = img.copy()
-            new_img_info['id'] = image_id
-            new_img_info['file_name'] = new_file_name
-            new_annotations['images'].append(new_img_info)
-            
-            for ann in annotations['annotations']:
-                if ann['image_id'] == img['id']:
-                    new_ann = ann.copy()
-                    new_ann['id'] = annotation_id
-                    new_ann['image_id'] = image_id
-                    new_annotations['annotations'].append(new_ann)
-                    annotation_id += 1
-            
-            image_id += 1
-    
+def augment_dataset(input_folder, input_annotation, output_folder, split_type, workers=None, seed=42, resume=True,
+                    partition=None, loader_cache=False):
+    annotations = load_json(input_annotation)
+    # A sharded worker only augments its images and leaves a partial manifest for reduce_augment
+    if partition is not None:
+        annotations = partition.select(annotations)
+    
+    # Finished images are journaled; a restarted run skips them and rebuilds the JSON from the journal
+    journal = None
+    if resume:
+        suffix = f'-{partition.suffix}' if partition is not None else ''
+        journal = Journal(os.path.join(output_folder, f'.{split_type}_augment{suffix}.journal'),
+                          settings={'augmentations': AUGMENTATIONS, 'seed': seed})
+    
+    # Originals are copied as-is; each image is decoded once for all variants in AUGMENTATIONS
+    try:
+        new_annotations, failures = augment_coco(annotations, input_folder, os.path.join(output_folder, 'images'),
+                                                 seed=seed, workers=workers, journal=journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    report_failures(failures, action="augment")
+    
+    if partition is not None:
+        write_partial(output_folder, f'{split_type}_augment', partition, items=len(new_annotations['images']),
+                      failures=[(task[0], error) for task, error in failures], data=new_annotations)
+        logger.info("Augmentation of %s complete. Images: %d", partition, len(new_annotations['images']))
+        return
     output_annotation = os.path.join(output_folder, f'{split_type}_split.json')
     save_json(new_annotations, output_annotation)
-    print(f"Augmentation complete. Total images: {len(new_annotations['images'])}")
+    if loader_cache:
+        # Training maps these records instead of parsing the JSON again
+        from json_works.loader_cache import write_loader_cache
+        write_loader_cache(new_annotations, os.path.join(output_folder, 'images'), os.path.join(output_folder, 'loader_cache'))
+    logger.info("Augmentation complete. Total images: %d", len(new_annotations['images']))
+
+def reduce_augment(output_folder, split_type, loader_cache=False):
+    # Stitch the partial manifests of every shard into <split_type>_split.json, renumbered from 0 like a single run
+    output_annotation = os.path.join(output_folder, f'{split_type}_split.json')
+    summary = reduce_partials(output_folder, f'{split_type}_augment', output_annotation)
+    if loader_cache:
+        from json_works.loader_cache import write_loader_cache
+        write_loader_cache(load_json(output_annotation), os.path.join(output_folder, 'images'),
+                           os.path.join(output_folder, 'loader_cache'))
+    logger.info("Augmentation complete. Total images: %s", summary['images'])
+    return summary
 
 def create_folder_structure(base_folder):
     folders = [
@@ -104,11 +88,10 @@ def plot_contours(image_path, annotations, output_path):
     for annotation in annotations:
         points = annotation['segmentation'][0]
         if len(points) % 2 == 0:
-            xy = list(zip(points[0::2], points[1::2]))
-            xy = [(max(0, min(x, image_width)), max(0, min(y, image_height))) for x, y in xy]
+            xy = [tuple(point) for point in clamp_points(points, image_width, image_height).tolist()]
             draw.line(xy + [xy[0]], fill=(255, 0, 0), width=2)
             contour_count += 1
-        print(f"Plotted contour with {len(xy)} points")
+            logger.debug("Plotted contour with %d points", len(xy))
     
     canvas_width = 200
     new_image = Image.new('RGB', (image_width + canvas_width, image_height), color='black')
@@ -122,31 +105,27 @@ def plot_contours(image_path, annotations, output_path):
     text_position = (image_width + (canvas_width - text_width) // 2, (image_height - text_height) // 2)
     draw.text(text_position, text, fill=(255, 255, 255), font=font)
     
-    print(f"Attempting to save image to: {output_path}")
-    try:
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        new_image.save(output_path)
-        print(f'Contours plotted and saved to {output_path}')
-    except Exception as e:
-        print(f"Error saving image: {e}")
+    logger.debug("Attempting to save image to: %s", output_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    new_image.save(output_path)
+    logger.debug("Contours plotted and saved to %s", output_path)
 
-def plot_annotations(data, image_folder, output_folder):
-    image_dict = {img['id']: img for img in data['images']}
-    annotations_by_image_id = {}
-    for ann in data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in annotations_by_image_id:
-            annotations_by_image_id[image_id] = []
-        annotations_by_image_id[image_id].append(ann)
-    
-    for image_id, annotations in tqdm(annotations_by_image_id.items(), desc=f"Plotting annotations for {output_folder}"):
-        img_info = image_dict[image_id]
+def plot_annotations(data, image_folder, output_folder, workers=None, use_cache=True):
+    index = CocoIndex(data)
+    
+    tasks = []
+    for image_id, annotations in index.annotations_by_image.items():
+        img_info = index.image(image_id)
         image_path = os.path.join(image_folder, img_info['file_name'])
         output_path = os.path.join(output_folder, f"annotated_{img_info['file_name']}")
-        plot_contours(image_path, annotations, output_path)
-        print(f"Plotted {len(annotations)} annotations for image {img_info['file_name']}")
+        tasks.append((image_path, annotations, output_path))
+    
+    cache = BuildCache(output_folder) if use_cache else None
+    failures = render_images(plot_contours, tasks, workers=workers, desc=f"Plotting annotations for {output_folder}", cache=cache)
+    report_failures(failures)
 
 def main():
+    setup_logging()
     base_folder = '.'
     create_folder_structure(base_folder)
     
@@ -158,16 +137,20 @@ def main():
     test_input_annotation = os.path.join(base_folder, 'train_test_split/test/test.json')
     test_output_folder = os.path.join(base_folder, 'aug_train_test_split/test')
     
-    augment_dataset(train_input_folder, train_input_annotation, train_output_folder, 'train')
-    augment_dataset(test_input_folder, test_input_annotation, test_output_folder, 'test')
+    with stage('augment_train'):
+        augment_dataset(train_input_folder, train_input_annotation, train_output_folder, 'train')
+    with stage('augment_test'):
+        augment_dataset(test_input_folder, test_input_annotation, test_output_folder, 'test')
     
     train_data = load_json(os.path.join(train_output_folder, 'train_split.json'))
     test_data = load_json(os.path.join(test_output_folder, 'test_split.json'))
     
-    plot_annotations(train_data, os.path.join(base_folder, 'aug_train_test_split/train/images'), os.path.join(base_folder, 'annotation_check/aug_train'))
-    plot_annotations(test_data, os.path.join(base_folder, 'aug_train_test_split/test/images'), os.path.join(base_folder, 'annotation_check/aug_test'))
+    with stage('plot', items=len(train_data['images']) + len(test_data['images'])):
+        plot_annotations(train_data, os.path.join(base_folder, 'aug_train_test_split/train/images'), os.path.join(base_folder, 'annotation_check/aug_train'))
+        plot_annotations(test_data, os.path.join(base_folder, 'aug_train_test_split/test/images'), os.path.join(base_folder, 'annotation_check/aug_test'))
     
-    print("Augmentation and annotation plotting completed successfully!")
+    logger.info("Augmentation and annotation plotting completed successfully!")
+    write_report(os.path.join(base_folder, 'aug_train_test_split/run_report.json'))
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,21 @@
 import os
-import json
 import shutil
+import sys
+from collections import defaultdict
 from tqdm import tqdm
 from PIL import Image, ImageDraw, ImageFont
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import json_io
+from json_works.dedup import DedupIndex
+from json_works.incremental import MergeManifest, source_key
+from json_works.instrument import logger, setup_logging, stage, write_report
+from json_works.json_io import CocoStreamWriter
+from json_works.materialize import MaterializeStats
+from json_works.pipeline import ImageJob, run_pipeline
+from json_works.render import report_failures
+from json_works.verify import verify_images
+
 def plot_contours(image_path, annotations, output_path):
     # Open the image
     image = Image.open(image_path)
@@ -32,16 +44,19 @@ def plot_contours(image_path, annotations, output_path):
     draw.text(text_position, text, fill=(255, 255, 255), font=font)
     
     new_image.save(output_path)
-    print(f'Contours plotted and saved to {output_path}')
+    logger.debug("Contours plotted and saved to %s", output_path)
+
+def remove_outputs(file_names, *folders):
+    for file_name in file_names:
+        for folder in folders:
+            path = os.path.join(folder, file_name)
+            if os.path.lexists(path):
+                os.remove(path)
 
-def process_annotations(root_folder):
-    combined_data = {
-        "images": [],
-        "annotations": [],
-        "categories": [{"id": 1, "name": "biscuit", "supercategory": ""}]
-    }
-    image_id_counter = 1
-    annotation_id_counter = 1
+def process_annotations(root_folder, workers=None, image_mode='hardlink', incremental=True, dedup_policy='remap',
+                        near_duplicates=False):
+    setup_logging()
+    categories = [{"id": 1, "name": "biscuit", "supercategory": ""}]
 
     combined_data_folder = os.path.join(os.path.dirname(root_folder), "combined_data")
     combined_images_folder = os.path.join(combined_data_folder, "images")
@@ -49,72 +64,122 @@ def process_annotations(root_folder):
 
     annotation_check_folder = os.path.join(os.path.dirname(root_folder), "annotation_check")
     os.makedirs(annotation_check_folder, exist_ok=True)
-
-    ignore_images = ["1817_cropped_1437.png", "1039_cropped_1838.png"]
-
-    for folder in tqdm(os.listdir(root_folder)):
-        folder_path = os.path.join(root_folder, folder)
-        if os.path.isdir(folder_path) and "biscuit" in folder:
-            json_path = os.path.join(folder_path, "annotations", "instances_default.json")
-            with open(json_path) as f:
-                data = json.load(f)
-
-            annotation_check_subfolder = os.path.join(annotation_check_folder, folder)
-            os.makedirs(annotation_check_subfolder, exist_ok=True)
-
-            for image_info in tqdm(data['images'], desc=f"Processing images in {folder}"):
-                if image_info['file_name'] in ignore_images:
-                    continue  # Skip ignored images
-
-                image_path = os.path.join(folder_path, "images", image_info['file_name'])
-                if not os.path.exists(image_path):
-                    print(f"Image not found: {image_info['file_name']}")
-                    continue
-
-                annotations = [ann for ann in data['annotations'] if ann['image_id'] == image_info['id']]
-                plot_contours(image_path, annotations, os.path.join(annotation_check_subfolder, image_info['file_name']))
-
-            # Add images and update image IDs
-            for image_info in data['images']:
-                if image_info['file_name'] in ignore_images:
-                    continue  # Skip ignored images
-
-                new_image_info = image_info.copy()
-                old_image_id = image_info['id']
-                new_image_info['id'] = image_id_counter
-                combined_data['images'].append(new_image_info)
-
-                src_image_path = os.path.join(folder_path, "images", image_info['file_name'])
-                dst_image_path = os.path.join(combined_images_folder, image_info['file_name'])
-                shutil.copy(src_image_path, dst_image_path)
-
-                # Update annotations with new image ID
-                for ann in data['annotations']:
-                    if ann['image_id'] == old_image_id:
-                        new_ann = ann.copy()
-                        new_ann['id'] = annotation_id_counter
-                        new_ann['image_id'] = image_id_counter
-                        combined_data['annotations'].append(new_ann)
-                        annotation_id_counter += 1
-
-                image_id_counter += 1
-
-    combined_json_path = os.path.join(combined_data_folder, "combined_json.json")
-    with open(combined_json_path, 'w') as f:
-        json.dump(combined_data, f)
-
     annotation_check_combined = os.path.join(annotation_check_folder, "combined_data")
     os.makedirs(annotation_check_combined, exist_ok=True)
 
-    for image_info in tqdm(combined_data['images'], desc="Plotting combined annotations"):
-        if image_info['file_name'] in ignore_images:
-            continue  # Skip ignored images
+    ignore_images = ["1817_cropped_1437.png", "1039_cropped_1838.png"]
+    copy_stats = MaterializeStats()
 
-        image_path = os.path.join(combined_images_folder, image_info['file_name'])
-        annotations = [ann for ann in combined_data['annotations'] if ann['image_id'] == image_info['id']]
-        plot_contours(image_path, annotations, os.path.join(annotation_check_combined, image_info['file_name']))
+    # The manifest records each folder's content key and id ranges; unchanged
+    # folders are carried over from the previous combined JSON without being
+    # read, copied or plotted again
+    combined_json_path = os.path.join(combined_data_folder, "combined_json.json")
+    manifest = MergeManifest(combined_json_path)
+    if not incremental:
+        manifest.sources = {}
+    settings = {"ignore_images": ignore_images, "categories": categories, "dedup_policy": dedup_policy}
+    folders = sorted(folder for folder in os.listdir(root_folder)
+                     if os.path.isdir(os.path.join(root_folder, folder)) and "biscuit" in folder)
+    with stage("hash_sources", items=len(folders)):
+        keys = {folder: source_key(os.path.join(root_folder, folder, "annotations", "instances_default.json"),
+                                   os.path.join(root_folder, folder, "images"), settings)
+                for folder in folders}
+    plan = manifest.plan(keys)
+    logger.info(plan)
+    # Content hashes are cached across runs; canonical copies of unchanged folders stay valid
+    dedup = DedupIndex(combined_data_folder, policy=dedup_policy, near_duplicates=near_duplicates)
+    dedup.retain(plan.unchanged)
+
+    # Images and annotations are streamed into the combined JSON folder by folder
+    writer = CocoStreamWriter(combined_json_path, header={"categories": categories})
+    with stage("carry_over_unchanged") as s:
+        s.items = manifest.copy_unchanged(writer, plan.unchanged)
+
+    for folder in plan.removed:
+        entry_files = manifest.file_names(folder)
+        manifest.remove(folder)
+        still_used = set().union(*(manifest.file_names(name) for name in manifest.sources))
+        remove_outputs(entry_files - still_used, combined_images_folder, annotation_check_combined)
+        shutil.rmtree(os.path.join(annotation_check_folder, folder), ignore_errors=True)
+        logger.info("Removed %s from the combined data", folder)
+
+    for folder in tqdm(plan.to_merge):
+        folder_path = os.path.join(root_folder, folder)
+        json_path = os.path.join(folder_path, "annotations", "instances_default.json")
+        previous_files = manifest.file_names(folder)
+
+        annotation_check_subfolder = os.path.join(annotation_check_folder, folder)
+        os.makedirs(annotation_check_subfolder, exist_ok=True)
+
+        # Add images and annotations with new IDs, skipping ignored images. Byte-identical
+        # images are stored once and clashing file names get the folder as prefix.
+        # The folder's JSON is streamed; its records are collected on the way for the plots.
+        images, annotations_by_image = [], defaultdict(list)
+
+        def collect(kind, record, merged):
+            if kind == 'image':
+                images.append(record)
+            else:
+                annotations_by_image[record['image_id']].append(record)
+
+        with stage(f"merge_{folder}"):
+            resolver = dedup.source(os.path.join(folder_path, "images"), folder)
+            manifest.merge_source(writer, folder, keys[folder], json_path,
+                                  image_filter=lambda image_info: image_info['file_name'] not in ignore_images,
+                                  resolver=resolver, on_record=collect)
+
+        # One listing per image directory instead of a stat per image
+        missing_images = set(verify_images({'images': images}, os.path.join(folder_path, "images"),
+                                           check_dimensions=False).missing)
+        # Each image is read once: linked into combined_data and plotted from memory.
+        # The combined plot shows the same contours, so it is linked from the folder plot.
+        # Duplicates are still plotted for their folder but not stored again.
+        jobs = []
+        for image_info in images:
+            if image_info['file_name'] in ignore_images:
+                continue  # Skip ignored images
+
+            image_path = os.path.join(folder_path, "images", image_info['file_name'])
+            if image_info['file_name'] in missing_images:
+                logger.warning("Image not found: %s", image_info['file_name'])
+                continue
+
+            annotations = annotations_by_image.get(image_info['id'], [])
+            combined_name = resolver.final_names.get(image_info['file_name'])
+            job = ImageJob(image_path, render_args=(annotations, os.path.join(annotation_check_subfolder, image_info['file_name'])))
+            if combined_name is not None:
+                job.destinations = [os.path.join(combined_images_folder, combined_name)]
+                job.extra_outputs = [os.path.join(annotation_check_combined, combined_name)]
+            jobs.append(job)
+
+        # Outputs of images this folder no longer has
+        dropped = previous_files - manifest.file_names(folder)
+        remove_outputs(dropped, annotation_check_subfolder)
+        still_used = set().union(*(manifest.file_names(name) for name in manifest.sources))
+        remove_outputs(dropped - still_used, combined_images_folder, annotation_check_combined)
+
+        with stage(f"copy_plot_{folder}") as s:
+            stats, failures = run_pipeline(jobs, plot_contours, mode=image_mode, renderers=workers,
+                                           desc=f"Processing images in {folder}")
+            s.items = sum(stats.files.values())
+            s.bytes = stats.bytes_written + stats.bytes_avoided
+        report_failures(failures, action="copy or plot")
+        copy_stats.merge(stats)
+        if failures:
+            # Not recorded as done, so the next run merges this folder again
+            manifest.sources[folder]['key'] = None
+
+    with stage("write_combined_json"):
+        writer.close()
+    manifest.save()
+    dedup.save()
+    logger.info(dedup)
+    json_io.save_json(dedup.report(), os.path.join(combined_data_folder, "dedup_report.json"), indent=2)
+    logger.info(copy_stats)
+    write_report(os.path.join(combined_data_folder, "run_report.json"))
 
 # Ensure the paths are correctly updated to match your environment
 # process_annotations("/path/to/root_folder")
 
-process_annotations("biscuits_data")
+if __name__ == "__main__":
+    process_annotations("biscuits_data")
@@ -1,11 +1,19 @@
 import os
-import json
+import sys
 from PIL import Image, ImageDraw, ImageFont
-from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import CocoIndex
+from json_works.columnar import load_coco
+from json_works.geometry import clamp_points
+from json_works.build_cache import BuildCache
+from json_works.instrument import logger, setup_logging, stage, write_report
+from json_works.partition import write_partial
+from json_works.render import render_images, report_failures
 
 def load_json(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
+    # Also loads columnar stores (.npz or directory) written by json_works.columnar
+    return load_coco(file_path)
 
 def plot_contours(image_path, annotations, output_path):
     image = Image.open(image_path)
@@ -17,11 +25,10 @@ def plot_contours(image_path, annotations, output_path):
     for annotation in annotations:
         points = annotation['segmentation'][0]
         if len(points) % 2 == 0:
-            xy = list(zip(points[0::2], points[1::2]))
-            xy = [(max(0, min(x, image_width)), max(0, min(y, image_height))) for x, y in xy]
+            xy = [tuple(point) for point in clamp_points(points, image_width, image_height).tolist()]
             draw.line(xy + [xy[0]], fill=(255, 0, 0), width=2)
             contour_count += 1
-        print(f"Plotted contour with {len(xy)} points")
+            logger.debug("Plotted contour with %d points", len(xy))
     
     canvas_width = 200
     new_image = Image.new('RGB', (image_width + canvas_width, image_height), color='black')
@@ -35,32 +42,36 @@ def plot_contours(image_path, annotations, output_path):
     text_position = (image_width + (canvas_width - text_width) // 2, (image_height - text_height) // 2)
     draw.text(text_position, text, fill=(255, 255, 255), font=font)
     
-    print(f"Attempting to save image to: {output_path}")
-    try:
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        new_image.save(output_path)
-        print(f'Contours plotted and saved to {output_path}')
-    except Exception as e:
-        print(f"Error saving image: {e}")
+    logger.debug("Attempting to save image to: %s", output_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    new_image.save(output_path)
+    logger.debug("Contours plotted and saved to %s", output_path)
 
-def plot_annotations(data, image_folder, output_folder):
-    image_dict = {img['id']: img for img in data['images']}
-    annotations_by_image_id = {}
-    for ann in data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in annotations_by_image_id:
-            annotations_by_image_id[image_id] = []
-        annotations_by_image_id[image_id].append(ann)
+def plot_annotations(data, image_folder, output_folder, workers=None, use_cache=True, partition=None):
+    index = CocoIndex(data)
     
-    for image_id, annotations in tqdm(annotations_by_image_id.items(), desc=f"Plotting annotations for {output_folder}"):
-        img_info = image_dict[image_id]
+    tasks = []
+    for image_id, annotations in index.annotations_by_image.items():
+        # A sharded worker renders only the images hashed into its shard
+        if partition is not None and not partition.owns(image_id):
+            continue
+        img_info = index.image(image_id)
         image_path = os.path.join(image_folder, img_info['file_name'])
         output_path = os.path.join(output_folder, f"annotated_{img_info['file_name']}")
-        plot_contours(image_path, annotations, output_path)
-        print(f"Plotted {len(annotations)} annotations for image {img_info['file_name']}")
+        tasks.append((image_path, annotations, output_path))
+    
+    cache = BuildCache(output_folder, partition=partition) if use_cache else None
+    failures = render_images(plot_contours, tasks, workers=workers, desc=f"Plotting annotations for {output_folder}", cache=cache)
+    report_failures(failures)
+    if partition is not None:
+        failed = {task[2] for task, _ in failures}
+        write_partial(output_folder, 'plot', partition, items=len(tasks),
+                      outputs=[task[2] for task in tasks if task[2] not in failed],
+                      failures=[(task[0], error) for task, error in failures])
 
 # Example usage:
 def main():
+    setup_logging()
     base_folder = '.'
     
     # Load the JSON data
@@ -79,8 +90,10 @@ def main():
     test_output_folder = os.path.join(base_folder, 'annotation_check/custom_aug_test')
     
     # Plot and save annotated images
-    plot_annotations(train_data, train_input_folder, train_output_folder)
-    plot_annotations(test_data, test_input_folder, test_output_folder)
+    with stage('plot', items=len(train_data['images']) + len(test_data['images'])):
+        plot_annotations(train_data, train_input_folder, train_output_folder)
+        plot_annotations(test_data, test_input_folder, test_output_folder)
+    write_report(os.path.join(base_folder, 'annotation_check/plotting_report.json'))
 
 if __name__ == "__main__":
     main()
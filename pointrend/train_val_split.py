@@ -1,47 +1,47 @@
-import json
 import os
-import shutil
-import random
+import sys
 from tqdm import tqdm
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_works import CocoIndex, json_io
+from json_works.columnar import load_coco
+from json_works.geometry import clamp_points
+from json_works.build_cache import BuildCache
+from json_works.materialize import materialize_files
+from json_works.instrument import logger, setup_logging, stage, write_report
+from json_works.journal import Journal
+from json_works.partition import write_partial
+from json_works.render import render_images, report_failures
+from json_works.shards import write_shards
+from json_works.splits import split_coco
+from json_works import verify as verification
+
 def load_json(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
+    # Also loads columnar stores (.npz or directory) written by json_works.columnar
+    return load_coco(file_path)
 
-def verify_images(data, image_folder):
-    img_not_found = []
-    print("Verifying images...")
-    for image in tqdm(data['images'], desc="Checking images"):
-        if not os.path.exists(os.path.join(image_folder, image['file_name'])):
-            print(f"Image not found: {image['file_name']}")
-            img_not_found.append(image['file_name'])
-    
-    if not img_not_found:
-        print("All images found successfully!")
-    return img_not_found
+def verify_images(data, image_folder, check_dimensions=True):
+    logger.info("Verifying images...")
+    # One directory listing for existence, image headers only for width/height
+    report = verification.verify_images(data, image_folder, check_dimensions=check_dimensions)
+    for file_name in report.missing:
+        logger.warning("Image not found: %s", file_name)
+    for file_name, expected, actual in report.mismatched:
+        logger.warning("Image %s is %sx%s, JSON says %sx%s", file_name, actual[0], actual[1], expected[0], expected[1])
+    for file_name, error in report.unreadable:
+        logger.warning("Could not read image %s: %s", file_name, error)
+    logger.info(report)
+    
+    if not report.missing:
+        logger.info("All images found successfully!")
+    return report.missing
 
-def split_dataset(data, train_ratio=0.8):
-    images = data['images']
-    random.shuffle(images)
-    split_index = int(len(images) * train_ratio)
-    train_images = images[:split_index]
-    test_images = images[split_index:]
-    
-    train_data = {k: v for k, v in data.items() if k != 'images'}
-    test_data = {k: v for k, v in data.items() if k != 'images'}
-    
-    train_data['images'] = train_images
-    test_data['images'] = test_images
-    
-    print("Splitting annotations...")
-    train_data['annotations'] = [ann for ann in tqdm(data['annotations'], desc="Processing train annotations") 
-                                 if ann['image_id'] in [img['id'] for img in train_images]]
-    test_data['annotations'] = [ann for ann in tqdm(data['annotations'], desc="Processing test annotations") 
-                                if ann['image_id'] in [img['id'] for img in test_images]]
-    
-    return train_data, test_data
+def split_dataset(data, train_ratio=0.8, seed=42, stratify=False):
+    logger.info("Splitting annotations...")
+    splits = split_coco(data, {'train': train_ratio, 'test': 1 - train_ratio}, seed=seed, stratify=stratify)
+    return splits['train'], splits['test']
 
 def create_folder_structure():
     folders = [
@@ -54,15 +54,37 @@ def create_folder_structure():
         os.makedirs(folder, exist_ok=True)
 
 def save_json(data, file_path):
-    with open(file_path, 'w') as f:
-        json.dump(data, f)
+    json_io.save_json(data, file_path)
+
+def copy_images(data, src_folder, dest_folder, mode='hardlink', workers=8, resume=True, partition=None):
+    pairs = [
+        (os.path.join(src_folder, image['file_name']), os.path.join(dest_folder, image['file_name']))
+        for image in data['images'] if partition is None or partition.owns(image['id'])
+    ]
+    # The journal sits next to the images folder so it is not listed as an extra image
+    split_folder = os.path.dirname(os.path.abspath(dest_folder))
+    suffix = f'-{partition.suffix}' if partition is not None else ''
+    journal = Journal(os.path.join(split_folder, f'.copy{suffix}.journal'),
+                      settings={'mode': mode}) if resume else None
+    try:
+        stats = materialize_files(pairs, mode=mode, workers=workers, desc=f"Copying images to {dest_folder}",
+                                  journal=journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    logger.info(stats)
+    if partition is not None:
+        write_partial(split_folder, 'copy', partition, items=len(pairs), outputs=[dst for _, dst in pairs])
+    return stats
 
-def copy_images(data, src_folder, dest_folder):
-    for image in tqdm(data['images'], desc=f"Copying images to {dest_folder}"):
-        shutil.copy(
-            os.path.join(src_folder, image['file_name']),
-            os.path.join(dest_folder, image['file_name'])
-        )
+def shard_images(data, src_folder, dest_folder, split_name, shard_size=1000, shard_bytes=1 << 30):
+    # Images and their annotations go into tar shards plus an index instead of loose files
+    index_path, failures = write_shards(data, src_folder, dest_folder, split_name, max_samples=shard_size,
+                                        max_bytes=shard_bytes, desc=f"Writing {split_name} shards")
+    for file_name, error in failures:
+        logger.warning("Could not read image %s: %s", file_name, error)
+    logger.info("%s: %s samples indexed in %s", split_name, len(data['images']) - len(failures), index_path)
+    return len(data['images']) - len(failures)
 
 def plot_contours(image_path, annotations, output_path):
     image = Image.open(image_path)
@@ -74,11 +96,10 @@ def plot_contours(image_path, annotations, output_path):
     for annotation in annotations:
         points = annotation['segmentation'][0]
         if len(points) % 2 == 0:
-            xy = list(zip(points[0::2], points[1::2]))
-            xy = [(max(0, min(x, image_width)), max(0, min(y, image_height))) for x, y in xy]
+            xy = [tuple(point) for point in clamp_points(points, image_width, image_height).tolist()]
             draw.line(xy + [xy[0]], fill=(255, 0, 0), width=2)
             contour_count += 1
-        print(f"Plotted contour with {len(xy)} points")
+            logger.debug("Plotted contour with %d points", len(xy))
     
     # Create a black canvas on the right side
     canvas_width = 200
@@ -94,70 +115,93 @@ def plot_contours(image_path, annotations, output_path):
     text_position = (image_width + (canvas_width - text_width) // 2, (image_height - text_height) // 2)
     draw.text(text_position, text, fill=(255, 255, 255), font=font)
     
-    print(f"Attempting to save image to: {output_path}")
-    try:
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        new_image.save(output_path)
-        print(f'Contours plotted and saved to {output_path}')
-    except Exception as e:
-        print(f"Error saving image: {e}")
+    logger.debug("Attempting to save image to: %s", output_path)
+    # Ensure the directory exists
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    new_image.save(output_path)
+    logger.debug("Contours plotted and saved to %s", output_path)
 
-def plot_annotations(data, image_folder, output_folder):
-    image_dict = {img['id']: img for img in data['images']}
-    annotations_by_image_id = {}
-    for ann in data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in annotations_by_image_id:
-            annotations_by_image_id[image_id] = []
-        annotations_by_image_id[image_id].append(ann)
-    
-    for image_id, annotations in tqdm(annotations_by_image_id.items(), desc=f"Plotting annotations for {output_folder}"):
-        img_info = image_dict[image_id]
+def plot_annotations(data, image_folder, output_folder, workers=None, use_cache=True):
+    index = CocoIndex(data)
+    
+    tasks = []
+    for image_id, annotations in index.annotations_by_image.items():
+        img_info = index.image(image_id)
         image_path = os.path.join(image_folder, img_info['file_name'])
         output_path = os.path.join(output_folder, f"annotated_{img_info['file_name']}")
-        plot_contours(image_path, annotations, output_path)
-        print(f"Plotted {len(annotations)} annotations for image {img_info['file_name']}")
+        tasks.append((image_path, annotations, output_path))
+    
+    cache = BuildCache(output_folder) if use_cache else None
+    failures = render_images(plot_contours, tasks, workers=workers, desc=f"Plotting annotations for {output_folder}", cache=cache)
+    report_failures(failures)
 
-def main():
-    print("Starting image annotation processing...")
+def main(output_format='files', shard_size=1000, loader_cache=False):
+    setup_logging()
+    logger.info("Starting image annotation processing...")
     
     # Load JSON data
-    data = load_json('combined_data/combined_json.json')
-    print("JSON data loaded successfully.")
+    with stage('load') as s:
+        data = load_json('combined_data/combined_json.json')
+        s.items = len(data['images'])
+    logger.info("JSON data loaded successfully.")
     
     # Verify images
-    img_not_found = verify_images(data, 'combined_data/images')
+    with stage('verify', items=len(data['images'])):
+        img_not_found = verify_images(data, 'combined_data/images')
     if img_not_found:
-        print("Missing images:", img_not_found)
+        logger.warning("Missing images: %s", img_not_found)
         return
     
     # Split dataset
-    print("Splitting dataset...")
-    train_data, test_data = split_dataset(data)
-    print("Dataset split completed.")
+    logger.info("Splitting dataset...")
+    with stage('split', items=len(data['images'])):
+        train_data, test_data = split_dataset(data)
+    logger.info("Dataset split completed.")
     
     # Create folder structure
-    print("Creating folder structure...")
+    logger.info("Creating folder structure...")
     create_folder_structure()
     
     # Save split data
-    print("Saving split data...")
-    save_json(train_data, 'train_test_split/train/train.json')
-    save_json(test_data, 'train_test_split/test/test.json')
-    print("Split data saved.")
-    
-    # Copy images
-    print("Copying images...")
-    copy_images(train_data, 'combined_data/images', 'train_test_split/train/images')
-    copy_images(test_data, 'combined_data/images', 'train_test_split/test/images')
+    logger.info("Saving split data...")
+    with stage('save'):
+        save_json(train_data, 'train_test_split/train/train.json')
+        save_json(test_data, 'train_test_split/test/test.json')
+    logger.info("Split data saved.")
+    
+    if output_format == 'shards':
+        logger.info("Writing shards...")
+        with stage('shard') as s:
+            for split_data, split_name in ((train_data, 'train'), (test_data, 'test')):
+                s.items += shard_images(split_data, 'combined_data/images', f'train_test_split/{split_name}/shards',
+                                        split_name, shard_size=shard_size)
+        # No loose copies to plot from, the combined images are the same files
+        train_images = test_images = 'combined_data/images'
+    else:
+        # Copy images
+        logger.info("Copying images...")
+        with stage('copy') as s:
+            for split_data, dest in ((train_data, 'train_test_split/train/images'), (test_data, 'train_test_split/test/images')):
+                stats = copy_images(split_data, 'combined_data/images', dest)
+                s.items += sum(stats.files.values())
+                s.bytes += stats.bytes_written + stats.bytes_avoided
+        train_images, test_images = 'train_test_split/train/images', 'train_test_split/test/images'
+    
+    if loader_cache:
+        # Memory-mapped training records, see json_works.loader_cache
+        from json_works.loader_cache import write_loader_cache
+        with stage('loader_cache'):
+            for split_data, split_name, images in ((train_data, 'train', train_images), (test_data, 'test', test_images)):
+                write_loader_cache(split_data, images, f'train_test_split/{split_name}/loader_cache')
     
     # Plot annotations
-    print("Plotting annotations...")
-    plot_annotations(train_data, 'train_test_split/train/images', 'annotation_check/train')
-    plot_annotations(test_data, 'train_test_split/test/images', 'annotation_check/test')
+    logger.info("Plotting annotations...")
+    with stage('plot', items=len(train_data['images']) + len(test_data['images'])):
+        plot_annotations(train_data, train_images, 'annotation_check/train')
+        plot_annotations(test_data, test_images, 'annotation_check/test')
     
-    print("Processing completed successfully!")
+    logger.info("Processing completed successfully!")
+    write_report('train_test_split/run_report.json')
 
 if __name__ == "__main__":
     main()